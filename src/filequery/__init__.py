@@ -1,19 +1,52 @@
 import argparse
 import json
 import sys
-from typing import List
+from typing import Any, Dict, List, Tuple
 
 import duckdb
 
 from filequery.__version__ import __version__
 from filequery.file_query_args import FileQueryArgs
-from filequery.filedb import FileDb, FileType
+from filequery.filedb import (FILE_EXT_MAP, STDIN_PATH, FileDb, FileType,
+                              sample_clause)
+from filequery.jobs import Job, run_jobs, write_report
+from filequery.jobstatus import JobStatus
+from filequery.loaderrormode import LoadErrorMode
+from filequery.progress import ProgressPrinter
+from filequery.queryhistory import QueryHistory
+from filequery.querylog import DEFAULT_QUERY_LOG_PATH, QueryLog
+from filequery.queryresult import DEFAULT_MAX_ROWS
+from filequery.shards import build_merge_query, query_shards
+from filequery.sources import SourceOptions
+from filequery.statements import get_query_params, split_statements
+from filequery.summarytables import SummaryTable
 from filequery.tui.duckui import DuckUI
 
+# mapping from --out_file_format values to FileType
+OUT_FILE_FORMATS = {
+    "csv": FileType.CSV,
+    "parquet": FileType.PARQUET,
+    "json": FileType.JSON,
+    "ndjson": FileType.NDJSON,
+    "arrow": FileType.ARROW,
+}
+
+# mapping from --on_load_error values to LoadErrorMode
+LOAD_ERROR_MODES = {mode.name.lower(): mode for mode in LoadErrorMode}
+
 
 def parse_arguments(parser: argparse.ArgumentParser) -> FileQueryArgs:
     parser.add_argument(
-        "-f", "--filename", required=False, help="path to a CSV, Parquet or JSON file"
+        "-f",
+        "--filename",
+        required=False,
+        help="path to a CSV, Parquet or JSON file, or - to read from standard input into a table called stdin",
+    )
+    parser.add_argument(
+        "-I",
+        "--input_format",
+        required=False,
+        help="format of standard input or of files without a recognized extension, one of csv, json, ndjson or parquet (not for standard input)",
     )
     parser.add_argument(
         "-d",
@@ -32,13 +65,13 @@ def parse_arguments(parser: argparse.ArgumentParser) -> FileQueryArgs:
         "--out_file",
         nargs="+",
         required=False,
-        help="file to write results to instead of printing to standard output",
+        help="file to write results to instead of printing to standard output, use - to write the output format to standard output",
     )
     parser.add_argument(
         "-F",
         "--out_file_format",
         required=False,
-        help="either csv or parquet, defaults to csv",
+        help="one of csv, json, ndjson, parquet or arrow (Arrow IPC stream), defaults to csv",
     )
     parser.add_argument(
         "-D",
@@ -46,6 +79,109 @@ def parse_arguments(parser: argparse.ArgumentParser) -> FileQueryArgs:
         required=False,
         help="delimiter to use when printing result or writing to CSV file",
     )
+    parser.add_argument(
+        "-n",
+        "--max_rows",
+        type=int,
+        required=False,
+        help=f"maximum number of rows to print in the table format, 0 prints all rows, defaults to {DEFAULT_MAX_ROWS}",
+    )
+    parser.add_argument(
+        "--pager",
+        required=False,
+        help="show results with more than max_rows rows in a pager ($PAGER or less)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stats",
+        required=False,
+        help="print row counts and column statistics (null %%, approximate distinct count, min, max) for each table",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--memory_report",
+        required=False,
+        help="print the estimated size, row count and compression of each table and DuckDB's memory usage once the files are loaded",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--progress",
+        required=False,
+        help="print progress on standard error while files are loaded (files, bytes and rows per second) and while queries run",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--sample",
+        required=False,
+        help="only load a sample of each file for fast, approximate results, either a percentage of rows (e.g. 10%%) or a number of rows (e.g. 10000)",
+    )
+    parser.add_argument(
+        "-p",
+        "--param",
+        type=parse_param,
+        action="append",
+        required=False,
+        help="value for a $name placeholder in the query given as name=value, values are read as JSON if possible and as strings otherwise, can be given more than once",
+    )
+    parser.add_argument(
+        "--order_by",
+        type=parse_table_columns,
+        action="append",
+        required=False,
+        help="sort a table by columns while loading it so filters on them can skip data, given as table=col1,col2, can be given more than once",
+    )
+    parser.add_argument(
+        "--index",
+        type=parse_table_columns,
+        action="append",
+        required=False,
+        help="build an index on columns of a table after loading it for fast point lookups, given as table=col1,col2, can be given more than once",
+    )
+    parser.add_argument(
+        "--database",
+        required=False,
+        help="path to a DuckDB database file to load the files into, summary tables from a config file are kept in it between runs",
+    )
+    parser.add_argument(
+        "--on_load_error",
+        required=False,
+        help="what to do when a file fails to load: fail (the default), skip (load the other files) or quarantine (like skip, and CSV rows that can't be parsed are moved to a load_rejects table)",
+    )
+    parser.add_argument(
+        "--resume",
+        required=False,
+        help="with --database, don't load files again that an earlier run already loaded and that haven't changed since, so an interrupted or partly failed load continues where it stopped",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--shard_dirs",
+        nargs="+",
+        required=False,
+        help="directories to run the query against one at a time in separate processes, the results are merged into the result over all of them",
+    )
+    parser.add_argument(
+        "--shard_workers",
+        type=int,
+        required=False,
+        help="number of shard directories to query at the same time, defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--shard_memory",
+        required=False,
+        help="memory limit for each shard worker, e.g. 4GB",
+    )
+    parser.add_argument(
+        "--merge_query",
+        required=False,
+        help="query that merges the results of the shards, which are in a table called shard_results, by default results are concatenated and sum, count, min and max are aggregated again",
+    )
+    parser.add_argument(
+        "--query_log",
+        nargs="?",
+        const=DEFAULT_QUERY_LOG_PATH,
+        required=False,
+        help=f"append each statement with its timing, rows, bytes written, source file sizes and peak memory to a log that can be queried with filequery, defaults to {DEFAULT_QUERY_LOG_PATH} if no path is given",
+    )
     parser.add_argument(
         "-c", "--config", required=False, help="path to JSON config file"
     )
@@ -65,6 +201,10 @@ def parse_arguments(parser: argparse.ArgumentParser) -> FileQueryArgs:
     if args.config:
         try:
             cli_args = parse_config_file(args.config)
+        except ValueError as e:
+            print("failed to load config file")
+            print(e)
+            sys.exit()
         except:
             print("failed to load config file")
             sys.exit()
@@ -78,11 +218,89 @@ def parse_arguments(parser: argparse.ArgumentParser) -> FileQueryArgs:
             args.out_file_format,
             args.delimiter,
             args.editor,
+            args.max_rows,
+            args.pager,
+            args.stats,
+            args.sample,
+            args.input_format,
+            dict(args.param) if args.param else None,
+            args.database,
+            sources=get_source_options(args.order_by, args.index),
+            shard_dirs=args.shard_dirs,
+            shard_workers=args.shard_workers,
+            shard_memory=args.shard_memory,
+            merge_query=args.merge_query,
+            progress=args.progress,
+            query_log=args.query_log,
+            on_load_error=args.on_load_error,
+            resume=args.resume,
+            memory_report=args.memory_report,
         )
 
     return cli_args
 
 
+def parse_table_columns(value: str) -> Tuple[str, List[str]]:
+    """
+    Parse an --order_by or --index argument of the form table=col1,col2
+
+    :param value: argument to parse
+    :type value: str
+    :raises argparse.ArgumentTypeError: raised if there is no table name or no columns
+    :return: table name and columns
+    :rtype: Tuple[str, List[str]]
+    """
+    table, _, columns = value.partition("=")
+    columns = [col.strip() for col in columns.split(",") if col.strip()]
+
+    if not table or not columns:
+        raise argparse.ArgumentTypeError(f"expected table=col1,col2, got {value!r}")
+
+    return table, columns
+
+
+def get_source_options(
+    order_by: List[Tuple[str, List[str]]], indexes: List[Tuple[str, List[str]]]
+) -> Dict[str, SourceOptions]:
+    """
+    Combine --order_by and --index arguments into options for each table
+
+    :return: mapping from table name to its options, or None if no options were given
+    :rtype: Dict[str, SourceOptions]
+    """
+    sources = {}
+
+    for table, columns in order_by or []:
+        sources.setdefault(table, SourceOptions()).order_by = columns
+
+    for table, columns in indexes or []:
+        sources.setdefault(table, SourceOptions()).indexes.append(columns)
+
+    return sources or None
+
+
+def parse_param(param: str) -> Tuple[str, Any]:
+    """
+    Parse a --param argument of the form name=value. The value is read as JSON so numbers, booleans
+    and null keep their type, anything that isn't valid JSON is used as a string.
+
+    :param param: argument to parse
+    :type param: str
+    :raises argparse.ArgumentTypeError: raised if there is no = or no name
+    :return: parameter name and value
+    :rtype: Tuple[str, Any]
+    """
+    name, sep, value = param.partition("=")
+
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(f"expected name=value, got {param!r}")
+
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
 def parse_config_file(config_file: str):
     args = None
 
@@ -103,58 +321,148 @@ def parse_config_file(config_file: str):
             out_file_format=config.get("out_file_format"),
             delimiter=config.get("delimiter"),
             editor=False,
+            max_rows=config.get("max_rows"),
+            pager=config.get("pager", False),
+            stats=config.get("stats", False),
+            sample=config.get("sample"),
+            input_format=config.get("input_format"),
+            params=config.get("params"),
+            database=config.get("database"),
+            summaries=config.get("summaries"),
+            sources={
+                table: SourceOptions(**options)
+                for table, options in config.get("sources", {}).items()
+            }
+            or None,
+            shard_dirs=config.get("shard_dirs"),
+            shard_workers=config.get("shard_workers"),
+            shard_memory=config.get("shard_memory"),
+            merge_query=config.get("merge_query"),
+            jobs=[parse_job(job) for job in config.get("jobs", [])] or None,
+            report=config.get("report"),
+            max_parallel_jobs=config.get("max_parallel_jobs"),
+            progress=config.get("progress", False),
+            query_log=get_query_log_path(config.get("query_log")),
+            on_load_error=config.get("on_load_error"),
+            resume=config.get("resume", False),
+            memory_report=config.get("memory_report", False),
         )
 
     return args
 
 
+def get_query_log_path(query_log: Any) -> str:
+    # in a config file, the query log can be true to use the default path
+    if query_log is True:
+        return DEFAULT_QUERY_LOG_PATH
+
+    return query_log or None
+
+
+def parse_job(job: Dict[str, Any]) -> Job:
+    """
+    Create a job from its entry in the jobs list of a config file
+
+    :param job: job settings, see Job
+    :type job: Dict[str, Any]
+    :raises ValueError: raised if out_file_format isn't a valid format
+    :return: the job
+    :rtype: Job
+    """
+    out_file_format = job.get("out_file_format", "csv")
+
+    if out_file_format not in OUT_FILE_FORMATS:
+        raise ValueError(f"out_file_format must be one of: {', '.join(OUT_FILE_FORMATS)}")
+
+    return Job(**{**job, "out_file_format": OUT_FILE_FORMATS[out_file_format]})
+
+
 def validate_args(args: FileQueryArgs) -> str:
     err_msg = None
 
+    # the editor reads keyboard input from standard input
+    if args.editor and args.filename == STDIN_PATH:
+        return "the editor can't be used when reading from standard input"
+
+    if args.shard_dirs and (
+        args.filename or args.filesdir or args.database or args.editor
+    ):
+        return "shard_dirs can't be used with filename, filesdir, database or the editor"
+
+    if args.jobs and (args.query or args.query_file or args.shard_dirs):
+        return "you cannot provide jobs along with a query, query_file or shard_dirs"
+
+    if args.shard_dirs and not args.query and not args.query_file:
+        return "you must provide a query to run against shard_dirs"
+
     # if using editor, other args are optional
     if args.editor:
         return err_msg
 
-    if not args.filename and not args.filesdir:
+    if not args.filename and not args.filesdir and not args.shard_dirs:
         err_msg = "you must provide either a file name or a path to a directory containing CSV and/or Parquet files"
 
     if args.filename and args.filesdir:
         err_msg = "you cannot provide both filename and filesdir"
 
-    if not args.query and not args.query_file and not args.editor:
+    if (
+        not args.query
+        and not args.query_file
+        and not args.editor
+        and not args.stats
+        and not args.memory_report
+        and not args.jobs
+    ):
         err_msg = "you must provide either a query or a path to a file with a query"
 
     if args.query and args.query_file:
         err_msg = "you cannot provide both query and query_file"
 
+    if args.input_format and args.input_format not in FILE_EXT_MAP:
+        err_msg = f"input_format must be one of: {', '.join(FILE_EXT_MAP)}"
+
+    if args.filename == STDIN_PATH and not args.input_format:
+        err_msg = "you must provide input_format when reading from standard input"
+
+    if args.sample:
+        try:
+            sample_clause(args.sample)
+        except ValueError as e:
+            err_msg = str(e)
+
+    if args.out_file_format and args.out_file_format not in OUT_FILE_FORMATS:
+        err_msg = f"out_file_format must be one of: {', '.join(OUT_FILE_FORMATS)}"
+
+    if args.on_load_error and args.on_load_error not in LOAD_ERROR_MODES:
+        err_msg = f"on_load_error must be one of: {', '.join(LOAD_ERROR_MODES)}"
+
+    if args.resume and not args.database:
+        err_msg = "resume needs a database to keep track of loaded files"
+
     return err_msg
 
 
 def split_queries(sql: str) -> List[str]:
     """
-    Split semicolon separated SQL to a list
+    Split semicolon separated SQL to a list. Semicolons in strings, quoted identifiers and
+    comments are not treated as separators.
 
     :param sql: SQL to split
     :type sql: str
     :return: List of SQL statements
     :rtype: List[str]
     """
-    queries = sql.split(";")
-
-    if queries[-1].strip() in ("", "\n", "\r", "\t"):
-        queries = queries[:-1]
-
-    return queries
+    return split_statements(sql)
 
 
-def run_sql(fdb: FileDb, queries: List[str]):
-    if len(queries) > 1:
+def run_sql(fdb: FileDb, queries: List[str], params: Dict[str, Any] = None):
+    if len(queries) > 1 and not params:
         query_results = fdb.exec_many_queries(queries)
         for qr in query_results:
             yield qr
     else:
-        query_result = fdb.exec_query(queries[0])
-        yield query_result
+        for query in queries:
+            yield fdb.exec_query(query, get_query_params(query, params))
 
 
 def get_query_list(args: FileQueryArgs) -> List[str]:
@@ -167,29 +475,212 @@ def get_query_list(args: FileQueryArgs) -> List[str]:
     return split_queries(query)
 
 
+def open_query_log(path: str) -> QueryLog:
+    # queries still run if the log can't be written, with a note why they aren't logged
+    if not path:
+        return None
+
+    try:
+        return QueryLog(path)
+    except OSError as e:
+        print(f"query log is disabled: {e}", file=sys.stderr)
+        return None
+
+
+def open_query_history() -> QueryHistory:
+    # the editor works without history, e.g. if the cache directory can't be created
+    try:
+        return QueryHistory()
+    except OSError:
+        return None
+
+
+def handle_jobs(fdb: FileDb, args: FileQueryArgs):
+    progress = fdb.on_progress
+
+    # the progress lines of jobs running at the same time would overwrite each other
+    if args.max_parallel_jobs != 1 and len(args.jobs) > 1:
+        fdb.on_progress = None
+
+    try:
+        results = run_jobs(fdb, args.jobs, args.params, args.max_parallel_jobs)
+    except ValueError as e:
+        print("failed to run jobs")
+        print(e)
+        sys.exit()
+    finally:
+        fdb.on_progress = progress
+
+        # the progress line has to end before the results are printed
+        if progress:
+            progress.finish()
+
+    for result in results:
+        print(result, file=sys.stderr)
+
+    if args.report:
+        write_report(results, args.report)
+
+    # so a scheduler running the pipeline can tell it failed
+    if any(result.status != JobStatus.SUCCEEDED for result in results):
+        sys.exit(1)
+
+
+def handle_sharded_query(args: FileQueryArgs):
+    try:
+        queries = get_query_list(args)
+    except Exception as e:
+        print("failed to read query")
+        print(e)
+        sys.exit()
+
+    if len(queries) != 1:
+        print("only a single query can be run against shard_dirs")
+        sys.exit()
+
+    query = queries[0]
+    query_log = open_query_log(args.query_log)
+
+    try:
+        fdb = query_shards(
+            args.shard_dirs,
+            query,
+            get_query_params(query, args.params),
+            args.shard_workers,
+            args.shard_memory,
+            sample=args.sample,
+            input_format=FILE_EXT_MAP.get(args.input_format),
+            summaries=[
+                SummaryTable(name, summary_query)
+                for name, summary_query in (args.summaries or {}).items()
+            ],
+            source_options=args.sources,
+            query_log=query_log,
+        )
+        merge_query = args.merge_query or build_merge_query(fdb.db, query)
+
+        # the query is logged once for each shard, then the merge query is logged
+        fdb.query_log = query_log
+    except Exception as e:
+        print("failed to query shards")
+        print(e)
+        sys.exit()
+
+    if args.sample:
+        print(
+            f"note: results are based on a sample ({args.sample}) of each file",
+            file=sys.stderr,
+        )
+
+    if args.out_file:
+        if len(args.out_file) != 1:
+            print("number of queries and output files do not match")
+            sys.exit()
+
+        fdb.export_query(
+            merge_query,
+            args.out_file[0],
+            OUT_FILE_FORMATS.get(args.out_file_format, FileType.CSV),
+            delimiter=args.delimiter if args.delimiter else ",",
+        )
+    else:
+        max_rows = args.max_rows if args.max_rows is not None else DEFAULT_MAX_ROWS
+        fdb.exec_query(merge_query).format_as_table(
+            args.delimiter, max_rows, args.pager
+        )
+
+
 # determines what to do based on arguments provided
 # having this separate from fq_cli_handler() makes unit testing easier
 def handle_args(args: FileQueryArgs):
     # if using editor and no files specified, run DuckUI with an empty database
     if args.editor and not args.filename and not args.filesdir:
-        ui = DuckUI(conn=duckdb.connect(":memory:"))
+        ui = DuckUI(
+            conn=duckdb.connect(":memory:"),
+            history=open_query_history(),
+            query_log=open_query_log(args.query_log),
+        )
         ui.run()
         return
 
+    if args.shard_dirs:
+        handle_sharded_query(args)
+        return
+
+    progress = ProgressPrinter() if args.progress else None
+
     try:
         filepath = args.filename if args.filename else args.filesdir
-        fdb = FileDb(filepath)
+        fdb = FileDb(
+            filepath,
+            sample=args.sample,
+            input_format=FILE_EXT_MAP.get(args.input_format),
+            database=args.database,
+            summaries=[
+                SummaryTable(name, query)
+                for name, query in (args.summaries or {}).items()
+            ],
+            source_options=args.sources,
+            on_progress=progress,
+            query_log=open_query_log(args.query_log),
+            on_load_error=LOAD_ERROR_MODES.get(args.on_load_error, LoadErrorMode.FAIL),
+            resume=args.resume,
+        )
     except Exception as e:
         print("failed to load files")
         print(e)
         sys.exit()
+    finally:
+        if progress:
+            progress.finish()
+
+    # files that were skipped, the others were loaded and can be queried
+    for load_error in fdb.load_errors():
+        print(load_error, file=sys.stderr)
+
+    # report how long sorting and indexing took, so the cost can be weighed against faster queries
+    if args.sources:
+        for load_stats in fdb.load_stats():
+            if load_stats.table in args.sources:
+                print(load_stats, file=sys.stderr)
 
     # if editor mode, run the editor and return afterwards
     if args.editor:
-        ui = DuckUI(conn=fdb.db)
+        ui = DuckUI(
+            conn=fdb.db,
+            sample=args.sample,
+            history=open_query_history(),
+            query_log=fdb.query_log,
+            sources=fdb.source_files(),
+            load_time=fdb.load_time,
+        )
         ui.run()
         return
 
+    # use stderr so the note doesn't end up in piped output
+    if args.sample:
+        print(
+            f"note: results are based on a sample ({args.sample}) of each file",
+            file=sys.stderr,
+        )
+
+    if args.stats:
+        for table_stats in fdb.all_table_stats():
+            table_stats.format_as_table()
+
+    if args.memory_report:
+        fdb.memory_report().format_as_table()
+
+    # stats and the memory report can be printed on their own or before running queries
+    if (args.stats or args.memory_report) and not (
+        args.query or args.query_file or args.jobs
+    ):
+        return
+
+    if args.jobs:
+        handle_jobs(fdb, args)
+        return
+
     try:
         queries = get_query_list(args)
     except Exception as e:
@@ -202,18 +693,29 @@ def handle_args(args: FileQueryArgs):
             print("number of queries and output files do not match")
             sys.exit()
 
-        outfile_type = (
-            FileType.PARQUET if args.out_file_format == "parquet" else FileType.CSV
-        )
+        outfile_type = OUT_FILE_FORMATS.get(args.out_file_format, FileType.CSV)
 
         for i in range(len(queries)):
             delimiter = args.delimiter if args.delimiter else ","
             fdb.export_query(
-                queries[i], args.out_file[i], outfile_type, delimiter=delimiter
+                queries[i],
+                args.out_file[i],
+                outfile_type,
+                get_query_params(queries[i], args.params),
+                delimiter=delimiter,
             )
+
+            if progress:
+                progress.finish()
     else:
-        for query_result in run_sql(fdb, queries):
-            query_result.format_as_table(args.delimiter)
+        max_rows = args.max_rows if args.max_rows is not None else DEFAULT_MAX_ROWS
+
+        for query_result in run_sql(fdb, queries, args.params):
+            # the progress line has to end before the result is printed
+            if progress:
+                progress.finish()
+
+            query_result.format_as_table(args.delimiter, max_rows, args.pager)
 
 
 def fq_cli_handler():
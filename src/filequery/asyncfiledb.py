@@ -0,0 +1,301 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Dict, List, Union
+
+import duckdb
+
+from .batchformat import BatchFormat
+from .filedb import DEFAULT_BATCH_SIZE, FileDb, QueryParams
+from .filetype import FileType
+from .queryresult import QueryResult
+
+# default number of queries that can run at the same time
+DEFAULT_MAX_WORKERS = 4
+
+
+class _QueryCall:
+    """
+    Cursor a query runs on, checked out of the database's cursor pool by the worker thread, so the
+    query can be interrupted from the event loop. Once interrupted, a query that hasn't started yet
+    doesn't run at all.
+    """
+
+    def __init__(self, fdb: FileDb):
+        self._fdb = fdb
+        self._lock = threading.Lock()
+        self._cur: duckdb.DuckDBPyConnection = None
+        self.interrupted = False
+
+    def run(self, func: Callable, *args) -> Any:
+        """
+        Call func with the cursor and args, checking out a cursor first if this call doesn't have one yet
+        """
+        if self._cur is None:
+            # may wait for a cursor, so outside the lock to not block interrupt()
+            cur = self._fdb.acquire_cursor()
+
+            with self._lock:
+                self._cur = cur
+
+        with self._lock:
+            if self.interrupted:
+                raise duckdb.InterruptException("query was interrupted before it started")
+
+        return func(self._cur, *args)
+
+    def release(self):
+        """
+        Return the cursor to the pool
+        """
+        with self._lock:
+            cur, self._cur = self._cur, None
+
+        if cur is not None:
+            self._fdb.release_cursor(cur)
+
+    def interrupt(self):
+        """
+        Interrupt the query if it's running and keep it from starting if it isn't
+        """
+        with self._lock:
+            self.interrupted = True
+
+            # a cursor is only released after it's cleared here, so it's never closed or reused yet
+            if self._cur is not None:
+                self._cur.interrupt()
+
+
+class AsyncFileDb:
+    def __init__(self, fdb: FileDb, max_workers: int = DEFAULT_MAX_WORKERS):
+        """
+        AsyncFileDb constructor. Queries run on a bounded pool of worker threads, each on a cursor from
+        the database's cursor pool, so awaiting them doesn't block the event loop and many tasks can
+        share one database. Use AsyncFileDb.open() to also load the files without blocking the event loop.
+
+        :param fdb: database to run queries against, it isn't closed by close()
+        :type fdb: FileDb
+        :param max_workers: maximum number of queries to run at the same time, defaults to DEFAULT_MAX_WORKERS
+        :type max_workers: int, optional
+        """
+        self.fdb = fdb
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="filequery"
+        )
+
+        # whether close() also closes fdb, for databases created by open()
+        self._owns_fdb = False
+
+    @classmethod
+    async def open(
+        cls,
+        filepath: Union[str, List[str]] = None,
+        tables: Dict[str, Any] = None,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        **kwargs,
+    ) -> "AsyncFileDb":
+        """
+        Create a FileDb in a worker thread and wrap it in an AsyncFileDb, see FileDb() for the arguments.
+        The FileDb is closed along with the AsyncFileDb.
+
+        :return: database ready for queries
+        :rtype: AsyncFileDb
+        """
+        loop = asyncio.get_running_loop()
+        fdb = await loop.run_in_executor(
+            None, functools.partial(FileDb, filepath, tables, **kwargs)
+        )
+
+        adb = cls(fdb, max_workers)
+        adb._owns_fdb = True
+
+        return adb
+
+    async def _run(
+        self,
+        call: _QueryCall,
+        func: Callable,
+        *args,
+        timeout: float = None,
+    ) -> Any:
+        """
+        Run func in the worker pool. If it doesn't finish within timeout seconds, the query of call is
+        interrupted, or dropped if it's still waiting for a worker, and asyncio.TimeoutError is raised.
+
+        :param call: call func runs its query in
+        :type call: _QueryCall
+        :param func: function to run
+        :type func: Callable
+        :param timeout: seconds to wait for func, defaults to None (no timeout)
+        :type timeout: float, optional
+        :raises asyncio.TimeoutError: raised if func doesn't finish within timeout seconds
+        :return: return value of func
+        :rtype: Any
+        """
+        future = self._executor.submit(func, *args)
+        waiter = asyncio.wrap_future(future)
+
+        try:
+            done, _ = await asyncio.wait({waiter}, timeout=timeout)
+        except asyncio.CancelledError:
+            call.interrupt()
+            future.cancel()
+            # nobody is waiting for the result anymore, retrieve it so it isn't reported as unhandled
+            waiter.add_done_callback(lambda f: f.cancelled() or f.exception())
+            raise
+
+        if not done:
+            call.interrupt()
+
+            # a query still queued never starts, a running one is waited for so its cursor is released
+            if not future.cancel():
+                await asyncio.wait({waiter})
+                waiter.exception()
+
+            raise asyncio.TimeoutError(
+                f"query did not finish within {timeout} seconds"
+            )
+
+        return waiter.result()
+
+    async def exec_query(
+        self, query: str, params: QueryParams = None, timeout: float = None
+    ) -> QueryResult:
+        """
+        Executes a query, see FileDb.exec_query(). The query is logged and reports progress like it
+        does with FileDb.exec_query()
+
+        :param query: query to execute
+        :type query: str
+        :param params: values to bind to the query's placeholders, defaults to None
+        :type params: QueryParams, optional
+        :param timeout: seconds before the query is interrupted, defaults to None (no timeout)
+        :type timeout: float, optional
+        :return: result of executing the query
+        :rtype: QueryResult
+        """
+        call = _QueryCall(self.fdb)
+
+        def run():
+            try:
+                return call.run(self.fdb._exec_query_on, query, params)
+            finally:
+                call.release()
+
+        return await self._run(call, run, timeout=timeout)
+
+    async def export_query(
+        self,
+        query: str,
+        output_filepath: str,
+        filetype: int = FileType.CSV,
+        params: QueryParams = None,
+        timeout: float = None,
+        **kwargs,
+    ):
+        """
+        Writes query result to a file, see FileDb.export_query()
+
+        :param query: query to execute
+        :type query: str
+        :param output_filepath: path to output file
+        :type output_filepath: str
+        :param filetype: output file format, defaults to FileType.CSV
+        :type filetype: FileType
+        :param params: values to bind to the query's placeholders, defaults to None
+        :type params: QueryParams, optional
+        :param timeout: seconds before the query is interrupted, defaults to None (no timeout)
+        :type timeout: float, optional
+        """
+        call = _QueryCall(self.fdb)
+
+        def run():
+            try:
+                call.run(
+                    self.fdb._export_query_on,
+                    query,
+                    output_filepath,
+                    filetype,
+                    params,
+                    **kwargs,
+                )
+            finally:
+                call.release()
+
+        await self._run(call, run, timeout=timeout)
+
+    async def iter_query(
+        self,
+        query: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_format: BatchFormat = BatchFormat.ROWS,
+        params: QueryParams = None,
+        timeout: float = None,
+    ) -> AsyncIterator[Any]:
+        """
+        Executes a query and yields the result in batches, see FileDb.iter_query(). A worker thread is
+        only used while a batch is being fetched, not while the consumer handles it.
+
+        :param query: query to execute
+        :type query: str
+        :param batch_size: maximum number of rows per batch, defaults to DEFAULT_BATCH_SIZE
+        :type batch_size: int
+        :param batch_format: type of batch to yield, defaults to BatchFormat.ROWS
+        :type batch_format: BatchFormat
+        :param params: values to bind to the query's placeholders, defaults to None
+        :type params: QueryParams, optional
+        :param timeout: seconds to wait for each batch before the query is interrupted, defaults to None (no timeout)
+        :type timeout: float, optional
+        :return: async iterator over batches of the query result
+        :rtype: AsyncIterator[Any]
+        """
+        call = _QueryCall(self.fdb)
+        batches = None
+
+        def close():
+            if batches is not None:
+                batches.close()
+
+            call.release()
+
+        try:
+            batches = await self._run(
+                call,
+                call.run,
+                self.fdb._start_query_on,
+                query,
+                batch_size,
+                batch_format,
+                params,
+                timeout=timeout,
+            )
+
+            while True:
+                batch = await self._run(
+                    call, call.run, lambda _: next(batches, None), timeout=timeout
+                )
+
+                if batch is None:
+                    break
+
+                yield batch
+        finally:
+            await asyncio.get_running_loop().run_in_executor(self._executor, close)
+
+    async def close(self):
+        """
+        Wait for running queries to finish and shut down the worker pool, closing the database too if it
+        was created by open()
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+
+        if self._owns_fdb:
+            await loop.run_in_executor(None, self.fdb.close)
+
+    async def __aenter__(self) -> "AsyncFileDb":
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
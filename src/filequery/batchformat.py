@@ -0,0 +1,7 @@
+from enum import Enum
+
+
+class BatchFormat(Enum):
+    ROWS = 0
+    ARROW = 1
+    NUMPY = 2
@@ -0,0 +1,359 @@
+import re
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+import duckdb
+
+from .completionkind import CompletionKind
+
+# default maximum number of completions to return
+DEFAULT_COMPLETION_LIMIT = 50
+
+# number of names above which adding them to the index sorts it again instead of inserting each one
+BULK_ADD_THRESHOLD = 100
+
+# tables and aliases in FROM and JOIN clauses, e.g. "from orders o" or "join \"my data\" as d"
+_TABLE_ALIAS_REGEX = re.compile(
+    r'\b(?:from|join)\s+("(?:""|[^"])+"|[A-Za-z_][\w$]*)(?:\s+(?:as\s+)?([A-Za-z_][\w$]*))?',
+    re.IGNORECASE,
+)
+
+# identifiers that don't need to be quoted when inserted into a query
+_PLAIN_IDENTIFIER_REGEX = re.compile(r"^[a-z_][a-z0-9_$]*$")
+
+
+class Completion(NamedTuple):
+    text: str
+    kind: CompletionKind
+    detail: str
+
+
+def _sort_key(completion: Completion) -> Tuple[str, int, str]:
+    return completion.text.lower(), completion.kind.value, completion.text
+
+
+def _unquote(name: str) -> str:
+    if name.startswith('"') and name.endswith('"'):
+        return name[1:-1].replace('""', '"')
+
+    return name
+
+
+def find_aliases(sql: str) -> Dict[str, str]:
+    """
+    Find the tables a statement reads from in its FROM and JOIN clauses, along with their aliases.
+    This is a pattern match rather than a parse, so it also works on incomplete statements.
+
+    :param sql: statement to look through
+    :type sql: str
+    :return: mapping from alias (or table name, if there is no alias) to table name, keys are lowercase
+    :rtype: Dict[str, str]
+    """
+    aliases = {}
+
+    for match in _TABLE_ALIAS_REGEX.finditer(sql):
+        table = _unquote(match.group(1))
+        aliases[table.lower()] = table
+
+        if match.group(2):
+            aliases[match.group(2).lower()] = table
+
+    return aliases
+
+
+def format_identifier(name: str) -> str:
+    """
+    Quote a table or column name if it can't be used as is
+
+    :param name: table or column name
+    :type name: str
+    :return: name to insert into a query
+    :rtype: str
+    """
+    if _PLAIN_IDENTIFIER_REGEX.match(name):
+        return name
+
+    escaped = name.replace('"', '""')
+    return f'"{escaped}"'
+
+
+class CompletionIndex:
+    """
+    In-memory index of table names, column names, functions and keywords for completing SQL as it is
+    typed. Names are kept in a sorted list so prefix lookups are a binary search. Fuzzy lookups run a
+    single regular expression over all names joined into one string, which keeps the scan in C even
+    with tens of thousands of columns.
+    """
+
+    def __init__(self):
+        # sorted by _sort_key
+        self._entries: List[Tuple[Tuple[str, int, str], Completion]] = []
+
+        # mapping from table name to its columns as (name, type), and a hash of them to tell when a table changes
+        self._tables: Dict[str, List[Tuple[str, str]]] = {}
+        self._table_hashes: Dict[str, int] = {}
+
+        # number of tables each column name is in, a column name has a single entry however many tables have it
+        self._column_counts: Dict[str, int] = {}
+        self._functions: Set[str] = set()
+
+        # names joined by newlines for fuzzy matching, built when first needed after a change
+        self._haystack: Optional[str] = None
+        self._line_starts: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _add(self, completion: Completion):
+        key = _sort_key(completion)
+        idx = bisect_left(self._entries, (key,))
+
+        # keys are unique, and comparing two entries with the same key would compare the completions
+        if idx < len(self._entries) and self._entries[idx][0] == key:
+            return
+
+        self._entries.insert(idx, (key, completion))
+        self._haystack = None
+
+    def _add_all(self, completions: List[Completion]):
+        # inserting one at a time shifts the list on every insert, so for many names it's cheaper to sort once
+        if len(completions) < BULK_ADD_THRESHOLD:
+            for completion in completions:
+                self._add(completion)
+
+            return
+
+        entries = dict(self._entries)
+
+        for completion in completions:
+            entries.setdefault(_sort_key(completion), completion)
+
+        self._entries = sorted(entries.items(), key=lambda entry: entry[0])
+        self._haystack = None
+
+    def _remove(self, completion: Completion):
+        key = _sort_key(completion)
+        idx = bisect_left(self._entries, (key,))
+
+        if idx < len(self._entries) and self._entries[idx][0] == key:
+            del self._entries[idx]
+            self._haystack = None
+
+    def build(self, con: duckdb.DuckDBPyConnection):
+        """
+        Load keywords, functions, tables and columns from the database
+
+        :param con: connection to read the catalog from
+        :type con: duckdb.DuckDBPyConnection
+        """
+        con.execute("select keyword_name from duckdb_keywords()")
+        self._add_all(
+            [
+                Completion(rec[0].lower(), CompletionKind.KEYWORD, "keyword")
+                for rec in con.fetchall()
+            ]
+        )
+
+        self.refresh(con)
+
+    def refresh(self, con: duckdb.DuckDBPyConnection) -> Set[str]:
+        """
+        Update the index after the catalog changed, e.g. after a CREATE, DROP or ALTER statement.
+        Only tables that were created, dropped or changed are read from the catalog again.
+
+        :param con: connection to read the catalog from
+        :type con: duckdb.DuckDBPyConnection
+        :return: names of the tables that were added, removed or updated
+        :rtype: Set[str]
+        """
+        con.execute(
+            """
+            select table_name, hash(list(column_name || ' ' || data_type order by column_index))
+            from duckdb_columns()
+            where not internal
+            group by table_name
+            """
+        )
+        hashes = dict(con.fetchall())
+
+        removed = set(self._table_hashes) - set(hashes)
+        changed = {
+            table
+            for table, table_hash in hashes.items()
+            if self._table_hashes.get(table) != table_hash
+        }
+
+        for table in removed | changed:
+            self._remove_table(table)
+
+        added: List[Completion] = []
+
+        if changed:
+            # when building the index, every table has changed and there's no need to filter
+            table_filter = "" if changed == set(hashes) else "and list_contains(?, table_name)"
+            con.execute(
+                f"""
+                select table_name, column_name, data_type
+                from duckdb_columns()
+                where not internal {table_filter}
+                order by table_name, column_index
+                """,
+                [sorted(changed)] if table_filter else None,
+            )
+            columns: Dict[str, List[Tuple[str, str]]] = {}
+
+            for table, column, data_type in con.fetchall():
+                columns.setdefault(table, []).append((column, data_type))
+
+            for table, table_columns in columns.items():
+                added += self._add_table(table, table_columns, hashes[table])
+
+        # builtin functions don't change, but macros can be created and dropped
+        con.execute("select distinct function_name from duckdb_functions()")
+        functions = {rec[0] for rec in con.fetchall()}
+
+        for name in self._functions - functions:
+            self._remove(Completion(name, CompletionKind.FUNCTION, "function"))
+
+        added += [
+            Completion(name, CompletionKind.FUNCTION, "function")
+            for name in functions - self._functions
+        ]
+        self._add_all(added)
+        self._functions = functions
+
+        return removed | changed
+
+    def _add_table(
+        self, table: str, columns: List[Tuple[str, str]], table_hash: int
+    ) -> List[Completion]:
+        # returns the completions to add for the table, names of columns already in another table are left out
+        self._tables[table] = columns
+        self._table_hashes[table] = table_hash
+        completions = [Completion(table, CompletionKind.TABLE, "table")]
+
+        for column, _ in columns:
+            count = self._column_counts.get(column, 0)
+            self._column_counts[column] = count + 1
+
+            if count == 0:
+                completions.append(Completion(column, CompletionKind.COLUMN, "column"))
+
+        return completions
+
+    def _remove_table(self, table: str):
+        columns = self._tables.pop(table, None)
+        self._table_hashes.pop(table, None)
+
+        if columns is None:
+            return
+
+        self._remove(Completion(table, CompletionKind.TABLE, "table"))
+
+        for column, _ in columns:
+            count = self._column_counts[column] - 1
+
+            if count == 0:
+                del self._column_counts[column]
+                self._remove(Completion(column, CompletionKind.COLUMN, "column"))
+            else:
+                self._column_counts[column] = count
+
+    def columns(self, table: str) -> List[Tuple[str, str]]:
+        """
+        Get the columns of a table
+
+        :param table: table name
+        :type table: str
+        :return: list of (column name, type), empty if the table isn't known
+        :rtype: List[Tuple[str, str]]
+        """
+        return self._tables.get(table, [])
+
+    def _get_haystack(self) -> str:
+        if self._haystack is None:
+            # a newline in a name would split it into two lines, replacing it keeps the offsets the same
+            names = [key[0].replace("\n", " ") for key, _ in self._entries]
+            self._haystack = "\n".join(names)
+            self._line_starts = []
+            pos = 0
+
+            for name in names:
+                self._line_starts.append(pos)
+                pos += len(name) + 1
+
+        return self._haystack
+
+    def _fuzzy(self, prefix: str, limit: int, exclude: Set[Completion]) -> List[Completion]:
+        # each character of the prefix has to appear in order, ranked by how close together they are
+        pattern = "[^\n]*?".join(re.escape(char) for char in prefix)
+        regex = re.compile(f"^[^\n]*?({pattern})", re.MULTILINE)
+        haystack = self._get_haystack()
+        matches = []
+
+        for match in regex.finditer(haystack):
+            idx = bisect_right(self._line_starts, match.start()) - 1
+            completion = self._entries[idx][1]
+
+            if completion not in exclude:
+                span = match.end(1) - match.start(1)
+                matches.append((span, _sort_key(completion)[1:], completion))
+
+        matches.sort(key=lambda match: match[:2] + (len(match[2].text),))
+
+        return [match[2] for match in matches[:limit]]
+
+    def complete(
+        self,
+        prefix: str,
+        qualifier: str = None,
+        aliases: Dict[str, str] = None,
+        limit: int = DEFAULT_COMPLETION_LIMIT,
+    ) -> List[Completion]:
+        """
+        Find completions for a partially typed name. Names starting with prefix come first, followed
+        by fuzzy matches, names that contain the characters of prefix in order.
+
+        :param prefix: the partially typed name
+        :type prefix: str
+        :param qualifier: table name or alias before a dot, e.g. "o" in "o.cust", only columns of that table are completed, defaults to None
+        :type qualifier: str, optional
+        :param aliases: mapping from lowercase alias to table name used to resolve qualifier, see find_aliases(), defaults to None
+        :type aliases: Dict[str, str], optional
+        :param limit: maximum number of completions, defaults to DEFAULT_COMPLETION_LIMIT
+        :type limit: int, optional
+        :return: completions, best match first
+        :rtype: List[Completion]
+        """
+        lower_prefix = prefix.lower()
+
+        if qualifier is not None:
+            table = _unquote(qualifier)
+            table = (aliases or {}).get(table.lower(), table)
+            columns = [
+                Completion(column, CompletionKind.COLUMN, data_type)
+                for column, data_type in self.columns(table)
+            ]
+            starts = [col for col in columns if col.text.lower().startswith(lower_prefix)]
+            regex = re.compile(".*?".join(re.escape(char) for char in lower_prefix))
+            fuzzy = [
+                col
+                for col in columns
+                if col not in starts and regex.search(col.text.lower())
+            ]
+
+            return (starts + fuzzy)[:limit]
+
+        if not lower_prefix:
+            return []
+
+        start = bisect_left(self._entries, ((lower_prefix,),))
+        end = bisect_left(self._entries, ((lower_prefix + "\uffff",),))
+        matches = [completion for _, completion in self._entries[start:end]]
+        matches.sort(key=lambda completion: (completion.kind.value, len(completion.text)))
+        matches = matches[:limit]
+
+        if len(matches) < limit:
+            matches += self._fuzzy(lower_prefix, limit - len(matches), set(matches))
+
+        return matches
@@ -0,0 +1,9 @@
+from enum import Enum
+
+
+# values are the order completions of each kind are listed in
+class CompletionKind(Enum):
+    COLUMN = 0
+    TABLE = 1
+    FUNCTION = 2
+    KEYWORD = 3
@@ -0,0 +1,180 @@
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Tuple
+
+import duckdb
+
+
+@dataclass
+class CursorPoolStats:
+    size: int
+    in_use: int
+    max_size: int
+    checkouts: int
+    waits: int
+    total_wait_time: float
+    max_wait_time: float
+
+
+class CursorPool:
+    """
+    Pool of cursors on one DuckDB database. A checked out cursor is only used by one thread at a time,
+    while all cursors see the same catalog, so queries from different threads run in parallel and
+    tables created on one cursor are visible to the others.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], duckdb.DuckDBPyConnection],
+        max_size: int = None,
+    ):
+        """
+        CursorPool constructor
+
+        :param factory: function that creates a new cursor
+        :type factory: Callable[[], duckdb.DuckDBPyConnection]
+        :param max_size: maximum number of cursors, checkouts wait for a cursor to be returned once this many exist, defaults to None (no limit)
+        :type max_size: int, optional
+        """
+        self._factory = factory
+        self.max_size = max_size
+
+        # idle cursors along with the generation they were created in, see invalidate()
+        self._idle: List[Tuple[int, duckdb.DuckDBPyConnection]] = []
+        self._checked_out: Dict[int, int] = {}
+        self._size = 0
+        self._generation = 0
+        self._cond = threading.Condition()
+
+        self._checkouts = 0
+        self._waits = 0
+        self._total_wait_time = 0.0
+        self._max_wait_time = 0.0
+
+    def acquire(self) -> duckdb.DuckDBPyConnection:
+        """
+        Check out a cursor, waiting for one to be released if the pool is full
+
+        :return: cursor for the calling thread to use until it is released
+        :rtype: duckdb.DuckDBPyConnection
+        """
+        start = time.perf_counter()
+        waited = False
+        cur = None
+
+        with self._cond:
+            while True:
+                while self._idle and cur is None:
+                    generation, idle_cur = self._idle.pop()
+
+                    if generation == self._generation:
+                        cur = idle_cur
+                    else:
+                        idle_cur.close()
+                        self._size -= 1
+
+                if cur is not None:
+                    break
+
+                if self.max_size is None or self._size < self.max_size:
+                    # reserve a slot, the cursor itself is created outside the lock
+                    self._size += 1
+                    break
+
+                waited = True
+                self._cond.wait()
+
+            generation = self._generation
+
+        if cur is None:
+            try:
+                cur = self._factory()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        wait_time = time.perf_counter() - start
+
+        with self._cond:
+            self._checked_out[id(cur)] = generation
+            self._checkouts += 1
+
+            if waited:
+                self._waits += 1
+                self._total_wait_time += wait_time
+                self._max_wait_time = max(self._max_wait_time, wait_time)
+
+        return cur
+
+    def release(self, cur: duckdb.DuckDBPyConnection):
+        """
+        Return a cursor to the pool
+
+        :param cur: cursor returned by acquire()
+        :type cur: duckdb.DuckDBPyConnection
+        """
+        with self._cond:
+            generation = self._checked_out.pop(id(cur))
+
+            if generation == self._generation:
+                self._idle.append((generation, cur))
+            else:
+                cur.close()
+                self._size -= 1
+
+            self._cond.notify()
+
+    @contextmanager
+    def checkout(self) -> Iterator[duckdb.DuckDBPyConnection]:
+        """
+        Context manager that acquires a cursor and releases it on exit
+        """
+        cur = self.acquire()
+
+        try:
+            yield cur
+        finally:
+            self.release(cur)
+
+    def invalidate(self):
+        """
+        Replace every cursor with a new one from the factory. Idle cursors are closed now, checked out
+        cursors are closed when they are released.
+        """
+        with self._cond:
+            self._generation += 1
+
+            for _, cur in self._idle:
+                cur.close()
+
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    def close(self):
+        """
+        Close all idle cursors, cursors that are checked out are closed when they are released
+        """
+        self.invalidate()
+
+    def stats(self) -> CursorPoolStats:
+        """
+        Get the current size of the pool and how long checkouts have waited for a cursor
+
+        :return: pool statistics
+        :rtype: CursorPoolStats
+        """
+        with self._cond:
+            return CursorPoolStats(
+                size=self._size,
+                in_use=len(self._checked_out),
+                max_size=self.max_size,
+                checkouts=self._checkouts,
+                waits=self._waits,
+                total_wait_time=self._total_wait_time,
+                max_wait_time=self._max_wait_time,
+            )
@@ -0,0 +1,101 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Collection, Dict, List
+
+
+def check_dependencies(deps: Dict[str, Collection[str]], kind: str):
+    """
+    Check that items don't depend on each other in a cycle
+
+    :param deps: mapping from each item's name to the names of the items it depends on, which must all be keys too
+    :type deps: Dict[str, Collection[str]]
+    :param kind: what the items are, for the error message, e.g. "jobs"
+    :type kind: str
+    :raises ValueError: raised if items depend on each other in a cycle
+    """
+    # depth first search, any item seen again while it's still on the stack is part of a cycle
+    state = {}
+
+    def visit(name: str, path: List[str]):
+        if state.get(name) == "done":
+            return
+
+        if state.get(name) == "visiting":
+            cycle = path[path.index(name) :] + [name]
+            raise ValueError(f"{kind} depend on each other: {' -> '.join(cycle)}")
+
+        state[name] = "visiting"
+
+        for dep in deps[name]:
+            visit(dep, path + [name])
+
+        state[name] = "done"
+
+    for name in deps:
+        visit(name, [])
+
+
+def run_in_dependency_order(
+    deps: Dict[str, Collection[str]],
+    run: Callable[[str], Any],
+    skip: Callable[[str, Dict[str, Any]], Any] = None,
+    max_workers: int = None,
+    thread_name_prefix: str = "filequery",
+) -> Dict[str, Any]:
+    """
+    Call run with the name of each item in a thread pool, once the items it depends on are done, so
+    items that don't depend on each other run at the same time. Items that are ready start in the
+    order of deps. If run raises, no more items are started and the error is raised once the running
+    ones finished.
+
+    :param deps: mapping from each item's name to the names of the items it depends on, checked with check_dependencies()
+    :type deps: Dict[str, Collection[str]]
+    :param run: called with an item's name to run it, returns the item's result
+    :type run: Callable[[str], Any]
+    :param skip: called with an item's name and the results so far once its dependencies are done, if it returns something other than None that is the item's result and run isn't called, defaults to None
+    :type skip: Callable[[str, Dict[str, Any]], Any], optional
+    :param max_workers: maximum number of items to run at the same time, defaults to None (ThreadPoolExecutor's default)
+    :type max_workers: int, optional
+    :param thread_name_prefix: prefix of the worker threads' names, defaults to "filequery"
+    :type thread_name_prefix: str, optional
+    :return: mapping from each item's name to its result, in the order the items finished
+    :rtype: Dict[str, Any]
+    """
+    results: Dict[str, Any] = {}
+
+    with ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix=thread_name_prefix
+    ) as executor:
+        pending = list(deps)
+        running: Dict[Future, str] = {}
+
+        while pending or running:
+            # start every item whose dependencies are done
+            for name in list(pending):
+                if any(dep not in results for dep in deps[name]):
+                    continue
+
+                pending.remove(name)
+                result = skip(name, results) if skip else None
+
+                if result is not None:
+                    results[name] = result
+                else:
+                    running[executor.submit(run, name)] = name
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                name = running.pop(future)
+
+                # let the remaining items finish, then raise the first error
+                if future.exception() is not None:
+                    pending.clear()
+                    wait(running)
+                    future.result()
+
+                results[name] = future.result()
+
+    return results
@@ -1,5 +1,8 @@
 from dataclasses import dataclass
-from typing import List
+from typing import Any, Dict, List
+
+from filequery.jobs import Job
+from filequery.sources import SourceOptions
 
 
 @dataclass
@@ -12,3 +15,24 @@ class FileQueryArgs:
     out_file_format: str
     delimiter: str
     editor: bool
+    max_rows: int = None
+    pager: bool = False
+    stats: bool = False
+    sample: str = None
+    input_format: str = None
+    params: Dict[str, Any] = None
+    database: str = None
+    summaries: Dict[str, str] = None
+    sources: Dict[str, SourceOptions] = None
+    shard_dirs: List[str] = None
+    shard_workers: int = None
+    shard_memory: str = None
+    merge_query: str = None
+    jobs: List[Job] = None
+    report: str = None
+    max_parallel_jobs: int = None
+    progress: bool = False
+    query_log: str = None
+    on_load_error: str = None
+    resume: bool = False
+    memory_report: bool = False
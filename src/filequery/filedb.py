@@ -1,12 +1,34 @@
+import contextlib
+import csv
+import hashlib
+import io
+import json
 import os
 import re
-from typing import List
+import sys
+import threading
+import time
+import warnings
+from typing import (Any, BinaryIO, Callable, Dict, Iterator, List, Sequence,
+                    Set, Union)
 
 import duckdb
 
+from .batchformat import BatchFormat
+from .cursorpool import CursorPool, CursorPoolStats
 from .exceptions import InvalidFileTypeException
+from .preparedquery import PreparedQuery
 from .filetype import FileType
+from .loaderrormode import LoadErrorMode
+from .memoryreport import MemoryReport, build_memory_report
+from .progress import (LoadProgress, ProgressCallback, QueryProgress,
+                       enable_progress, monitor_progress)
+from .querylog import MemorySampler, QueryLog
 from .queryresult import QueryResult
+from .sources import LoadError, SourceInfo, SourceLoadStats, SourceOptions
+from .summarytables import SummaryTable, build_summary_tables
+from .tablestats import (TableStats, TableStatsCache, TableVersions,
+                         quote_identifier)
 
 READ_FUNCS = {
     FileType.CSV: "read_csv",
@@ -15,6 +37,32 @@ READ_FUNCS = {
     FileType.NDJSON: "read_ndjson_auto",
 }
 
+# number of rows per batch when streaming a result out of DuckDB, this matches DuckDB's row group size
+DEFAULT_BATCH_SIZE = 122880
+
+# output path that means "write to standard output"
+STDOUT_PATH = "-"
+
+# input path that means "read from standard input", and the name of the table it is read into
+STDIN_PATH = "-"
+STDIN_TABLE_NAME = "stdin"
+
+# query parameters, either positional (for ? or $1 placeholders) or named (for $name placeholders)
+QueryParams = Union[Sequence[Any], Dict[str, Any]]
+
+# --sample values, either a percentage like "10%" or a number of rows like "10000"
+SAMPLE_REGEX = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(%?)\s*$")
+
+# prefix of the table comment that records which version of its file a table was loaded from
+SOURCE_FINGERPRINT_PREFIX = "filequery-source:"
+
+# table that CSV rows which can't be parsed are moved to with LoadErrorMode.QUARANTINE
+REJECTS_TABLE_NAME = "load_rejects"
+
+# temporary tables DuckDB stores the rows it couldn't parse in while reading a CSV file
+REJECTS_TEMP_TABLE_NAME = "__filequery_rejects"
+REJECT_SCANS_TEMP_TABLE_NAME = "__filequery_reject_scans"
+
 # mapping from file extension to FileType
 FILE_EXT_MAP = {
     "csv": FileType.CSV,
@@ -25,65 +73,888 @@ FILE_EXT_MAP = {
 
 
 class FileDb:
-    def __init__(self, filepath: str):
+    def __init__(
+        self,
+        filepath: Union[str, List[str]] = None,
+        tables: Dict[str, Any] = None,
+        max_cursors: int = None,
+        sample: str = None,
+        input_format: FileType = None,
+        database: str = None,
+        summaries: List[SummaryTable] = None,
+        source_options: Dict[str, SourceOptions] = None,
+        config: Dict[str, Any] = None,
+        on_progress: ProgressCallback = None,
+        query_log: QueryLog = None,
+        on_load_error: LoadErrorMode = LoadErrorMode.FAIL,
+        resume: bool = False,
+    ):
         """
         FileDb constructor
 
-        :param filepath: path to a file or directory containing files which will be read into tables
+        A FileDb can be shared between threads. Queries run on cursors checked out from a pool, so queries
+        from different threads run in parallel against the same tables.
+
+        :param filepath: path to a file or directory containing files which will be read into tables, or a list of such paths, defaults to None
+        :type filepath: Union[str, List[str]], optional
+        :param tables: mapping from table name to an in-memory object (pandas DataFrame, Arrow table, dict of numpy arrays, ...) to query alongside the files, see register(), defaults to None
+        :type tables: Dict[str, Any], optional
+        :param max_cursors: maximum number of queries to run at the same time, other queries wait for a cursor, defaults to None (no limit)
+        :type max_cursors: int, optional
+        :param sample: only load a sample of each file, either a percentage of rows ("10%") or a number of rows ("10000"), defaults to None (load everything)
+        :type sample: str, optional
+        :param input_format: format of standard input when filepath is "-" (read into a table called "stdin"), also used for files with an unrecognized extension, defaults to None
+        :type input_format: FileType, optional
+        :param database: path to a DuckDB database file to load the files into instead of an in-memory database, summary tables in it are kept between runs, defaults to None
+        :type database: str, optional
+        :param summaries: tables to create from queries once the files are loaded, see build_summaries(), defaults to None
+        :type summaries: List[SummaryTable], optional
+        :param source_options: mapping from table name to options for loading that table, e.g. the columns and rows to load, a sort order or indexes for fast lookups, defaults to None
+        :type source_options: Dict[str, SourceOptions], optional
+        :param config: DuckDB settings for the database, e.g. {"memory_limit": "4GB", "threads": 2}, defaults to None
+        :type config: Dict[str, Any], optional
+        :param on_progress: called from a background thread with a LoadProgress while files are loaded, and with a QueryProgress while exec_query() or export_query() runs, defaults to None
+        :type on_progress: ProgressCallback, optional
+        :param query_log: log to append each statement run through exec_query() and export_query() to, with its timing and the files it read, defaults to None
+        :type query_log: QueryLog, optional
+        :param on_load_error: what to do when a file fails to load, stop (the default), or skip it and load the other files, see load_errors(). With QUARANTINE, CSV rows that can't be parsed are also moved to a load_rejects table instead of failing their file, defaults to LoadErrorMode.FAIL
+        :type on_load_error: LoadErrorMode, optional
+        :param resume: don't load files again that were loaded into the database file by an earlier run and haven't changed since, so a load that was interrupted or partly failed continues where it stopped, defaults to False
+        :type resume: bool, optional
+        :raises ValueError: raised if sample is not a valid sample size, source_options names a table that isn't loaded, or resume is set without a database
+        """
+        if resume and not database:
+            raise ValueError("resuming a load needs a database file to keep track of loaded files")
+
+        self.database = database
+        self.db = duckdb.connect(database or ":memory:", config=config or {})
+        self.on_progress = on_progress
+        self.query_log = query_log
+        self.on_load_error = on_load_error
+        self.resume = resume
+
+        if on_progress is not None:
+            enable_progress(self.db)
+
+        # a database file still has the tables from the last run, so they're replaced when loading the files again
+        self._create_table = "create or replace table" if database else "create table"
+
+        # mapping from table name to the file it was loaded from (None for standard input), used to tell when summaries are stale
+        self._sources: Dict[str, str] = {}
+        self._source_info: Dict[str, SourceInfo] = {}
+        self.source_options = source_options or {}
+        self._load_stats: Dict[str, SourceLoadStats] = {}
+        self._load_errors: List[LoadError] = []
+
+        # DuckDB's keywords, looked up once the first time a table name is checked, see _should_quote_table_name()
+        self._keywords: Set[str] = None
+
+        # in-memory objects registered with register(), kept so they can be registered on new cursors
+        self._registered = {}
+
+        # guards self.db and self._registered, the pooled cursors don't need it. held while sources are
+        # loaded after the constructor, so new cursors wait for the tables to be added or refreshed
+        self._lock = threading.Lock()
+
+        # held while sources are added, removed or refreshed, so only one change to the tables runs at a time
+        self._sources_lock = threading.Lock()
+        self._pool = CursorPool(self.cursor, max_cursors)
+        # statements run through this FileDb, so cached stats notice updates
+        self._table_versions = TableVersions()
+        self._stats = TableStatsCache(self.cursor, self._table_versions)
+
+        # validate before loading anything so a bad sample size fails fast
+        self.sample = sample
+        self._sample_clause = sample_clause(sample) if sample else ""
+        self.input_format = input_format
+
+        filepaths = [filepath] if isinstance(filepath, str) else filepath or []
+        files = [file for path in filepaths for file in _list_source_files(path)]
+
+        # seconds it took to load the files, logged with each query to tell slower loads from slower queries
+        self.load_time = self._load_files(files, on_error=on_load_error)
+
+        skipped_tables = {error.table for error in self._load_errors}
+        unknown_tables = set(self.source_options) - set(self._sources) - skipped_tables
+
+        if unknown_tables:
+            raise ValueError(
+                f"options given for tables that weren't loaded: {', '.join(sorted(unknown_tables))}"
+            )
+
+        for name, obj in (tables or {}).items():
+            self.register(name, obj)
+
+        if summaries:
+            self.build_summaries(summaries)
+
+    def register(self, name: str, obj: Any):
+        """
+        Make an in-memory object queryable as a table called name. DuckDB scans the object in place,
+        so the data is not copied into the database. Anything DuckDB can register works, e.g. pandas
+        DataFrames, Arrow tables and record batch readers, or dicts of numpy arrays.
+
+        :param name: name to query the object by
+        :type name: str
+        :param obj: object to register
+        :type obj: Any
+        """
+        with self._lock:
+            self.db.register(name, obj)
+            self._registered[name] = obj
+
+        # pooled cursors were created without this object
+        self._pool.invalidate()
+
+    def unregister(self, name: str):
+        """
+        Remove an object added with register()
+
+        :param name: name the object was registered with
+        :type name: str
+        """
+        with self._lock:
+            self.db.unregister(name)
+            del self._registered[name]
+
+        self._pool.invalidate()
+
+    def cursor(self) -> duckdb.DuckDBPyConnection:
+        """
+        Create a new cursor on the database. Objects added with register() are only visible to the
+        connection they were registered on, so they are registered again on the cursor.
+
+        :return: cursor for the database
+        :rtype: duckdb.DuckDBPyConnection
+        """
+        with self._lock:
+            cur = self.db.cursor()
+
+            for name, obj in self._registered.items():
+                cur.register(name, obj)
+
+        if self.on_progress is not None:
+            enable_progress(cur)
+
+        return cur
+
+    def acquire_cursor(self) -> duckdb.DuckDBPyConnection:
+        """
+        Check out a cursor from the pool, for running queries across several calls, e.g. fetching a
+        result a batch at a time from another thread. Waits for a cursor if max_cursors are in use.
+
+        :return: cursor to use until it's given back with release_cursor()
+        :rtype: duckdb.DuckDBPyConnection
+        """
+        return self._pool.acquire()
+
+    def release_cursor(self, cur: duckdb.DuckDBPyConnection):
+        """
+        Give back a cursor checked out with acquire_cursor()
+
+        :param cur: cursor to give back
+        :type cur: duckdb.DuckDBPyConnection
+        """
+        self._pool.release(cur)
+
+    def cursor_pool_stats(self) -> CursorPoolStats:
+        """
+        Get the number of pooled cursors and how long queries have waited for one
+
+        :return: cursor pool statistics
+        :rtype: CursorPoolStats
+        """
+        return self._pool.stats()
+
+    def table_stats(self, table: str) -> TableStats:
+        """
+        Get the row count and per-column stats (null fraction, approximate distinct count, min and max)
+        for a table. Stats are cached until the table changes.
+
+        :param table: table name, without quotes
+        :type table: str
+        :return: stats for the table, or None if there is no such table
+        :rtype: TableStats
+        """
+        return self._stats.compute(table)
+
+    def all_table_stats(self) -> List[TableStats]:
+        """
+        Get stats for every table in the database, see table_stats()
+
+        :return: stats for each table
+        :rtype: List[TableStats]
+        """
+        return self._stats.all_stats()
+
+    def memory_report(self) -> MemoryReport:
+        """
+        Get the estimated size, row count and compression of every table, along with how much memory
+        DuckDB is using, e.g. to find the tables taking up the most memory
+
+        :return: memory report
+        :rtype: MemoryReport
+        """
+        with self._pool.checkout() as cur:
+            return build_memory_report(cur)
+
+    def start_stats_worker(self, on_computed: Callable[[TableStats], None] = None):
+        """
+        Compute stats for every table in a background thread, so later calls to table_stats() return
+        immediately
+
+        :param on_computed: called from the background thread with the stats of each table as they are computed, defaults to None
+        :type on_computed: Callable[[TableStats], None], optional
+        """
+        self._stats.start_background(on_computed)
+
+    def add_source(self, filepath: str, options: SourceOptions = None) -> str:
+        """
+        Load another file into a table, named after the file like the files given to the constructor
+
+        :param filepath: path to a CSV, JSON or Parquet file
         :type filepath: str
+        :param options: options for loading the table, defaults to None
+        :type options: SourceOptions, optional
+        :raises ValueError: raised if there already is a table with the file's name
+        :return: name of the new table
+        :rtype: str
+        """
+        table_name = _table_name(filepath)
+
+        return self.add_sources(
+            [filepath], {table_name: options} if options else None
+        )[0]
+
+    def add_sources(
+        self,
+        filepaths: List[str],
+        source_options: Dict[str, SourceOptions] = None,
+    ) -> List[str]:
         """
-        self.db = duckdb.connect(":memory:")
-
-        if os.path.isdir(filepath):
-            # only take accepted file types
-            files = []
-            for file in os.listdir(filepath):
-                is_accepted_type = (
-                    file.lower().endswith(".csv")
-                    or file.lower().endswith(".parquet")
-                    or file.lower().endswith(".json")
-                    or file.lower().endswith(".ndjson")
+        Load more files into tables without reloading the ones already loaded. The files are loaded in a
+        single transaction, so either all of them are added or, if one fails, none of them are.
+
+        :param filepaths: paths to files or directories containing files
+        :type filepaths: List[str]
+        :param source_options: mapping from table name to options for loading that table, defaults to None
+        :type source_options: Dict[str, SourceOptions], optional
+        :raises ValueError: raised if a file would be loaded into a table that already exists, or source_options names a table that isn't among the files
+        :return: names of the new tables
+        :rtype: List[str]
+        """
+        files = [file for path in filepaths for file in _list_source_files(path)]
+        table_names = [_table_name(file) for file in files]
+        source_options = source_options or {}
+
+        unknown_tables = set(source_options) - set(table_names)
+
+        if unknown_tables:
+            raise ValueError(
+                f"options given for tables that aren't among the files: {', '.join(sorted(unknown_tables))}"
+            )
+
+        with self._sources_lock:
+            seen = set()
+
+            for table_name in table_names:
+                if table_name in self._sources or table_name in seen:
+                    raise ValueError(f"there already is a table called {table_name}")
+
+                seen.add(table_name)
+
+            registries = self._save_registries()
+            self.source_options.update(source_options)
+
+            # self.db is shared with register() and cursor(), which run on other threads
+            with self._lock:
+                try:
+                    self.db.execute("begin transaction")
+                    self._load_files(files)
+                    self.db.execute("commit")
+                except BaseException:
+                    self.db.execute("rollback")
+                    self._restore_registries(registries)
+                    raise
+
+        return table_names
+
+    def remove_source(self, table: str):
+        """
+        Drop a table loaded from a file
+
+        :param table: name of the table
+        :type table: str
+        :raises ValueError: raised if no table was loaded from a file with this name
+        """
+        with self._sources_lock:
+            if table not in self._sources:
+                raise ValueError(f"no table called {table} was loaded from a file")
+
+            with self._lock:
+                self.db.execute(f"drop table {quote_identifier(table)}")
+
+            for registry in (
+                self._sources,
+                self._source_info,
+                self._load_stats,
+                self.source_options,
+            ):
+                registry.pop(table, None)
+
+    def refresh_source(self, table: str, force: bool = False) -> bool:
+        """
+        Load a table from its file again, if the file changed since it was loaded. Queries running on
+        other threads keep seeing the old table until it's replaced.
+
+        :param table: name of the table
+        :type table: str
+        :param force: reload the table even if the file didn't change, defaults to False
+        :type force: bool, optional
+        :raises ValueError: raised if no table was loaded from a file with this name, or the table was loaded from standard input
+        :return: whether the table was loaded again
+        :rtype: bool
+        """
+        with self._sources_lock:
+            info = self._source_info.get(table)
+
+            if info is None:
+                raise ValueError(f"no table called {table} was loaded from a file")
+
+            if info.path is None:
+                raise ValueError("a table loaded from standard input can't be refreshed")
+
+            stat = os.stat(info.path)
+
+            if not force and (stat.st_size, stat.st_mtime) == (info.size_bytes, info.mtime):
+                return False
+
+            registries = self._save_registries()
+
+            with self._lock:
+                try:
+                    self.db.execute("begin transaction")
+                    self._load_files([info.path], replace=True)
+                    self.db.execute("commit")
+                except BaseException:
+                    self.db.execute("rollback")
+                    self._restore_registries(registries)
+                    raise
+
+        return True
+
+    def sources(self) -> List[SourceInfo]:
+        """
+        Get the tables loaded from files, with each file's format, size and modification time when it
+        was loaded and how long it took
+
+        :return: loaded sources, in the order they were loaded
+        :rtype: List[SourceInfo]
+        """
+        with self._sources_lock:
+            return list(self._source_info.values())
+
+    def source_files(self) -> Dict[str, str]:
+        """
+        Get the file each table was loaded from
+
+        :return: mapping from table name to file path, None for the table read from standard input
+        :rtype: Dict[str, str]
+        """
+        return dict(self._sources)
+
+    def load_errors(self) -> List[LoadError]:
+        """
+        Get the files that were skipped because they failed to load, see the on_load_error argument of the constructor
+
+        :return: skipped files and the errors they failed with
+        :rtype: List[LoadError]
+        """
+        return list(self._load_errors)
+
+    def load_stats(self) -> List[SourceLoadStats]:
+        """
+        Get how long each table took to load, including sorting it, and how long each of its indexes
+        took to build
+
+        :return: load times for each table loaded from a file
+        :rtype: List[SourceLoadStats]
+        """
+        return list(self._load_stats.values())
+
+    def build_summaries(
+        self, summaries: List[SummaryTable], max_workers: int = None
+    ) -> List[str]:
+        """
+        Create a table from each summary's query so later queries can reuse the result instead of
+        computing it again. Summaries can read from the loaded files and from each other, each one is
+        built once the tables it reads from are built and independent summaries are built in parallel.
+        With a database file, a summary from a previous run is only rebuilt if its query or the
+        files it's built from changed.
+
+        :param summaries: summary tables to build
+        :type summaries: List[SummaryTable]
+        :param max_workers: maximum number of summaries to build at the same time, defaults to None
+        :type max_workers: int, optional
+        :raises ValueError: raised if a query can't be parsed, or summaries depend on each other in a cycle
+        :return: names of the summaries that were built
+        :rtype: List[str]
+        """
+        inputs = {
+            name: self._source_fingerprint(name, path)
+            for name, path in self._sources.items()
+        }
+
+        return build_summary_tables(self._pool, summaries, inputs, max_workers)
+
+    def _source_fingerprint(self, table_name: str, filepath: str) -> Any:
+        """
+        Something that changes when the table loaded from filepath would be different,
+        or None if that can't be determined (standard input)
+        """
+        if filepath is None:
+            return None
+
+        stat = os.stat(filepath)
+        options = self.source_options.get(table_name) or SourceOptions()
+
+        return [
+            os.path.abspath(filepath),
+            stat.st_size,
+            stat.st_mtime_ns,
+            self._sample_clause,
+            options.select_list(),
+            options.where,
+        ]
+
+    def close(self):
+        """
+        Close the pooled cursors and the database
+        """
+        self._pool.close()
+        self.db.close()
+
+    def _save_registries(self) -> tuple:
+        """
+        copy what's known about the sources, so it can be restored if loading more of them fails
+        """
+        return (
+            dict(self._sources),
+            dict(self._source_info),
+            dict(self._load_stats),
+            dict(self.source_options),
+        )
+
+    def _restore_registries(self, registries: tuple):
+        (
+            self._sources,
+            self._source_info,
+            self._load_stats,
+            self.source_options,
+        ) = registries
+
+    def _load_files(
+        self,
+        files: List[str],
+        replace: bool = False,
+        on_error: LoadErrorMode = LoadErrorMode.FAIL,
+    ) -> float:
+        """
+        load files into tables, reporting progress if there is a progress callback
+
+        :param files: files to load, "-" for standard input
+        :type files: List[str]
+        :param replace: replace tables that already exist, defaults to False
+        :type replace: bool, optional
+        :param on_error: whether to stop at a file that fails to load or skip it, defaults to LoadErrorMode.FAIL
+        :type on_error: LoadErrorMode, optional
+        :return: seconds it took to load the files
+        :rtype: float
+        """
+        self._load_progress = LoadProgress(
+            len(files), sum(_file_size(file) for file in files)
+        )
+        # replaced tables are loaded again even if their file didn't change, see refresh_source()
+        checkpoints = self._get_checkpoints() if self.resume and not replace else {}
+
+        start = time.perf_counter()
+
+        # tables loaded by this call, a later file with the same table name must leave them alone
+        loaded = set()
+
+        for file in files:
+            table_name = STDIN_TABLE_NAME if file == STDIN_PATH else _table_name(file)
+
+            if table_name in loaded:
+                error = ValueError(
+                    f"there already is a table called {table_name}, loaded from {self._sources[table_name]}"
                 )
 
-                if is_accepted_type:
-                    files.append(file)
+                if on_error == LoadErrorMode.FAIL:
+                    raise error
 
-            for file in files:
-                self._create_table_from_file(os.path.join(filepath, file))
-        else:
-            self._create_table_from_file(filepath)
+                self._skip_file(file, error, keep_table=True)
+                continue
+
+            try:
+                if file == STDIN_PATH:
+                    self._create_table_from_stdin()
+                else:
+                    self._create_table_from_file(file, replace, checkpoints)
+            except Exception as e:
+                if on_error == LoadErrorMode.FAIL:
+                    raise
+
+                self._skip_file(file, e)
+            else:
+                loaded.add(table_name)
+
+        return time.perf_counter() - start
+
+    def _skip_file(self, filepath: str, error: Exception, keep_table: bool = False):
+        """
+        forget a file that failed to load. the table is dropped, since it may have been created
+        before building an index failed, or be left from an earlier run when resuming. with
+        keep_table, the table belongs to another file and only the error is recorded
+        """
+        table_name = STDIN_TABLE_NAME if filepath == STDIN_PATH else _table_name(filepath)
 
-    def _create_table_from_file(self, filepath: str):
+        if not keep_table:
+            self.db.execute(f"drop table if exists {quote_identifier(table_name)}")
+
+            for registry in (self._sources, self._source_info, self._load_stats):
+                registry.pop(table_name, None)
+
+        self._load_errors.append(LoadError(table_name, filepath, str(error)))
+        self._load_progress.table = None
+        self._load_progress.table_bytes = 0
+        self._load_progress.table_percent = None
+
+    def _get_checkpoints(self) -> Dict[str, str]:
+        """
+        get the fingerprint of the file each table in the database was loaded from, for tables that
+        were loaded completely
+        """
+        self.db.execute(
+            """
+            select table_name, comment
+            from duckdb_tables()
+            where not internal and starts_with(comment, ?)
+            """,
+            [SOURCE_FINGERPRINT_PREFIX],
+        )
+
+        return {
+            rec[0]: rec[1][len(SOURCE_FINGERPRINT_PREFIX) :] for rec in self.db.fetchall()
+        }
+
+    def _checkpoint_fingerprint(self, table_name: str, filepath: str) -> str:
+        """
+        hash of everything that makes a difference to the table loaded from a file
+        """
+        options = self.source_options.get(table_name) or SourceOptions()
+        fingerprint = self._source_fingerprint(table_name, filepath) + [
+            repr(options),
+            self.on_load_error == LoadErrorMode.QUARANTINE,
+        ]
+
+        return hashlib.sha256(json.dumps(fingerprint).encode()).hexdigest()
+
+    def _create_table_from_file(
+        self,
+        filepath: str,
+        replace: bool = False,
+        checkpoints: Dict[str, str] = None,
+    ):
         """
         create a table in the database from a file
 
         :param filename: path to a CSV, JSON or Parquet file
         :type filename: str
+        :param replace: replace the table if it already exists, defaults to False
+        :type replace: bool, optional
+        :param checkpoints: fingerprints of the files tables were loaded from by an earlier run, tables whose file didn't change since aren't loaded again, defaults to None
+        :type checkpoints: Dict[str, str], optional
         :raises InvalidFileTypeException: raised if file is not CSV, JSON or Parquet
         """
-        base_filename = os.path.basename(filepath).lower()
-        table_name, file_ext = os.path.splitext(base_filename)
-        file_ext = file_ext.replace(".", "")
-        filetype = FILE_EXT_MAP.get(file_ext)
+        table_name = _table_name(filepath)
+        file_ext = os.path.splitext(filepath)[1].lower().replace(".", "")
+        filetype = FILE_EXT_MAP.get(file_ext) or self.input_format
 
         if filetype is None:
             raise InvalidFileTypeException
 
         read_func = READ_FUNCS[filetype]
+        stat = os.stat(filepath)
+        self._sources[table_name] = filepath
+        quoted_name = table_name
 
         if self._should_quote_table_name(table_name):
-            table_name = f'"{table_name}"'
+            quoted_name = f'"{table_name}"'
+
+        options = self.source_options.get(table_name) or SourceOptions()
+
+        if options.has_json_options and filetype not in (FileType.JSON, FileType.NDJSON):
+            raise ValueError(f"JSON options were given for {table_name}, which isn't a JSON file")
+
+        # tables in a database file record the version of the file they were loaded from, so
+        # a later run can tell they don't need to be loaded again
+        checkpoint = self._checkpoint_fingerprint(table_name, filepath) if self.database else None
+
+        if checkpoint is not None and (checkpoints or {}).get(table_name) == checkpoint:
+            self._source_info[table_name] = SourceInfo(
+                table_name, filepath, filetype, stat.st_size, stat.st_mtime
+            )
+            self._load_progress.table_bytes = stat.st_size
+            self._report_loaded(quoted_name)
+            return
+
+        quarantine = (
+            filetype == FileType.CSV and self.on_load_error == LoadErrorMode.QUARANTINE
+        )
 
         # for csv, json and ndjson, set sample size to -1 (sample all records)
         # this is not needed for parquet
-        if filetype == FileType.PARQUET:
-            self.db.execute(
-                f"create table {table_name} as select * from {read_func}('{filepath}');"
+        if filetype in (FileType.JSON, FileType.NDJSON):
+            scan = options.json_scan(filepath, filetype == FileType.NDJSON)
+        elif filetype == FileType.PARQUET:
+            scan = f"{read_func}('{filepath}')"
+        elif quarantine:
+            # rows that can't be parsed are left out and stored in temporary tables
+            scan = (
+                f"{read_func}('{filepath}', SAMPLE_SIZE=-1, store_rejects = true,"
+                f" rejects_table = '{REJECTS_TEMP_TABLE_NAME}', rejects_scan = '{REJECT_SCANS_TEMP_TABLE_NAME}')"
             )
         else:
+            scan = f"{read_func}('{filepath}', SAMPLE_SIZE=-1)"
+
+        self._load_table(table_name, quoted_name, scan, replace, checkpoint)
+        self._source_info[table_name] = SourceInfo(
+            table_name,
+            filepath,
+            filetype,
+            stat.st_size,
+            stat.st_mtime,
+            self._load_stats[table_name].load_time,
+        )
+
+        if quarantine:
+            self._store_rejects(table_name, filepath)
+
+    def _store_rejects(self, table_name: str, filepath: str):
+        """
+        move the rows DuckDB couldn't parse while loading a file to the load_rejects table, which is kept
+        in the database file unlike DuckDB's temporary tables
+        """
+        self.db.execute(
+            f"""
+            create table if not exists {REJECTS_TABLE_NAME} (
+                table_name varchar,
+                file varchar,
+                line bigint,
+                column_name varchar,
+                error_type varchar,
+                csv_line varchar,
+                error_message varchar
+            )
+            """
+        )
+
+        # rows from an earlier load of the same file
+        self.db.execute(f"delete from {REJECTS_TABLE_NAME} where file = ?", [filepath])
+        self.db.execute(
+            f"""
+            insert into {REJECTS_TABLE_NAME}
+            select ?, ?, line, column_name, error_type, csv_line, error_message
+            from {REJECTS_TEMP_TABLE_NAME}
+            """,
+            [table_name, filepath],
+        )
+        self.db.execute(f"delete from {REJECTS_TEMP_TABLE_NAME}")
+        self.db.execute(f"delete from {REJECT_SCANS_TEMP_TABLE_NAME}")
+
+    def _load_table(
+        self,
+        table_name: str,
+        quoted_name: str,
+        scan: str,
+        replace: bool = False,
+        checkpoint: str = None,
+    ):
+        """
+        create a table from a table function call that reads a file, applying the sample and the
+        table's source options, and record how long it took
+
+        :param table_name: name of the table
+        :type table_name: str
+        :param quoted_name: name of the table as it's written in SQL
+        :type quoted_name: str
+        :param scan: table function call to select from, e.g. read_csv('data.csv')
+        :type scan: str
+        :param replace: replace the table if it already exists, defaults to False
+        :type replace: bool, optional
+        :param checkpoint: fingerprint of the file to record once the table is loaded, see _checkpoint_fingerprint(), defaults to None
+        :type checkpoint: str, optional
+        """
+        options = self.source_options.get(table_name) or SourceOptions()
+        create_table = "create or replace table" if replace else self._create_table
+        where = f" where {options.where}" if options.where else ""
+        order_by = f" order by {', '.join(options.order_by)}" if options.order_by else ""
+
+        start = time.perf_counter()
+        self._load_progress.table = table_name
+        self._load_progress.table_bytes = _file_size(self._sources[table_name])
+
+        with self._monitor_load(table_name):
+            self.db.execute(
+                f"{create_table} {quoted_name} as select {options.select_list()} from {scan}{where}{self._sample_clause}{order_by};"
+            )
+
+        stats = SourceLoadStats(
+            table_name, time.perf_counter() - start, options.order_by
+        )
+
+        for columns in options.indexes:
+            index_name = quote_identifier(f"{table_name}_{'_'.join(columns)}_idx")
+            column_list = ", ".join(columns)
+
+            start = time.perf_counter()
+            self.db.execute(f"create index {index_name} on {quoted_name} ({column_list})")
+            stats.index_times[column_list] = time.perf_counter() - start
+
+        self._load_stats[table_name] = stats
+
+        # recorded last, so a table that was interrupted while its indexes were built is loaded again
+        if checkpoint is not None:
+            # the fingerprint is a hex digest, so it can't contain quotes
             self.db.execute(
-                f"create table {table_name} as select * from {read_func}('{filepath}', SAMPLE_SIZE=-1);"
+                f"comment on table {quoted_name} is '{SOURCE_FINGERPRINT_PREFIX}{checkpoint}'"
+            )
+
+        self._report_loaded(quoted_name)
+
+    def _report_loaded(self, quoted_name: str):
+        """
+        count a table as loaded in the load progress, if there is a progress callback
+        """
+        if self.on_progress is None:
+            return
+
+        self.db.execute(f"select count(*) from {quoted_name}")
+        self._load_progress.rows_loaded += self.db.fetchone()[0]
+        self._load_progress.files_loaded += 1
+        self._load_progress.bytes_loaded += self._load_progress.table_bytes
+        self._load_progress.table = None
+        self._load_progress.table_bytes = 0
+        self._load_progress.table_percent = None
+        self.on_progress(self._load_progress)
+
+    def _sample_memory(self):
+        """
+        sample DuckDB's memory usage while a statement runs, if there is a query log to record it in
+        """
+        if self.query_log is None:
+            return contextlib.nullcontext()
+
+        return MemorySampler(self.cursor)
+
+    def _log_query(
+        self,
+        cur: duckdb.DuckDBPyConnection,
+        query: str,
+        execute_time: float,
+        rows: int = None,
+        bytes_written: int = None,
+        memory: MemorySampler = None,
+    ):
+        """
+        append a statement to the query log, if there is one, parsing it on cur, the cursor it ran on.
+        the statement already ran, so a failure to log it is a warning rather than an error
+        """
+        if self.query_log is None:
+            return
+
+        try:
+            self.query_log.record(
+                cur,
+                query,
+                execute_time,
+                rows=rows,
+                bytes_written=bytes_written,
+                sources=self._sources,
+                load_time=self.load_time,
+                peak_memory_bytes=memory.peak_bytes if memory else None,
             )
+        except Exception as e:
+            warnings.warn(f"failed to write to the query log: {e}")
+
+    def _monitor_load(self, table_name: str):
+        """
+        report progress while a table loads, if there is a progress callback
+        """
+        if self.on_progress is None:
+            return contextlib.nullcontext()
+
+        def on_update(percent: float):
+            self._load_progress.table_percent = percent
+            self.on_progress(self._load_progress)
+
+        return monitor_progress(self.db, on_update)
+
+    def _monitor_query(self, cur: duckdb.DuckDBPyConnection):
+        """
+        report progress while a query runs on cur, if there is a progress callback
+        """
+        if self.on_progress is None:
+            return contextlib.nullcontext()
+
+        start = time.perf_counter()
+
+        return monitor_progress(
+            cur,
+            lambda percent: self.on_progress(
+                QueryProgress(percent, time.perf_counter() - start)
+            ),
+        )
+
+    def _create_table_from_stdin(self):
+        """
+        create a table called "stdin" from standard input. DuckDB reads the stream a buffer at a time
+        as the table is created, so the input is never written to disk or held in memory as a whole.
+        Column types are inferred from the first rows rather than the whole input, since a stream
+        can't be read twice.
+
+        :raises ValueError: raised if no input format was given, the format is parquet, or the platform has no /dev/stdin
+        """
+        if self.input_format is None:
+            raise ValueError("an input format is required to read from standard input")
+
+        if self.input_format == FileType.PARQUET:
+            raise ValueError(
+                "parquet can't be read from standard input since reading it requires seeking"
+            )
+
+        if not os.path.exists("/dev/stdin"):
+            raise ValueError("reading from standard input is not supported on this platform")
+
+        read_func = READ_FUNCS[self.input_format]
+        options = self.source_options.get(STDIN_TABLE_NAME) or SourceOptions()
+        self._sources[STDIN_TABLE_NAME] = None
+
+        if self.input_format in (FileType.JSON, FileType.NDJSON) and options.has_json_options:
+            scan = options.json_scan(
+                "/dev/stdin", self.input_format == FileType.NDJSON, sample_all=False
+            )
+        else:
+            scan = f"{read_func}('/dev/stdin')"
+
+        self._load_table(STDIN_TABLE_NAME, STDIN_TABLE_NAME, scan)
+        self._source_info[STDIN_TABLE_NAME] = SourceInfo(
+            STDIN_TABLE_NAME,
+            None,
+            self.input_format,
+            load_time=self._load_stats[STDIN_TABLE_NAME].load_time,
+        )
 
     def _should_quote_table_name(self, table_name: str) -> bool:
         """
@@ -104,54 +975,467 @@ class FileDb:
             return True
 
         # then check if it's a reserved word - using DuckDB's function duckdb_keywords()
-        query = f"""
-            select *
-            from duckdb_keywords()
-            where keyword_name = '{table_name.lower()}'
-        """
+        if self._keywords is None:
+            res = self.db.execute("select keyword_name from duckdb_keywords()")
+            self._keywords = {rec[0] for rec in res.fetchall()}
 
-        res = self.db.execute(query)
-        if len(res.fetchall()) > 0:
-            return True
-        
-        return False
+        return table_name.lower() in self._keywords
 
-    def exec_query(self, query: str) -> QueryResult:
+    def exec_query(self, query: str, params: QueryParams = None) -> QueryResult:
         """
         Executes a query in the database created from the file. If more than one semicolon separated queries are given,
         the result will only be given for the last one. Use the exec_many_queries() to get the result from multiple queries.
 
         :param query: query to execute
         :type query: str
+        :param params: values to bind to the query's placeholders, a list for ? or $1 placeholders or a dict for $name placeholders, defaults to None
+        :type params: QueryParams, optional
         :return: result of executing the query
         :rtype: QueryResult
         """
-        res = self.db.execute(query)
-        return QueryResult(res.fetchnumpy())
+        with self._pool.checkout() as cur:
+            return self._exec_query_on(cur, query, params)
+
+    def _exec_query_on(
+        self, cur: duckdb.DuckDBPyConnection, query: str, params: QueryParams = None
+    ) -> QueryResult:
+        """
+        execute a query on a cursor that was checked out of the pool, reporting its progress,
+        recording it in the table versions and logging it, see exec_query()
+        """
+        try:
+            with self._monitor_query(cur), self._sample_memory() as memory:
+                start = time.perf_counter()
+                res = cur.execute(query, params)
+                result = QueryResult(res.fetchnumpy())
+        finally:
+            self._table_versions.record(query)
+
+        self._log_query(
+            cur, query, time.perf_counter() - start, rows=len(result.records), memory=memory
+        )
+
+        return result
+
+    def prepare(self, query: str) -> PreparedQuery:
+        """
+        Parse a query once so it can be executed many times with different parameters
+
+        :param query: a single SQL statement with ?, $1 or $name placeholders
+        :type query: str
+        :raises ValueError: raised if query is not exactly one statement
+        :return: statement handle to execute with PreparedQuery.exec_query()
+        :rtype: PreparedQuery
+        """
+        return PreparedQuery(self._pool, query, self._table_versions)
+
+    def iter_query(
+        self,
+        query: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_format: BatchFormat = BatchFormat.ROWS,
+        params: QueryParams = None,
+    ) -> Iterator[Any]:
+        """
+        Executes a query and yields the result in batches of at most batch_size rows, so only one batch
+        is held in memory at a time. The query holds a pooled cursor, which is released when the result
+        is exhausted or the generator is closed (e.g. breaking out of a for loop over it).
+
+        Batches are lists of row tuples for BatchFormat.ROWS, pyarrow RecordBatches for BatchFormat.ARROW
+        and dicts from column name to numpy array for BatchFormat.NUMPY. Arrow and numpy batches require pyarrow.
+
+        :param query: query to execute
+        :type query: str
+        :param batch_size: maximum number of rows per batch, defaults to DEFAULT_BATCH_SIZE
+        :type batch_size: int
+        :param batch_format: type of batch to yield, defaults to BatchFormat.ROWS
+        :type batch_format: BatchFormat
+        :param params: values to bind to the query's placeholders, see exec_query(), defaults to None
+        :type params: QueryParams, optional
+        :return: iterator over batches of the query result
+        :rtype: Iterator[Any]
+        """
+        cur = self.acquire_cursor()
+
+        try:
+            yield from self._start_query_on(cur, query, batch_size, batch_format, params)
+        finally:
+            self.release_cursor(cur)
+
+    def _start_query_on(
+        self,
+        cur: duckdb.DuckDBPyConnection,
+        query: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_format: BatchFormat = BatchFormat.ROWS,
+        params: QueryParams = None,
+    ) -> Iterator[Any]:
+        """
+        execute a query on a cursor that was checked out of the pool and return an iterator over the
+        batches of its result, see iter_query()
+        """
+        try:
+            cur.execute(query, params)
+        finally:
+            self._table_versions.record(query)
+
+        return _iter_batches(cur, batch_size, batch_format)
 
     def exec_many_queries(self, queries: List[str]) -> List[QueryResult]:
         results = [self.exec_query(query) for query in queries]
         return results
 
     def export_query(
-        self, query: str, output_filepath: str, filetype: int = FileType.CSV, **kwargs
+        self,
+        query: str,
+        output_filepath: str,
+        filetype: int = FileType.CSV,
+        params: QueryParams = None,
+        **kwargs,
     ):
         """
         Writes query result to a file
 
         :param query: query to execute
         :type query: str
-        :param output_filepath: path to output file
+        :param output_filepath: path to output file, or "-" for standard output
         :type output_filepath: str
-        :param filetype: output file format (either FileType.CSV or FileType.Parquet), defaults to FileType.CSV
+        :param filetype: output file format (FileType.CSV, FileType.JSON, FileType.NDJSON, FileType.PARQUET or FileType.ARROW), defaults to FileType.CSV
         :type filetype: FileType.CSV
+        :param params: values to bind to the query's placeholders, see exec_query(), defaults to None
+        :type params: QueryParams, optional
         """
-        if filetype == FileType.CSV:
-            delimiter = "," if "delimiter" not in kwargs else kwargs["delimiter"]
-            self.db.execute(
-                f"copy ({query}) to '{output_filepath}' (header, delimiter '{delimiter}')"
-            )
-        elif filetype == FileType.JSON:
-            self.db.execute(f"copy ({query}) to '{output_filepath}' (ARRAY true)")
-        elif filetype == FileType.PARQUET:
-            self.db.execute(f"copy ({query}) to '{output_filepath}'")
+        with self._pool.checkout() as cur:
+            self._export_query_on(cur, query, output_filepath, filetype, params, **kwargs)
+
+    def _export_query_on(
+        self,
+        cur: duckdb.DuckDBPyConnection,
+        query: str,
+        output_filepath: str,
+        filetype: int = FileType.CSV,
+        params: QueryParams = None,
+        **kwargs,
+    ):
+        """
+        write a query's result to a file using a cursor that was checked out of the pool, reporting
+        its progress, recording it in the table versions and logging it, see export_query()
+        """
+        try:
+            with self._monitor_query(cur), self._sample_memory() as memory:
+                start = time.perf_counter()
+                _export_query(cur, query, output_filepath, filetype, params, **kwargs)
+        finally:
+            self._table_versions.record(query)
+
+        bytes_written = None
+
+        if output_filepath != STDOUT_PATH and os.path.isfile(output_filepath):
+            bytes_written = os.path.getsize(output_filepath)
+
+        self._log_query(
+            cur,
+            query,
+            time.perf_counter() - start,
+            bytes_written=bytes_written,
+            memory=memory,
+        )
+
+    def export_query_to_stream(
+        self,
+        query: str,
+        out: BinaryIO,
+        filetype: int = FileType.CSV,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        params: QueryParams = None,
+        **kwargs,
+    ):
+        """
+        Writes query result to a binary stream such as standard output, batch_size rows at a time.
+        Arrow and Parquet output is written from record batches produced by DuckDB and requires
+        pyarrow. JSON output is serialized by DuckDB.
+
+        :param query: query to execute
+        :type query: str
+        :param out: binary file-like object to write to
+        :type out: BinaryIO
+        :param filetype: output format, defaults to FileType.CSV
+        :type filetype: FileType
+        :param batch_size: number of rows to fetch from DuckDB at a time, defaults to DEFAULT_BATCH_SIZE
+        :type batch_size: int
+        :param params: values to bind to the query's placeholders, see exec_query(), defaults to None
+        :type params: QueryParams, optional
+        """
+        try:
+            with self._pool.checkout() as cur:
+                _export_query_to_stream(
+                    cur, query, out, filetype, batch_size, params, **kwargs
+                )
+        finally:
+            self._table_versions.record(query)
+
+
+def _list_source_files(filepath: str) -> List[str]:
+    """
+    Get the files to load for a path, the path itself for a file or standard input, or every
+    accepted file in a directory
+    """
+    if filepath == STDIN_PATH or not os.path.isdir(filepath):
+        return [filepath]
+
+    # only take accepted file types
+    return [
+        os.path.join(filepath, file)
+        for file in os.listdir(filepath)
+        if os.path.splitext(file)[1].lower().replace(".", "") in FILE_EXT_MAP
+    ]
+
+
+def _table_name(filepath: str) -> str:
+    # tables are named after their file, without the extension
+    return os.path.splitext(os.path.basename(filepath).lower())[0]
+
+
+def _file_size(filepath: str) -> int:
+    # standard input has no size, and a missing file fails when it's loaded
+    if filepath is None or filepath == STDIN_PATH:
+        return 0
+
+    try:
+        return os.path.getsize(filepath)
+    except OSError:
+        return 0
+
+
+def sample_clause(sample: str) -> str:
+    """
+    Build the USING SAMPLE clause for a sample size. Percentages use bernoulli sampling so every row has
+    the same chance of being kept, a number of rows uses reservoir sampling. Either way, rows are sampled
+    as the file is read, so the full file is never stored.
+
+    :param sample: percentage of rows ("10%") or number of rows ("10000")
+    :type sample: str
+    :raises ValueError: raised if sample is not a valid sample size
+    :return: clause to append to a select statement
+    :rtype: str
+    """
+    match = SAMPLE_REGEX.match(str(sample))
+
+    if not match:
+        raise ValueError(
+            f"invalid sample size '{sample}', use a percentage like 10% or a number of rows like 10000"
+        )
+
+    size, is_percent = match.groups()
+
+    if is_percent:
+        if float(size) > 100:
+            raise ValueError(f"sample percentage must be at most 100, got {size}")
+
+        return f" using sample {size}% (bernoulli)"
+
+    if "." in size:
+        raise ValueError(f"number of rows to sample must be a whole number, got {size}")
+
+    return f" using sample {size} rows"
+
+
+def _iter_batches(
+    cur: duckdb.DuckDBPyConnection, batch_size: int, batch_format: BatchFormat
+) -> Iterator[Any]:
+    """
+    Yield the result of the query last executed on cur in batches, see FileDb.iter_query()
+
+    :param cur: cursor a query was executed on
+    :type cur: duckdb.DuckDBPyConnection
+    :param batch_size: maximum number of rows per batch
+    :type batch_size: int
+    :param batch_format: type of batch to yield
+    :type batch_format: BatchFormat
+    :return: iterator over batches of the query result
+    :rtype: Iterator[Any]
+    """
+    if batch_format == BatchFormat.ROWS:
+        while rows := cur.fetchmany(batch_size):
+            yield rows
+
+        return
+
+    _import_pyarrow()
+
+    for batch in _fetch_arrow_reader(cur, batch_size):
+        if batch.num_rows == 0:
+            continue
+
+        if batch_format == BatchFormat.ARROW:
+            yield batch
+        else:
+            yield {
+                name: col.to_numpy(zero_copy_only=False)
+                for name, col in zip(batch.schema.names, batch.columns)
+            }
+
+
+def _bind_copy_options(params: QueryParams, **values) -> tuple:
+    """
+    Add values used in a COPY statement (output path, delimiter) to the query's parameters so they are
+    bound rather than put in the SQL string. Named and positional parameters can't be mixed, so the
+    placeholders for the values follow the style of params.
+
+    :param params: the query's own parameters
+    :type params: QueryParams
+    :return: placeholder for each value by name, and the combined parameters
+    :rtype: tuple
+    """
+    if isinstance(params, dict):
+        placeholders = {name: f"$fq_{name}" for name in values}
+        bound = {**params, **{f"fq_{name}": value for name, value in values.items()}}
+    else:
+        # positional placeholders are bound in order, and the COPY options come after the query
+        placeholders = {name: "?" for name in values}
+        bound = list(params or []) + list(values.values())
+
+    return placeholders, bound
+
+
+def _export_query(
+    con: duckdb.DuckDBPyConnection,
+    query: str,
+    output_filepath: str,
+    filetype: int = FileType.CSV,
+    params: QueryParams = None,
+    **kwargs,
+):
+    """
+    Writes query result to a file using con, see FileDb.export_query()
+    """
+    if output_filepath == STDOUT_PATH:
+        # anything already printed needs to go out before the binary output
+        sys.stdout.flush()
+        _export_query_to_stream(
+            con, query, sys.stdout.buffer, filetype, params=params, **kwargs
+        )
+        sys.stdout.buffer.flush()
+    elif filetype == FileType.CSV:
+        delimiter = "," if "delimiter" not in kwargs else kwargs["delimiter"]
+        placeholders, bound = _bind_copy_options(
+            params, path=output_filepath, delimiter=delimiter
+        )
+        con.execute(
+            f"copy ({query}) to {placeholders['path']} (header, delimiter {placeholders['delimiter']})",
+            bound,
+        )
+    elif filetype in (FileType.JSON, FileType.NDJSON, FileType.PARQUET):
+        options = {
+            FileType.JSON: "ARRAY true",
+            FileType.NDJSON: "FORMAT json",
+            FileType.PARQUET: "FORMAT parquet",
+        }
+        placeholders, bound = _bind_copy_options(params, path=output_filepath)
+        con.execute(
+            f"copy ({query}) to {placeholders['path']} ({options[filetype]})", bound
+        )
+    elif filetype == FileType.ARROW:
+        with open(output_filepath, "wb") as outfile:
+            _export_query_to_stream(con, query, outfile, filetype, params=params)
+
+
+def _export_query_to_stream(
+    con: duckdb.DuckDBPyConnection,
+    query: str,
+    out: BinaryIO,
+    filetype: int = FileType.CSV,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    params: QueryParams = None,
+    **kwargs,
+):
+    """
+    Writes query result to a binary stream using con, see FileDb.export_query_to_stream()
+    """
+    if filetype == FileType.ARROW:
+        pa = _import_pyarrow()
+        reader = _fetch_arrow_reader(con.execute(query, params), batch_size)
+
+        with pa.ipc.new_stream(out, reader.schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+    elif filetype == FileType.PARQUET:
+        _import_pyarrow()
+        import pyarrow.parquet as pq
+
+        reader = _fetch_arrow_reader(con.execute(query, params), batch_size)
+
+        with pq.ParquetWriter(out, reader.schema) as writer:
+            for batch in reader:
+                writer.write_batch(batch)
+    elif filetype in (FileType.JSON, FileType.NDJSON):
+        res = con.execute(f"select to_json(q)::varchar from ({query}) q", params)
+        is_array = filetype == FileType.JSON
+        separator = b",\n" if is_array else b"\n"
+        is_first_batch = True
+
+        if is_array:
+            out.write(b"[\n")
+
+        while rows := res.fetchmany(batch_size):
+            if is_array and not is_first_batch:
+                out.write(separator)
+
+            out.write(separator.join(row[0].encode() for row in rows))
+
+            if not is_array:
+                out.write(separator)
+
+            is_first_batch = False
+
+        if is_array:
+            out.write(b"\n]\n")
+    elif filetype == FileType.CSV:
+        delimiter = "," if "delimiter" not in kwargs else kwargs["delimiter"]
+        res = con.execute(query, params)
+
+        # csv module needs a text stream, detach afterwards so closing the wrapper doesn't close out
+        text_out = io.TextIOWrapper(out, encoding="utf-8", newline="")
+        writer = csv.writer(text_out, delimiter=delimiter)
+        writer.writerow([col[0] for col in res.description])
+
+        while rows := res.fetchmany(batch_size):
+            writer.writerows(rows)
+
+        text_out.flush()
+        text_out.detach()
+
+
+def _import_pyarrow():
+    """
+    Import pyarrow, which is only needed for Arrow and Parquet stream output
+
+    :raises ImportError: raised if pyarrow is not installed
+    :return: the pyarrow module
+    """
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise ImportError(
+            "pyarrow is required for this output format, install it with: pip install pyarrow"
+        ) from e
+
+    return pyarrow
+
+
+def _fetch_arrow_reader(res: duckdb.DuckDBPyConnection, batch_size: int):
+    """
+    Get a pyarrow RecordBatchReader for an executed query
+
+    :param res: connection or cursor a query was executed on
+    :type res: duckdb.DuckDBPyConnection
+    :param batch_size: number of rows per record batch
+    :type batch_size: int
+    :return: reader over the query result
+    :rtype: pyarrow.RecordBatchReader
+    """
+    # fetch_record_batch was renamed to to_arrow_reader in newer DuckDB versions
+    if hasattr(res, "to_arrow_reader"):
+        return res.to_arrow_reader(batch_size)
+
+    return res.fetch_record_batch(batch_size)
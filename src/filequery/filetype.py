@@ -6,3 +6,4 @@ class FileType(Enum):
     PARQUET = 1
     JSON = 2
     NDJSON = 3
+    ARROW = 4
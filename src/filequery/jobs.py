@@ -0,0 +1,231 @@
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from .dependencies import check_dependencies, run_in_dependency_order
+from .filedb import FileDb
+from .filetype import FileType
+from .jobstatus import JobStatus
+from .statements import get_query_params, split_statements
+
+
+@dataclass
+class Job:
+    """
+    One step of a pipeline run against a shared FileDb
+
+    - name: unique name other jobs refer to it by
+    - query: semicolon separated queries, or query_file with the path to a file with them
+    - out_file: file to write each query's result to, if given there must be one for every query.
+      Without it, queries are only executed, e.g. to create tables later jobs read from
+    - out_file_format, delimiter: format of the output files
+    - params: values for $name placeholders in the queries
+    - depends_on: names of jobs that have to succeed before this one runs
+    """
+
+    name: str
+    query: str = None
+    query_file: str = None
+    out_file: List[str] = None
+    out_file_format: FileType = FileType.CSV
+    delimiter: str = ","
+    params: Dict[str, Any] = None
+    depends_on: List[str] = field(default_factory=list)
+
+    def __post_init__(self):
+        if bool(self.query) == bool(self.query_file):
+            raise ValueError(f"job {self.name} needs either a query or a query_file")
+
+        if isinstance(self.out_file, str):
+            self.out_file = [self.out_file]
+
+        if isinstance(self.depends_on, str):
+            self.depends_on = [self.depends_on]
+
+    def queries(self) -> List[str]:
+        if self.query_file:
+            with open(self.query_file) as f:
+                return split_statements(f.read())
+
+        return split_statements(self.query)
+
+
+@dataclass
+class JobResult:
+    name: str
+    status: JobStatus
+
+    # seconds since the epoch the job started at and how long it took, None for skipped jobs
+    started_at: float = None
+    duration: float = None
+    error: str = None
+
+    def __str__(self) -> str:
+        text = f"{self.name}: {self.status.name.lower()}"
+
+        if self.duration is not None:
+            text += f" in {self.duration:.2f}s"
+
+        if self.error:
+            text += f" ({self.error})"
+
+        return text
+
+
+def _check_jobs(jobs: List[Job]):
+    """
+    Check that job names are unique, dependencies exist and jobs don't depend on each other in a cycle
+
+    :raises ValueError: raised if the jobs can't be run
+    """
+    by_name = {}
+
+    for job in jobs:
+        if job.name in by_name:
+            raise ValueError(f"more than one job is called {job.name}")
+
+        by_name[job.name] = job
+
+    for job in jobs:
+        unknown = set(job.depends_on) - set(by_name)
+
+        if unknown:
+            raise ValueError(
+                f"job {job.name} depends on unknown jobs: {', '.join(sorted(unknown))}"
+            )
+
+    check_dependencies({job.name: job.depends_on for job in jobs}, "jobs")
+
+
+def _run_job(fdb: FileDb, job: Job, params: Dict[str, Any]):
+    queries = job.queries()
+
+    if job.out_file and len(job.out_file) != len(queries):
+        raise ValueError("number of queries and output files do not match")
+
+    params = {**(params or {}), **(job.params or {})}
+
+    for i, query in enumerate(queries):
+        query_params = get_query_params(query, params)
+
+        if job.out_file:
+            fdb.export_query(
+                query,
+                job.out_file[i],
+                job.out_file_format,
+                query_params,
+                delimiter=job.delimiter,
+            )
+        else:
+            fdb.exec_query(query, query_params)
+
+
+def run_jobs(
+    fdb: FileDb,
+    jobs: List[Job],
+    params: Dict[str, Any] = None,
+    max_workers: int = None,
+) -> List[JobResult]:
+    """
+    Run jobs against a FileDb, so the files are loaded once for all of them. A job starts once the jobs
+    it depends on succeeded, and jobs that don't depend on each other run at the same time on separate
+    cursors. A job that fails doesn't stop the others, but jobs depending on it are skipped.
+
+    :param fdb: FileDb to run the jobs against
+    :type fdb: FileDb
+    :param jobs: jobs to run
+    :type jobs: List[Job]
+    :param params: values for $name placeholders shared by all jobs, a job's own params take precedence, defaults to None
+    :type params: Dict[str, Any], optional
+    :param max_workers: maximum number of jobs to run at the same time, defaults to None (ThreadPoolExecutor's default)
+    :type max_workers: int, optional
+    :raises ValueError: raised if job names aren't unique, a job depends on one that doesn't exist, or jobs depend on each other in a cycle
+    :return: result of each job, in the order the jobs were given
+    :rtype: List[JobResult]
+    """
+    _check_jobs(jobs)
+
+    by_name = {job.name: job for job in jobs}
+
+    def run(name: str) -> JobResult:
+        job = by_name[name]
+        started_at = time.time()
+        start = time.perf_counter()
+
+        try:
+            _run_job(fdb, job, params)
+        except Exception as e:
+            return JobResult(
+                job.name,
+                JobStatus.FAILED,
+                started_at,
+                time.perf_counter() - start,
+                str(e),
+            )
+
+        return JobResult(
+            job.name, JobStatus.SUCCEEDED, started_at, time.perf_counter() - start
+        )
+
+    def skip(name: str, results: Dict[str, JobResult]) -> Optional[JobResult]:
+        # jobs depending on one that failed or was skipped are skipped too
+        failed = [
+            dep
+            for dep in by_name[name].depends_on
+            if results[dep].status != JobStatus.SUCCEEDED
+        ]
+
+        if not failed:
+            return None
+
+        return JobResult(
+            name,
+            JobStatus.SKIPPED,
+            error=f"depends on {', '.join(failed)}, which didn't succeed",
+        )
+
+    results = run_in_dependency_order(
+        {job.name: job.depends_on for job in jobs},
+        run,
+        skip,
+        max_workers,
+        "filequery-job",
+    )
+
+    return [results[job.name] for job in jobs]
+
+
+def write_report(results: List[JobResult], path: str):
+    """
+    Write the results of a run as JSON, with the status, start time, duration and error of each job
+
+    :param results: results from run_jobs()
+    :type results: List[JobResult]
+    :param path: path to write the report to
+    :type path: str
+    """
+    started = [result.started_at for result in results if result.started_at is not None]
+    finished = [
+        result.started_at + result.duration
+        for result in results
+        if result.started_at is not None
+    ]
+    report = {
+        "started_at": min(started, default=None),
+        "duration": max(finished) - min(started) if started else 0.0,
+        "succeeded": all(result.status == JobStatus.SUCCEEDED for result in results),
+        "jobs": [
+            {
+                "name": result.name,
+                "status": result.status.name.lower(),
+                "started_at": result.started_at,
+                "duration": result.duration,
+                "error": result.error,
+            }
+            for result in results
+        ],
+    }
+
+    with open(path, "w") as f:
+        json.dump(report, f, indent=4)
@@ -0,0 +1,9 @@
+from enum import Enum
+
+
+class JobStatus(Enum):
+    SUCCEEDED = 0
+    FAILED = 1
+
+    # not run because a job it depends on failed
+    SKIPPED = 2
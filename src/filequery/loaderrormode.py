@@ -0,0 +1,12 @@
+from enum import Enum
+
+
+class LoadErrorMode(Enum):
+    # stop at the first file that fails to load
+    FAIL = 0
+
+    # skip files that fail to load and load the rest
+    SKIP = 1
+
+    # like SKIP, but CSV rows that can't be parsed are moved to the load_rejects table instead of failing their file
+    QUARANTINE = 2
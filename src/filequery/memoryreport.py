@@ -0,0 +1,159 @@
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import duckdb
+from rich import markup
+from rich.console import Console
+from rich.table import Table
+
+from .tablestats import (database_block_size, estimate_table_bytes,
+                         format_bytes, quote_identifier)
+
+
+@dataclass
+class TableMemory:
+    table: str
+    row_count: int
+    column_count: int
+
+    # estimated size of the table's data, see estimate_table_bytes()
+    estimated_bytes: int
+
+    # number of column segments stored with each compression method, e.g. {"Uncompressed": 40, "RLE": 2}
+    compression: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def compressed_fraction(self) -> float:
+        segments = sum(self.compression.values())
+        uncompressed = self.compression.get("Uncompressed", 0)
+
+        return (segments - uncompressed) / segments if segments else 0.0
+
+
+@dataclass
+class MemoryReport:
+    """
+    Estimated size of each table along with the memory DuckDB's buffer manager is using
+
+    - memory_usage_bytes: memory held by the buffer manager, for tables, hash tables, sorts and so on
+    - temporary_storage_bytes: data spilled to disk because it didn't fit in memory_limit
+    - memory_by_tag: memory used for each kind of buffer, e.g. IN_MEMORY_TABLE or HASH_TABLE, tags using
+      no memory are left out
+    """
+
+    tables: List[TableMemory]
+    memory_usage_bytes: int
+    temporary_storage_bytes: int
+    memory_limit: str
+    memory_by_tag: Dict[str, int] = field(default_factory=dict)
+
+    def format_as_table(self):
+        """
+        Prints the report as a table, largest tables first
+        """
+        title = (
+            f"memory usage {format_bytes(self.memory_usage_bytes)} of {self.memory_limit}"
+            f", {format_bytes(self.temporary_storage_bytes)} spilled to disk"
+        )
+        table = Table(title=title)
+        table.add_column("table")
+        table.add_column("rows", justify="right")
+        table.add_column("columns", justify="right")
+        table.add_column("size (approx)", justify="right")
+        table.add_column("compressed %", justify="right")
+
+        for mem in sorted(self.tables, key=lambda mem: mem.estimated_bytes, reverse=True):
+            table.add_row(
+                markup.escape(mem.table),
+                f"{mem.row_count:,}",
+                str(mem.column_count),
+                format_bytes(mem.estimated_bytes),
+                f"{mem.compressed_fraction * 100:.1f}",
+            )
+
+        tags = Table(title="buffer manager")
+        tags.add_column("tag")
+        tags.add_column("memory", justify="right")
+
+        for tag, num_bytes in self.memory_by_tag.items():
+            tags.add_row(tag, format_bytes(num_bytes))
+
+        console = Console()
+        console.print(table)
+        console.print(tags)
+
+
+def build_memory_report(con: duckdb.DuckDBPyConnection) -> MemoryReport:
+    """
+    Estimate the size of every table and get the buffer manager's memory usage. Sizes are estimated
+    from the blocks each table's column segments are stored in, see estimate_table_bytes().
+
+    :param con: connection to the database
+    :type con: duckdb.DuckDBPyConnection
+    :return: memory report
+    :rtype: MemoryReport
+    """
+    con.execute(
+        """
+        select database_name, schema_name, table_name, estimated_size, column_count
+        from duckdb_tables()
+        where not internal
+        order by database_name, schema_name, table_name
+        """
+    )
+    table_recs = con.fetchall()
+
+    con.execute("select current_database()")
+    current_database = con.fetchone()[0]
+    block_sizes = {}
+    tables = []
+
+    for database, schema, name, row_count, column_count in table_recs:
+        qualified = ".".join(quote_identifier(part) for part in (database, schema, name))
+
+        # tables are listed the way they are queried
+        label = name if database == current_database and schema == "main" else f"{schema}.{name}"
+
+        if database not in block_sizes:
+            block_sizes[database] = database_block_size(con, database)
+
+        try:
+            estimated_bytes = estimate_table_bytes(con, qualified, block_sizes[database])
+
+            # validity masks are left out, they're small next to the data whatever their compression
+            con.execute(
+                """
+                select compression, count(*)
+                from pragma_storage_info(?)
+                where segment_type != 'VALIDITY'
+                group by compression
+                """,
+                [qualified],
+            )
+            compression = dict(con.fetchall())
+        except duckdb.Error:
+            # e.g. the table was dropped while the report was built
+            continue
+
+        tables.append(
+            TableMemory(label, row_count, column_count, estimated_bytes, compression)
+        )
+
+    con.execute(
+        """
+        select tag, memory_usage_bytes, temporary_storage_bytes
+        from duckdb_memory()
+        """
+    )
+    memory_recs = con.fetchall()
+
+    con.execute("select current_setting('memory_limit')")
+    memory_limit = con.fetchone()[0]
+
+    return MemoryReport(
+        tables,
+        sum(rec[1] for rec in memory_recs),
+        sum(rec[2] for rec in memory_recs),
+        memory_limit,
+        {rec[0]: rec[1] for rec in memory_recs if rec[1]},
+    )
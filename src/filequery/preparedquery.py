@@ -0,0 +1,66 @@
+from typing import Any, Dict, Sequence, Set, Union
+
+import duckdb
+
+from .cursorpool import CursorPool
+from .queryresult import QueryResult
+from .tablestats import TableVersions
+
+
+class PreparedQuery:
+    """
+    A single SQL statement that is parsed once and executed many times with different parameters.
+    Each execution runs on a cursor from the database's pool, so a PreparedQuery can be shared by
+    several threads.
+    """
+
+    def __init__(self, pool: CursorPool, query: str, versions: TableVersions = None):
+        """
+        PreparedQuery constructor, use FileDb.prepare() to create one
+
+        :param pool: pool of cursors to execute the statement on
+        :type pool: CursorPool
+        :param query: a single SQL statement with ?, $1 or $name placeholders
+        :type query: str
+        :param versions: where each execution is recorded, so cached table stats notice writes, defaults to None
+        :type versions: TableVersions, optional
+        :raises ValueError: raised if query is not exactly one statement
+        """
+        statements = duckdb.extract_statements(query)
+
+        if len(statements) != 1:
+            raise ValueError(
+                f"a prepared query must be a single statement, got {len(statements)}"
+            )
+
+        self.query = query
+        self._pool = pool
+        self._statement = statements[0]
+        self._versions = versions
+        self._tables_written = TableVersions.tables_written(query) if versions else set()
+
+    @property
+    def parameters(self) -> Set[str]:
+        """
+        Names of the statement's parameters, positional parameters are named by their position starting at 1
+        """
+        return set(self._statement.named_parameters)
+
+    def exec_query(
+        self, params: Union[Sequence[Any], Dict[str, Any]] = None
+    ) -> QueryResult:
+        """
+        Execute the statement with the given parameters
+
+        :param params: values to bind to the placeholders, a list for ? or $1 placeholders or a dict for $name placeholders, defaults to None
+        :type params: Union[Sequence[Any], Dict[str, Any]], optional
+        :return: result of executing the statement
+        :rtype: QueryResult
+        """
+        try:
+            with self._pool.checkout() as cur:
+                res = cur.execute(self._statement, params)
+                return QueryResult(res.fetchnumpy())
+        finally:
+            if self._tables_written:
+                self._versions.bump(self._tables_written)
@@ -0,0 +1,180 @@
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, TextIO, Union
+
+import duckdb
+
+from .tablestats import format_bytes
+
+# seconds between progress updates while a statement runs
+DEFAULT_PROGRESS_INTERVAL = 0.5
+
+# seconds between progress lines when the output isn't a terminal, so logs don't fill up with them
+NON_TERMINAL_PROGRESS_INTERVAL = 10.0
+
+
+@dataclass
+class LoadProgress:
+    files_total: int
+    bytes_total: int
+    files_loaded: int = 0
+    bytes_loaded: int = 0
+    rows_loaded: int = 0
+
+    # table being loaded, the size of its file and how far DuckDB is through reading it (0 to 100), None between tables
+    table: str = None
+    table_bytes: int = 0
+    table_percent: float = None
+
+    started: float = field(default_factory=time.perf_counter)
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def bytes_read(self) -> float:
+        # estimated from how far along the table being loaded is, so the rate doesn't sit at 0 during a big file
+        return self.bytes_loaded + self.table_bytes * (self.table_percent or 0.0) / 100
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes_read / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows_loaded / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        text = (
+            f"loaded {self.files_loaded}/{self.files_total} files"
+            f" ({format_bytes(self.bytes_read)} of {format_bytes(self.bytes_total)}, {self.rows_loaded:,} rows)"
+            f" at {format_bytes(self.bytes_per_second)}/s, {self.rows_per_second:,.0f} rows/s"
+        )
+
+        if self.table is not None:
+            text += f", loading {self.table}"
+
+            if self.table_percent is not None:
+                text += f" {self.table_percent:.0f}%"
+
+        return text
+
+
+@dataclass
+class QueryProgress:
+    # how far DuckDB is through the query (0 to 100), None if it can't tell
+    percent: float
+    elapsed: float
+
+    def __str__(self) -> str:
+        percent = f" {self.percent:.0f}%" if self.percent is not None else ""
+        return f"running query{percent} ({self.elapsed:.1f}s)"
+
+
+# called with LoadProgress while files are loaded and QueryProgress while a query runs
+ProgressCallback = Callable[[Union[LoadProgress, QueryProgress]], None]
+
+
+def enable_progress(con: duckdb.DuckDBPyConnection):
+    """
+    Make DuckDB track the progress of statements on a connection, so query_progress() returns
+    something other than -1. The setting is per connection, so it's needed on every cursor.
+
+    :param con: connection or cursor to enable progress tracking on
+    :type con: duckdb.DuckDBPyConnection
+    """
+    # DuckDB would otherwise draw its own progress bar
+    con.execute("set enable_progress_bar = true")
+    con.execute("set enable_progress_bar_print = false")
+
+
+@contextmanager
+def monitor_progress(
+    con: duckdb.DuckDBPyConnection,
+    on_update: Callable[[float], None],
+    interval: float = DEFAULT_PROGRESS_INTERVAL,
+) -> Iterator[None]:
+    """
+    Call on_update from a background thread with the percentage done of the statement running on con,
+    every interval seconds until the block exits. DuckDB only reports progress on connections it's
+    enabled on, see enable_progress().
+
+    :param con: connection the statement runs on
+    :type con: duckdb.DuckDBPyConnection
+    :param on_update: called with the percentage done (0 to 100)
+    :type on_update: Callable[[float], None]
+    :param interval: seconds between updates, defaults to DEFAULT_PROGRESS_INTERVAL
+    :type interval: float, optional
+    """
+    stop = threading.Event()
+
+    def poll():
+        while not stop.wait(interval):
+            percent = con.query_progress()
+
+            # -1 means no statement is running, or DuckDB can't tell how far along it is
+            if percent >= 0:
+                on_update(percent)
+
+    thread = threading.Thread(target=poll, name="filequery-progress", daemon=True)
+    thread.start()
+
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+class ProgressPrinter:
+    """
+    Progress callback that prints progress to a stream, standard error by default. On a terminal the
+    line is rewritten in place, otherwise a line is printed every NON_TERMINAL_PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, out: TextIO = None):
+        self.out = out or sys.stderr
+        self.is_terminal = self.out.isatty()
+        self._last_printed = None
+        self._last_width = 0
+
+    def __call__(self, progress: Union[LoadProgress, QueryProgress]):
+        text = str(progress)
+
+        if self.is_terminal:
+            # pad with spaces to cover the end of a longer previous line
+            self.out.write(f"\r{text:<{self._last_width}}")
+            self._last_width = len(text)
+        else:
+            now = time.perf_counter()
+            is_loaded = (
+                isinstance(progress, LoadProgress)
+                and progress.files_loaded == progress.files_total
+            )
+
+            # the line saying every file is loaded is always printed
+            is_due = (
+                self._last_printed is None
+                or now - self._last_printed >= NON_TERMINAL_PROGRESS_INTERVAL
+            )
+
+            if not is_due and not is_loaded:
+                return
+
+            self._last_printed = now
+            self.out.write(f"{text}\n")
+
+        self.out.flush()
+
+    def finish(self):
+        """
+        End the progress line, so later output starts on a new line
+        """
+        if self.is_terminal and self._last_width:
+            self.out.write("\n")
+            self.out.flush()
+            self._last_width = 0
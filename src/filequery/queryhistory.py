@@ -0,0 +1,233 @@
+import json
+import os
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import List, Tuple
+
+import duckdb
+
+# where history and cached results are kept unless another directory is given
+DEFAULT_HISTORY_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "filequery",
+)
+
+# maximum total size of cached results, least recently used results are removed first
+DEFAULT_MAX_CACHE_BYTES = 512 * 1024 * 1024
+
+# maximum number of rows kept for each result
+DEFAULT_MAX_RESULT_ROWS = 100000
+
+# maximum number of queries kept in the history
+DEFAULT_MAX_ENTRIES = 1000
+
+HISTORY_FILE_NAME = "history.json"
+
+
+@dataclass
+class HistoryEntry:
+    id: str
+    query: str
+    executed_at: float
+    duration: float
+    row_count: int
+
+    # file name of the cached result in the history directory, None if it wasn't cached or was evicted
+    result_file: str = None
+    result_size: int = 0
+    result_rows: int = 0
+
+    # last time the result was written or opened, for evicting the least recently used results
+    last_used: float = 0.0
+
+    @property
+    def is_cached(self) -> bool:
+        return self.result_file is not None
+
+
+class QueryHistory:
+    """
+    History of executed queries, saved to a directory so it's kept between sessions. Results of
+    queries can be cached as Parquet files so they can be opened again without running the query.
+    Cached results are limited to max_result_rows rows each and max_cache_bytes in total.
+    """
+
+    def __init__(
+        self,
+        directory: str = DEFAULT_HISTORY_DIR,
+        max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES,
+        max_result_rows: int = DEFAULT_MAX_RESULT_ROWS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        """
+        QueryHistory constructor
+
+        :param directory: directory to keep the history and cached results in, created if it doesn't exist, defaults to DEFAULT_HISTORY_DIR
+        :type directory: str, optional
+        :param max_cache_bytes: maximum total size of cached results, defaults to DEFAULT_MAX_CACHE_BYTES
+        :type max_cache_bytes: int, optional
+        :param max_result_rows: maximum number of rows cached for each result, defaults to DEFAULT_MAX_RESULT_ROWS
+        :type max_result_rows: int, optional
+        :param max_entries: maximum number of queries kept in the history, defaults to DEFAULT_MAX_ENTRIES
+        :type max_entries: int, optional
+        """
+        self.directory = directory
+        self.max_cache_bytes = max_cache_bytes
+        self.max_result_rows = max_result_rows
+        self.max_entries = max_entries
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _history_path(self) -> str:
+        return os.path.join(self.directory, HISTORY_FILE_NAME)
+
+    def entries(self) -> List[HistoryEntry]:
+        """
+        Get the history, most recent query first
+
+        :return: history entries
+        :rtype: List[HistoryEntry]
+        """
+        try:
+            with open(self._history_path()) as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return []
+
+        entries = [HistoryEntry(**record) for record in records]
+        entries.sort(key=lambda entry: entry.executed_at, reverse=True)
+
+        return entries
+
+    def _save(self, entries: List[HistoryEntry]):
+        # write to a temporary file first so a crash doesn't leave a partially written history
+        tmp_path = self._history_path() + ".tmp"
+
+        with open(tmp_path, "w") as f:
+            json.dump([asdict(entry) for entry in entries], f)
+
+        os.replace(tmp_path, self._history_path())
+
+    def _remove_result(self, entry: HistoryEntry):
+        if entry.result_file is None:
+            return
+
+        try:
+            os.remove(os.path.join(self.directory, entry.result_file))
+        except FileNotFoundError:
+            pass
+
+        entry.result_file = None
+        entry.result_size = 0
+        entry.result_rows = 0
+
+    def _evict(self, entries: List[HistoryEntry]):
+        # drop the oldest queries, then the least recently used results until the cache fits
+        for entry in entries[self.max_entries :]:
+            self._remove_result(entry)
+
+        del entries[self.max_entries :]
+
+        cached = sorted(
+            (entry for entry in entries if entry.is_cached),
+            key=lambda entry: entry.last_used,
+        )
+        total_size = sum(entry.result_size for entry in cached)
+
+        for entry in cached:
+            if total_size <= self.max_cache_bytes:
+                break
+
+            total_size -= entry.result_size
+            self._remove_result(entry)
+
+    def record(
+        self,
+        con: duckdb.DuckDBPyConnection,
+        query: str,
+        duration: float,
+        row_count: int,
+        result_table: str = None,
+    ) -> HistoryEntry:
+        """
+        Add a query to the history
+
+        :param con: connection to write the result with
+        :type con: duckdb.DuckDBPyConnection
+        :param query: query that was executed
+        :type query: str
+        :param duration: seconds the query took
+        :type duration: float
+        :param row_count: number of rows in the result
+        :type row_count: int
+        :param result_table: table holding the query's result, the first max_result_rows rows are cached if given, defaults to None
+        :type result_table: str, optional
+        :return: the new history entry
+        :rtype: HistoryEntry
+        """
+        now = time.time()
+        entry = HistoryEntry(uuid.uuid4().hex, query, now, duration, row_count)
+
+        if result_table is not None:
+            result_file = f"{entry.id}.parquet"
+            result_path = os.path.join(self.directory, result_file)
+            con.execute(
+                f"copy (select * from {result_table} limit {int(self.max_result_rows)}) to ? (format parquet)",
+                [result_path],
+            )
+
+            entry.result_file = result_file
+            entry.result_size = os.path.getsize(result_path)
+            entry.result_rows = min(row_count, self.max_result_rows)
+            entry.last_used = now
+
+        entries = [entry] + self.entries()
+        self._evict(entries)
+        self._save(entries)
+
+        return entry
+
+    def open_result(
+        self, con: duckdb.DuckDBPyConnection, entry: HistoryEntry
+    ) -> Tuple[List[str], List[tuple]]:
+        """
+        Read the cached result of a query
+
+        :param con: connection to read the result with
+        :type con: duckdb.DuckDBPyConnection
+        :param entry: history entry with a cached result
+        :type entry: HistoryEntry
+        :raises ValueError: raised if the result isn't cached
+        :return: column names and rows
+        :rtype: Tuple[List[str], List[tuple]]
+        """
+        if not entry.is_cached:
+            raise ValueError("the result of this query is not cached")
+
+        con.execute(
+            "select * from read_parquet(?)",
+            [os.path.join(self.directory, entry.result_file)],
+        )
+        col_names = [col[0] for col in con.description]
+        rows = con.fetchall()
+
+        # mark the result as recently used so it's evicted last
+        entries = self.entries()
+
+        for other in entries:
+            if other.id == entry.id:
+                other.last_used = time.time()
+
+        self._save(entries)
+
+        return col_names, rows
+
+    def clear(self):
+        """
+        Remove all queries and cached results from the history
+        """
+        for entry in self.entries():
+            self._remove_result(entry)
+
+        self._save([])
@@ -0,0 +1,250 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List
+
+import duckdb
+
+from .__version__ import __version__
+from .summarytables import find_table_references
+
+# seconds between samples of DuckDB's memory usage while a logged statement runs
+DEFAULT_MEMORY_SAMPLE_INTERVAL = 0.05
+
+# where the query log is written when no other path is given
+DEFAULT_QUERY_LOG_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")),
+    "filequery",
+    "query_log.ndjson",
+)
+
+
+@dataclass
+class QueryLogRecord:
+    """
+    One statement in the query log
+
+    - sql_hash: hash of the statement with literals removed, so runs of the same query with
+      different values can be compared
+    - sources: files the statement read from, as {"table", "path", "size_bytes"}
+    - rows: number of rows returned, None for exports
+    - bytes_written: size of the output file for exports, None otherwise
+    - load_time: seconds it took to load the files the statement ran against
+    - execute_time: seconds the statement took
+    - peak_memory_bytes: highest memory use of DuckDB's buffer manager sampled while the statement ran,
+      see MemorySampler
+    """
+
+    logged_at: str
+    sql_hash: str
+    query: str
+    sources: List[Dict[str, Any]] = field(default_factory=list)
+    rows: int = None
+    bytes_written: int = None
+    load_time: float = None
+    execute_time: float = None
+    peak_memory_bytes: int = None
+    filequery_version: str = __version__
+    duckdb_version: str = duckdb.__version__
+
+
+def _strip_literals(node: Any) -> Any:
+    # the parse tree without positions and constant values
+    if isinstance(node, dict):
+        if node.get("class") == "CONSTANT":
+            return "?"
+
+        return {
+            key: _strip_literals(value)
+            for key, value in node.items()
+            if key != "query_location"
+        }
+
+    if isinstance(node, list):
+        return [_strip_literals(value) for value in node]
+
+    return node
+
+
+def normalized_sql_hash(con: duckdb.DuckDBPyConnection, query: str) -> str:
+    """
+    Hash a statement so that formatting, comments and literal values don't change the hash, e.g.
+    "select * from t where x = 1" and "SELECT *\\nFROM t WHERE x = 2" hash the same.
+
+    :param con: connection to parse the statement on
+    :type con: duckdb.DuckDBPyConnection
+    :param query: statement to hash
+    :type query: str
+    :return: hex digest
+    :rtype: str
+    """
+    serialized = json.loads(
+        con.execute("select json_serialize_sql(?)", [query]).fetchone()[0]
+    )
+
+    # statements other than selects can't be serialized, so fall back to the text without extra whitespace
+    if serialized.get("error"):
+        normalized = re.sub(r"\s+", " ", query.strip().lower())
+    else:
+        normalized = json.dumps(_strip_literals(serialized["statements"]), sort_keys=True)
+
+    return hashlib.sha256(normalized.encode()).hexdigest()
+
+
+class MemorySampler:
+    """
+    Context manager that samples the memory DuckDB's buffer manager uses from a background thread while
+    a statement runs, for logging the statement's peak memory. The whole database is sampled, so
+    statements running at the same time on other cursors count too.
+    """
+
+    def __init__(
+        self,
+        cursor_factory: Callable[[], duckdb.DuckDBPyConnection],
+        interval: float = DEFAULT_MEMORY_SAMPLE_INTERVAL,
+    ):
+        """
+        MemorySampler constructor
+
+        :param cursor_factory: function that creates a new cursor on the database, memory is sampled on its own cursor while the statement runs on another
+        :type cursor_factory: Callable[[], duckdb.DuckDBPyConnection]
+        :param interval: seconds between samples, defaults to DEFAULT_MEMORY_SAMPLE_INTERVAL
+        :type interval: float, optional
+        """
+        self._cursor_factory = cursor_factory
+        self.interval = interval
+
+        # highest memory usage sampled, None until the block exits if no sample could be taken
+        self.peak_bytes: int = None
+
+        self._cur: duckdb.DuckDBPyConnection = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread = None
+
+    def _sample(self):
+        try:
+            self._cur.execute("select sum(memory_usage_bytes) from duckdb_memory()")
+            usage = int(self._cur.fetchone()[0] or 0)
+        except duckdb.Error:
+            return
+
+        self.peak_bytes = usage if self.peak_bytes is None else max(self.peak_bytes, usage)
+
+    def _poll(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> "MemorySampler":
+        self._cur = self._cursor_factory()
+        self._sample()
+        self._thread = threading.Thread(
+            target=self._poll, name="filequery-memory", daemon=True
+        )
+        self._thread.start()
+
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+        # memory still held at the end, e.g. by a result that wasn't fetched yet
+        self._sample()
+        self._cur.close()
+
+
+class QueryLog:
+    """
+    Log of executed statements with timing and resource use, for tracking how recurring queries perform
+    over time. Records are appended to a newline delimited JSON file, which can be queried with
+    filequery itself, e.g. filequery -f query_log.ndjson -q "select ... from query_log".
+    Appending a line at a time means several processes can write to the same log.
+    """
+
+    def __init__(self, path: str = DEFAULT_QUERY_LOG_PATH):
+        """
+        QueryLog constructor
+
+        :param path: path to the log file, created along with its directory if it doesn't exist, defaults to DEFAULT_QUERY_LOG_PATH
+        :type path: str, optional
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # a log is sent to the worker processes of sharded queries, the lock only guards this process's writes
+        return {"path": self.path}
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.path = state["path"]
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        con: duckdb.DuckDBPyConnection,
+        query: str,
+        execute_time: float,
+        rows: int = None,
+        bytes_written: int = None,
+        sources: Dict[str, str] = None,
+        load_time: float = None,
+        peak_memory_bytes: int = None,
+    ) -> QueryLogRecord:
+        """
+        Append a statement to the log
+
+        :param con: connection to parse the statement on
+        :type con: duckdb.DuckDBPyConnection
+        :param query: statement that was executed
+        :type query: str
+        :param execute_time: seconds the statement took
+        :type execute_time: float
+        :param rows: number of rows returned, defaults to None
+        :type rows: int, optional
+        :param bytes_written: size of the file the result was written to, defaults to None
+        :type bytes_written: int, optional
+        :param sources: mapping from table name to the file it was loaded from (None for standard input), tables the statement reads from are logged with their file sizes, defaults to None
+        :type sources: Dict[str, str], optional
+        :param load_time: seconds it took to load the files, defaults to None
+        :type load_time: float, optional
+        :param peak_memory_bytes: peak memory use while the statement ran, see MemorySampler, defaults to None
+        :type peak_memory_bytes: int, optional
+        :return: the logged record
+        :rtype: QueryLogRecord
+        """
+        record = QueryLogRecord(
+            datetime.now(timezone.utc).isoformat(),
+            normalized_sql_hash(con, query),
+            query,
+            rows=rows,
+            bytes_written=bytes_written,
+            load_time=load_time,
+            execute_time=execute_time,
+            peak_memory_bytes=peak_memory_bytes,
+        )
+
+        if sources:
+            try:
+                tables = find_table_references(con, query)
+            except ValueError:
+                tables = set()
+
+            for table in sorted(tables & set(sources)):
+                path = sources[table]
+                size = os.path.getsize(path) if path and os.path.exists(path) else None
+                record.sources.append({"table": table, "path": path, "size_bytes": size})
+
+        line = json.dumps(asdict(record)) + "\n"
+
+        # a single write to a file opened for appending isn't interleaved with writes from other processes
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+        return record
@@ -1,10 +1,20 @@
-from typing import Any, Dict, List
+import os
+import shlex
+import subprocess
+import sys
+from typing import Any, Dict, List, TextIO
 
 import numpy as np
 from rich import markup
 from rich.console import Console
 from rich.table import Table
 
+# default number of rows shown when pretty printing, half from the start and half from the end
+DEFAULT_MAX_ROWS = 100
+
+# number of records written at a time when streaming delimited output
+WRITE_BATCH_SIZE = 10000
+
 
 class QueryResult:
     def __init__(self, result: Dict[str, np.ndarray]):
@@ -56,30 +66,128 @@ class QueryResult:
 
         return f"{header_str}\n{records_str}"
 
-    def format_as_table(self, delimiter: str = None):
+    def write_delimited(self, out: TextIO, delimiter: str = ","):
+        """
+        Writes the query result to a file-like object as delimited text, a batch of records at a time
+        so the whole result never has to be built as a single string
+
+        :param out: file-like object to write to
+        :type out: TextIO
+        :param delimiter: delimiter to separate fields with, defaults to ','
+        :type delimiter: str
+        """
+        col_names = list(self.result_cols.keys())
+        out.write(delimiter.join(map(self.__format_field, col_names)) + "\n")
+
+        for i in range(0, len(self.records), WRITE_BATCH_SIZE):
+            batch = self.records[i : i + WRITE_BATCH_SIZE]
+            out.write(
+                "".join(
+                    delimiter.join(map(self.__format_field, rec)) + "\n"
+                    for rec in batch
+                )
+            )
+
+    def format_as_table(
+        self,
+        delimiter: str = None,
+        max_rows: int = DEFAULT_MAX_ROWS,
+        pager: bool = False,
+    ):
         """
         Formats and prints query result as a string in a tabular format
 
+        Only the first and last max_rows / 2 records are laid out in the "pretty" format. If the result
+        has more records than that, it is streamed as plain delimited text instead when standard output
+        is not a terminal, or when pager is True, through the pager in $PAGER (less by default).
+
         :param delimiter: specify a delimiter to format like a delimited file, if not specified, the result will be a "pretty" format, defaults to None
         :type delimiter: str, optional
-        :return: query result as a tabular-formatted string
-        :rtype: str
+        :param max_rows: maximum number of records to show in the "pretty" format, 0 or None shows every record, defaults to DEFAULT_MAX_ROWS
+        :type max_rows: int, optional
+        :param pager: show results with more than max_rows records in a pager, defaults to False
+        :type pager: bool, optional
         """
         if delimiter:
-            print(self.format_with_delimiter(delimiter))
+            self.write_delimited(sys.stdout, delimiter)
+            return
+
+        console = Console()
+        is_truncated = bool(max_rows) and len(self.records) > max_rows
+
+        if is_truncated and pager and console.is_terminal:
+            self._write_to_pager()
+        elif is_truncated and not console.is_terminal:
+            self.write_delimited(sys.stdout)
         else:
-            # otherwise create a table using rich
-            table = Table()
-            for col in self.result_cols:
-                justify = "left" if self.result_cols[col] == "object" else "right"
-                table.add_column(col, justify=justify)
+            console.print(self._build_table(max_rows if is_truncated else None))
+
+            # the table is usually narrower than this message, so print it below the table instead of as a caption
+            if is_truncated:
+                console.print(
+                    f"{len(self.records):,} rows ({max_rows:,} shown)", style="dim"
+                )
 
-            for rec in self.records:
+    def _build_table(self, max_rows: int = None) -> Table:
+        """
+        Create a rich table for the result. Column widths are measured from the records that get added,
+        so with max_rows set, only the head and tail of the result are ever stringified.
+
+        :param max_rows: number of records to include, split between the head and tail of the result, defaults to None (all records)
+        :type max_rows: int, optional
+        :return: table ready to be printed
+        :rtype: Table
+        """
+        num_records = len(self.records)
+
+        if max_rows:
+            head_rows = (max_rows + 1) // 2
+            tail_rows = max_rows - head_rows
+            head = self.records[:head_rows]
+            tail = self.records[num_records - tail_rows :] if tail_rows else []
+        else:
+            head = self.records
+            tail = []
+
+        table = Table()
+        for col in self.result_cols:
+            justify = "left" if self.result_cols[col] == "object" else "right"
+            table.add_column(col, justify=justify)
+
+        for rec in head:
+            stringified = [markup.escape(str(r)) for r in rec]
+            table.add_row(*stringified)
+
+        if tail:
+            table.add_row(*["..." for _ in self.result_cols])
+
+            for rec in tail:
                 stringified = [markup.escape(str(r)) for r in rec]
                 table.add_row(*stringified)
 
-            console = Console()
-            console.print(table)
+        return table
+
+    def _write_to_pager(self):
+        """
+        Streams the result as delimited text to a pager process. Falls back to standard output if the
+        pager can't be started.
+        """
+        pager_cmd = shlex.split(os.environ.get("PAGER", "less -S"))
+
+        try:
+            proc = subprocess.Popen(pager_cmd, stdin=subprocess.PIPE, text=True)
+        except OSError:
+            self.write_delimited(sys.stdout)
+            return
+
+        try:
+            self.write_delimited(proc.stdin)
+            proc.stdin.close()
+        except BrokenPipeError:
+            # user quit the pager before reading everything
+            pass
+
+        proc.wait()
 
     def save_to_file(self, filepath: str, delimiter: str = ","):
         """
@@ -91,4 +199,4 @@ class QueryResult:
         :type filepath: str
         """
         with open(filepath, "w") as outfile:
-            outfile.write(self.format_with_delimiter(delimiter))
+            self.write_delimited(outfile, delimiter)
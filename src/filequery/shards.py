@@ -0,0 +1,396 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import duckdb
+
+from .filedb import FileDb, QueryParams
+from .tablestats import quote_identifier
+
+# table the results of every shard are collected in, merge queries read from it
+SHARD_RESULTS_TABLE = "shard_results"
+
+# aggregates whose results for each shard can be combined into the result for all shards,
+# mapped to the aggregate that combines them
+MERGE_AGGREGATES = {
+    "sum": "sum",
+    "count": "sum",
+    "count_star": "sum",
+    "min": "min",
+    "max": "max",
+    "bool_and": "bool_and",
+    "bool_or": "bool_or",
+}
+
+
+def _quote_path(path: str) -> str:
+    # ATTACH can't take the path as a parameter
+    escaped = path.replace("'", "''")
+    return f"'{escaped}'"
+
+
+def _query_shard(
+    shard_dir: str,
+    query: str,
+    params: QueryParams,
+    out_path: str,
+    filedb_kwargs: Dict[str, Any],
+) -> int:
+    """
+    Load a shard and write the query's result for it to a database file, runs in a worker process.
+    Returns the number of rows in the result.
+    """
+    try:
+        fdb = FileDb(shard_dir, **filedb_kwargs)
+
+        try:
+            fdb.db.execute(f"attach {_quote_path(out_path)} as shard_out")
+
+            with fdb._sample_memory() as memory:
+                start = time.perf_counter()
+                fdb.db.execute(
+                    f"create table shard_out.{SHARD_RESULTS_TABLE} as {query}", params
+                )
+
+            execute_time = time.perf_counter() - start
+            fdb.db.execute(f"select count(*) from shard_out.{SHARD_RESULTS_TABLE}")
+            rows = fdb.db.fetchone()[0]
+
+            # each shard is logged with its own files, timing and memory
+            fdb._log_query(fdb.db, query, execute_time, rows=rows, memory=memory)
+
+            return rows
+        finally:
+            fdb.close()
+    except Exception as e:
+        # DuckDB's exceptions don't always survive being sent back to the parent process
+        raise RuntimeError(f"query failed for shard {shard_dir}: {e}") from None
+
+
+def query_shards(
+    shard_dirs: List[str],
+    query: str,
+    params: QueryParams = None,
+    max_workers: int = None,
+    memory_limit: str = None,
+    **kwargs,
+) -> FileDb:
+    """
+    Run a query against each of several directories of files (shards) in separate processes, each with
+    its own FileDb, so only one shard per worker has to fit in memory at a time. The results of all
+    shards are collected in a table called shard_results in the returned FileDb, see build_merge_query()
+    for combining them into the result of the query over every shard.
+
+    :param shard_dirs: directories to load, each one is loaded into its own FileDb
+    :type shard_dirs: List[str]
+    :param query: query to run against each shard
+    :type query: str
+    :param params: values for placeholders in the query, defaults to None
+    :type params: QueryParams, optional
+    :param max_workers: number of shards to query at the same time, defaults to None (number of CPUs)
+    :type max_workers: int, optional
+    :param memory_limit: DuckDB memory limit for each worker, e.g. "4GB", defaults to None (DuckDB's default, a share of the system memory)
+    :type memory_limit: str, optional
+    :param kwargs: other arguments for each shard's FileDb, e.g. sample, source_options or query_log
+    :raises RuntimeError: raised if the query fails for a shard
+    :return: FileDb holding the results of every shard
+    :rtype: FileDb
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+
+    # every worker would otherwise start a thread per CPU
+    config = {"threads": max(1, (os.cpu_count() or 1) // max_workers)}
+
+    if memory_limit:
+        config["memory_limit"] = memory_limit
+
+    filedb_kwargs = {**kwargs, "config": {**config, **kwargs.get("config", {})}}
+    tmp_dir = tempfile.mkdtemp(prefix="filequery-shards-")
+
+    try:
+        out_paths = [
+            os.path.join(tmp_dir, f"shard_{i}.duckdb") for i in range(len(shard_dirs))
+        ]
+
+        # forking a process that has DuckDB's threads running isn't safe
+        with ProcessPoolExecutor(
+            max_workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _query_shard, shard_dir, query, params, out_path, filedb_kwargs
+                )
+                for shard_dir, out_path in zip(shard_dirs, out_paths)
+            ]
+
+            for future in futures:
+                future.result()
+
+        fdb = FileDb()
+        parts = []
+
+        for i, out_path in enumerate(out_paths):
+            fdb.db.execute(f"attach {_quote_path(out_path)} as shard_{i} (read_only)")
+            parts.append(f"select * from shard_{i}.{SHARD_RESULTS_TABLE}")
+
+        fdb.db.execute(
+            f"create table {SHARD_RESULTS_TABLE} as {' union all by name '.join(parts)}"
+        )
+
+        for i in range(len(out_paths)):
+            fdb.db.execute(f"detach shard_{i}")
+
+        return fdb
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _walk(node: Any):
+    # every dict in a serialized query
+    nodes = [node]
+
+    while nodes:
+        node = nodes.pop()
+
+        if isinstance(node, dict):
+            yield node
+            nodes.extend(node.values())
+        elif isinstance(node, list):
+            nodes.extend(node)
+
+
+def build_merge_query(con: duckdb.DuckDBPyConnection, query: str) -> str:
+    """
+    Build a query that combines the results of query for each shard, read from the shard_results table,
+    into its result over all shards. Results of plain selects are concatenated. For aggregate queries,
+    the aggregates are computed again over the results of the shards, which works for aggregates that
+    can be combined this way (sum, count, min, max, bool_and and bool_or) but not for e.g. avg or
+    count(distinct). ORDER BY and LIMIT are applied again to the combined result.
+
+    :param con: connection with the shard_results table, see query_shards()
+    :type con: duckdb.DuckDBPyConnection
+    :param query: query that was run against each shard
+    :type query: str
+    :raises ValueError: raised if the results of the shards can't be combined into the result of the query
+    :return: query to run against shard_results
+    :rtype: str
+    """
+    serialized = json.loads(
+        con.execute("select json_serialize_sql(?)", [query]).fetchone()[0]
+    )
+
+    if serialized.get("error"):
+        raise ValueError(serialized.get("error_message", "failed to parse query"))
+
+    if len(serialized["statements"]) != 1:
+        raise ValueError("only a single query can be run against shards")
+
+    node = serialized["statements"][0]["node"]
+
+    if node["type"] != "SELECT_NODE":
+        raise _merge_error("the query isn't a single SELECT")
+
+    con.execute(f"select * from {SHARD_RESULTS_TABLE} limit 0")
+    columns = [col[0] for col in con.description]
+
+    con.execute(
+        "select distinct function_name from duckdb_functions() where function_type = 'aggregate'"
+    )
+    aggregates = {rec[0] for rec in con.fetchall()} | {"count_star"}
+
+    select_list = node["select_list"]
+    modifiers = {modifier["type"]: modifier for modifier in node["modifiers"]}
+
+    def is_aggregate(expr: Dict[str, Any]) -> bool:
+        return expr.get("class") == "FUNCTION" and expr["function_name"] in aggregates
+
+    if any(
+        expr.get("class") == "WINDOW" for item in select_list for expr in _walk(item)
+    ):
+        raise _merge_error("the query has window functions")
+
+    if node["qualify"]:
+        raise _merge_error("the query has a QUALIFY clause")
+
+    has_aggregates = any(
+        is_aggregate(expr) for item in select_list for expr in _walk(item)
+    )
+    is_grouped = (
+        has_aggregates
+        or bool(node["group_expressions"])
+        or node["aggregate_handling"] == "FORCE_AGGREGATES"
+    )
+
+    if is_grouped:
+        if node["having"]:
+            raise _merge_error("the query has a HAVING clause")
+
+        if "DISTINCT_MODIFIER" in modifiers or "LIMIT_MODIFIER" in modifiers:
+            # each shard only has part of every group, so this would drop rows before they're combined
+            raise _merge_error("DISTINCT and LIMIT can't be used with GROUP BY")
+
+        if len(select_list) != len(columns) or any(
+            item.get("class") == "STAR" for item in select_list
+        ):
+            raise _merge_error("* can't be used with GROUP BY")
+
+        if len(node["group_sets"]) > 1:
+            # the subtotal rows of ROLLUP, CUBE and GROUPING SETS can't be told apart after merging
+            raise _merge_error("the query has more than one grouping set")
+
+        if node["aggregate_handling"] != "FORCE_AGGREGATES":
+            _check_group_keys(node["group_expressions"], select_list, columns, is_aggregate)
+
+        items = []
+        group_by = []
+
+        for item, column in zip(select_list, columns):
+            quoted = quote_identifier(column)
+
+            if is_aggregate(item):
+                merge_func = MERGE_AGGREGATES.get(item["function_name"])
+
+                if merge_func is None or item["distinct"]:
+                    raise _merge_error(
+                        f"{column} can't be computed from the result of each shard"
+                    )
+
+                # the sum of counts is a HUGEINT, but counts are BIGINT
+                if item["function_name"] in ("count", "count_star"):
+                    items.append(f"cast(sum({quoted}) as bigint) as {quoted}")
+                else:
+                    items.append(f"{merge_func}({quoted}) as {quoted}")
+            elif any(is_aggregate(expr) for expr in _walk(item)):
+                raise _merge_error(f"{column} is an expression over aggregates")
+            else:
+                items.append(quoted)
+                group_by.append(quoted)
+
+        merge_query = f"select {', '.join(items)} from {SHARD_RESULTS_TABLE}"
+
+        if group_by:
+            merge_query += f" group by {', '.join(group_by)}"
+    else:
+        distinct = "distinct " if "DISTINCT_MODIFIER" in modifiers else ""
+        merge_query = f"select {distinct}* from {SHARD_RESULTS_TABLE}"
+
+    if "ORDER_MODIFIER" in modifiers:
+        order_by = _merge_order_by(modifiers["ORDER_MODIFIER"], columns)
+
+        if order_by is None:
+            raise _merge_error("ORDER BY can only use columns of the result")
+
+        merge_query += f" order by {order_by}"
+
+    if "LIMIT_MODIFIER" in modifiers:
+        limit = modifiers["LIMIT_MODIFIER"]
+
+        # every shard skipped its own first rows
+        if limit["offset"] is not None or limit["limit"].get("class") != "CONSTANT":
+            raise _merge_error(
+                "only LIMIT with a constant and no OFFSET can be merged"
+            )
+
+        merge_query += f" limit {int(limit['limit']['value']['value'])}"
+
+    return merge_query
+
+
+def _merge_error(reason: str) -> ValueError:
+    return ValueError(
+        f"can't merge the results of the shards, {reason}, give a merge query instead"
+    )
+
+
+def _check_group_keys(
+    group_expressions: List[Dict[str, Any]],
+    select_list: List[Dict[str, Any]],
+    columns: List[str],
+    is_aggregate: Callable[[Dict[str, Any]], bool],
+):
+    # the merge query groups by the non-aggregate columns of the result, which only gives the same
+    # groups as the query if those are exactly what the query groups by
+    lower_columns = [column.lower() for column in columns]
+    keys = [
+        position
+        for position, item in enumerate(select_list)
+        if not any(is_aggregate(expr) for expr in _walk(item))
+    ]
+    grouped = set()
+
+    for expr in group_expressions:
+        position = None
+
+        if expr.get("class") == "COLUMN_REF" and len(expr["column_names"]) == 1:
+            name = expr["column_names"][0].lower()
+            position = lower_columns.index(name) if name in lower_columns else None
+        elif expr.get("class") == "CONSTANT" and isinstance(expr["value"]["value"], int):
+            position = expr["value"]["value"] - 1
+
+        if position not in keys:
+            # e.g. group by t.col2 or an expression repeated in the select list
+            position = next(
+                (key for key in keys if _same_expression(select_list[key], expr)), None
+            )
+
+        if position is None:
+            raise _merge_error("the query groups by expressions that aren't in its result")
+
+        grouped.add(position)
+
+    for key in keys:
+        if key not in grouped and any(
+            expr.get("class") == "COLUMN_REF" for expr in _walk(select_list[key])
+        ):
+            # e.g. col2 % 2 when grouping by col2, each shard can have several rows with the same value
+            raise _merge_error(f"{columns[key]} isn't one of the GROUP BY expressions")
+
+
+def _same_expression(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+    def strip(node):
+        if isinstance(node, dict):
+            return {
+                key: strip(value)
+                for key, value in node.items()
+                if key not in ("alias", "query_location")
+            }
+        elif isinstance(node, list):
+            return [strip(value) for value in node]
+
+        return node
+
+    return strip(a) == strip(b)
+
+
+def _merge_order_by(
+    order_modifier: Dict[str, Any], columns: List[str]
+) -> Optional[str]:
+    # ORDER BY for the merge query, or None if it doesn't only order by output columns (by name or position)
+    lower_columns = {column.lower(): column for column in columns}
+    orders = []
+
+    for order in order_modifier["orders"]:
+        expr = order["expression"]
+        column = None
+
+        if expr.get("class") == "COLUMN_REF" and len(expr["column_names"]) == 1:
+            column = lower_columns.get(expr["column_names"][0].lower())
+        elif expr.get("class") == "CONSTANT" and isinstance(expr["value"]["value"], int):
+            position = expr["value"]["value"]
+            column = columns[position - 1] if 0 < position <= len(columns) else None
+
+        if column is None:
+            return None
+
+        direction = {"ASCENDING": " asc", "DESCENDING": " desc"}.get(order["type"], "")
+        nulls = {"NULLS_FIRST": " nulls first", "NULLS_LAST": " nulls last"}.get(
+            order["null_order"], ""
+        )
+        orders.append(f"{quote_identifier(column)}{direction}{nulls}")
+
+    return ", ".join(orders)
@@ -0,0 +1,206 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Union
+
+from .filetype import FileType
+from .tablestats import quote_identifier
+
+# values for SourceOptions.json_format, passed on to DuckDB's read_json
+JSON_FORMATS = ("auto", "array", "newline_delimited", "unstructured")
+
+
+def _quote_literal(value: str) -> str:
+    escaped = value.replace("'", "''")
+    return f"'{escaped}'"
+
+
+@dataclass
+class SourceOptions:
+    """
+    Options for how a table is loaded from its file
+
+    - order_by: columns or expressions to sort the table by while loading it. DuckDB keeps min/max values
+      for each block of rows, so filters on these columns can skip most of the table
+    - indexes: columns to build an ART index on after loading, each index is a column or a list of columns
+    - columns: only load these columns
+    - exclude: load every column except these
+    - where: only load rows matching this SQL condition
+
+    columns, exclude and where are pushed down into the scan of the file, so columns that aren't
+    loaded are not parsed and, for parquet, row groups that can't match the condition are skipped.
+
+    Options for JSON and NDJSON files:
+
+    - json_columns: mapping from column name to DuckDB type, e.g. {"id": "BIGINT", "payload": "JSON"}.
+      The structure isn't inferred from the file, which otherwise means reading all of it an extra time
+    - json_format: one of JSON_FORMATS, "array" for a top level array of records, "newline_delimited" for
+      one record per line, which is read in parallel. Defaults to newline_delimited for .ndjson files
+      and auto for .json files
+    - maximum_object_size: maximum size in bytes of a single record, DuckDB's default is 16MB
+    - json_paths: mapping from column name to a JSON path, e.g. {"user_id": "$.user.id"}. Records are
+      read as raw JSON without inferring their structure and only these paths are loaded, as text
+    - json_unnest: path to an array in each record, e.g. "$.items". Each element of the array becomes a
+      row, and json_paths are taken from the elements rather than the records
+    """
+
+    order_by: List[str] = None
+    indexes: List[Union[str, List[str]]] = None
+    columns: List[str] = None
+    exclude: List[str] = None
+    where: str = None
+    json_columns: Dict[str, str] = None
+    json_format: str = None
+    maximum_object_size: int = None
+    json_paths: Dict[str, str] = None
+    json_unnest: str = None
+
+    def __post_init__(self):
+        if self.columns and self.exclude:
+            raise ValueError("only one of columns and exclude can be given")
+
+        if self.json_format is not None and self.json_format not in JSON_FORMATS:
+            raise ValueError(f"json_format must be one of: {', '.join(JSON_FORMATS)}")
+
+        if self.json_columns and self.json_paths:
+            raise ValueError("only one of json_columns and json_paths can be given")
+
+        if self.json_unnest and not self.json_paths:
+            raise ValueError("json_unnest needs json_paths to pick values from the array elements")
+
+        if isinstance(self.order_by, str):
+            self.order_by = [self.order_by]
+
+        self.indexes = [
+            [index] if isinstance(index, str) else list(index)
+            for index in self.indexes or []
+        ]
+
+    def select_list(self) -> str:
+        """
+        Build the select list for loading the table
+
+        :return: columns to select
+        :rtype: str
+        """
+        if self.columns:
+            return ", ".join(quote_identifier(col) for col in self.columns)
+
+        if self.exclude:
+            excluded = ", ".join(quote_identifier(col) for col in self.exclude)
+            return f"* exclude ({excluded})"
+
+        return "*"
+
+    @property
+    def has_json_options(self) -> bool:
+        return any(
+            option is not None
+            for option in (
+                self.json_columns,
+                self.json_format,
+                self.maximum_object_size,
+                self.json_paths,
+                self.json_unnest,
+            )
+        )
+
+    def json_scan(
+        self, path: str, newline_delimited: bool = False, sample_all: bool = True
+    ) -> str:
+        """
+        Build the table function call that reads a JSON file with these options
+
+        :param path: path to the file
+        :type path: str
+        :param newline_delimited: whether the file is NDJSON, used when json_format isn't given, defaults to False
+        :type newline_delimited: bool, optional
+        :param sample_all: whether to infer types from every record rather than the first ones when no json_columns are given, defaults to True
+        :type sample_all: bool, optional
+        :return: table function call, or a subquery when only json_paths are loaded
+        :rtype: str
+        """
+        args = [_quote_literal(path)]
+        json_format = self.json_format or ("newline_delimited" if newline_delimited else None)
+
+        if json_format:
+            args.append(f"format = '{json_format}'")
+
+        if self.maximum_object_size:
+            args.append(f"maximum_object_size = {int(self.maximum_object_size)}")
+
+        if self.json_paths:
+            # each record as a single JSON value, nothing is inferred
+            scan = f"read_json_objects({', '.join(args)})"
+
+            if self.json_unnest:
+                scan = f"(select unnest(cast(json_extract(json, {_quote_literal(self.json_unnest)}) as json[])) as json from {scan})"
+
+            extracted = ", ".join(
+                f"json ->> {_quote_literal(json_path)} as {quote_identifier(column)}"
+                for column, json_path in self.json_paths.items()
+            )
+
+            return f"(select {extracted} from {scan})"
+
+        if self.json_columns:
+            structure = ", ".join(
+                f"{_quote_literal(column)}: {_quote_literal(column_type)}"
+                for column, column_type in self.json_columns.items()
+            )
+            args.append(f"columns = {{{structure}}}")
+        elif sample_all:
+            # sample every record so types are inferred from the whole file
+            args.append("sample_size = -1")
+
+        return f"read_json({', '.join(args)})"
+
+
+@dataclass
+class SourceLoadStats:
+    table: str
+    load_time: float
+    order_by: List[str] = None
+    index_times: Dict[str, float] = field(default_factory=dict)
+
+    def __str__(self) -> str:
+        text = f"{self.table}: loaded in {self.load_time:.2f}s"
+
+        if self.order_by:
+            text += f" (sorted by {', '.join(self.order_by)})"
+
+        for columns, seconds in self.index_times.items():
+            text += f", index on ({columns}) built in {seconds:.2f}s"
+
+        return text
+
+
+@dataclass
+class SourceInfo:
+    """
+    A table loaded from a file, see FileDb.sources()
+
+    - path: file the table was loaded from, None for standard input
+    - size_bytes, mtime: size and modification time of the file when it was loaded, used to tell
+      whether refreshing the table would change it
+    - load_time: seconds it took to load the table, including sorting it and building its indexes
+    """
+
+    table: str
+    path: str
+    format: FileType
+    size_bytes: int = None
+    mtime: float = None
+    load_time: float = None
+
+
+@dataclass
+class LoadError:
+    """
+    A file that was skipped because it failed to load, see FileDb.load_errors()
+    """
+
+    table: str
+    path: str
+    error: str
+
+    def __str__(self) -> str:
+        return f"failed to load {self.path}: {self.error}"
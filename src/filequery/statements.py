@@ -0,0 +1,301 @@
+import re
+from bisect import bisect_right
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import duckdb
+
+# tokens that matter for finding statement boundaries, everything else is matched by "other"
+# strings, quoted identifiers, comments and dollar quoted strings may contain semicolons,
+# so they're consumed as a single token. unterminated tokens run to the end of the text
+_TOKEN_REGEX = re.compile(
+    r"""
+    (?P<ws>\s+)
+    | (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+    | (?P<estring>(?<![\w$])[eE]'(?:\\.|''|[^'\\])*(?:'|\Z))
+    | (?P<string>'(?:''|[^'])*(?:'|\Z))
+    | (?P<ident>"(?:""|[^"])*(?:"|\Z))
+    | (?P<dollar>\$(?P<tag>[A-Za-z_][A-Za-z0-9_]*|)\$.*?(?:\$(?P=tag)\$|\Z))
+    | (?P<semi>;)
+    | (?P<other>(?:[^\s;'"$/\-eE]|[eE](?!'))+|.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+# unquoted identifiers and keywords within "other" tokens
+_WORD_REGEX = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*")
+
+
+class Statement(NamedTuple):
+    """
+    Location of a single statement in a SQL string. Offsets are character indices into the text.
+
+    - start: first character after the previous semicolon (or 0)
+    - end: index of the terminating semicolon, or the length of the text if there isn't one
+    - code_start/code_end: span of the statement without surrounding whitespace and comments,
+      both are None if the statement only contains whitespace and comments
+    """
+
+    start: int
+    end: int
+    code_start: Optional[int]
+    code_end: Optional[int]
+
+    @property
+    def is_empty(self) -> bool:
+        return self.code_start is None
+
+    def shift(self, delta: int) -> "Statement":
+        if self.is_empty:
+            return Statement(self.start + delta, self.end + delta, None, None)
+
+        return Statement(
+            self.start + delta,
+            self.end + delta,
+            self.code_start + delta,
+            self.code_end + delta,
+        )
+
+
+def _lex_statements(text: str, pos: int):
+    """
+    Generator of statements in text starting at pos. pos must be the start of a statement.
+    The last statement yielded always ends at the end of text.
+
+    :param text: SQL text
+    :type text: str
+    :param pos: offset to start lexing from
+    :type pos: int
+    """
+    start = pos
+    code_start = None
+    code_end = None
+    text_len = len(text)
+
+    while pos < text_len:
+        match = _TOKEN_REGEX.match(text, pos)
+        kind = match.lastgroup
+        pos = match.end()
+
+        if kind == "semi":
+            yield Statement(start, pos - 1, code_start, code_end)
+            start = pos
+            code_start = None
+            code_end = None
+        elif kind != "ws" and kind != "comment":
+            if code_start is None:
+                code_start = match.start()
+            code_end = pos
+
+    yield Statement(start, text_len, code_start, code_end)
+
+
+def split_statements(sql: str) -> List[str]:
+    """
+    Split SQL into individual statements. Semicolons inside strings, quoted identifiers, comments
+    and dollar quoted strings don't end a statement. Statements that are empty or only contain
+    comments are dropped.
+
+    :param sql: SQL to split
+    :type sql: str
+    :return: list of statements without the terminating semicolons
+    :rtype: List[str]
+    """
+    return [
+        sql[stmt.code_start : stmt.code_end]
+        for stmt in _lex_statements(sql, 0)
+        if not stmt.is_empty
+    ]
+
+
+def referenced_names(sql: str) -> Set[str]:
+    """
+    Get every identifier and keyword in SQL, lowercased, leaving out strings and comments. Quoted
+    identifiers are unquoted. Used to find the tables a statement could touch without parsing it.
+
+    :param sql: SQL text
+    :type sql: str
+    :return: lowercased names
+    :rtype: Set[str]
+    """
+    names = set()
+    pos = 0
+
+    while pos < len(sql):
+        match = _TOKEN_REGEX.match(sql, pos)
+        kind = match.lastgroup
+        pos = match.end()
+
+        if kind == "ident":
+            # an unterminated identifier runs to the end of the text without a closing quote
+            quoted = match.group()
+            unquoted = quoted[1:-1] if len(quoted) > 1 and quoted.endswith('"') else quoted[1:]
+            names.add(unquoted.replace('""', '"').lower())
+        elif kind == "other":
+            names.update(word.lower() for word in _WORD_REGEX.findall(match.group()))
+
+    return names
+
+
+def get_query_params(query: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Pick the parameters a query uses. DuckDB rejects parameters a statement doesn't have, and
+    with several queries each one usually only uses some of the parameters given.
+
+    :param query: a single SQL statement
+    :type query: str
+    :param params: all parameters given
+    :type params: Dict[str, Any]
+    :return: parameters for the query, or None if it doesn't have any
+    :rtype: Dict[str, Any]
+    """
+    if not params:
+        return None
+
+    names = duckdb.extract_statements(query)[0].named_parameters
+
+    return {name: params[name] for name in names if name in params} or None
+
+
+def _common_prefix_len(a: str, b: str) -> int:
+    # binary search over slice comparisons, this keeps the comparisons in C rather than
+    # walking both strings a character at a time
+    lo, hi = 0, min(len(a), len(b))
+
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return lo
+
+
+def _common_suffix_len(a: str, b: str, limit: int) -> int:
+    lo, hi = 0, limit
+
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid :] == b[len(b) - mid :]:
+            lo = mid
+        else:
+            hi = mid - 1
+
+    return lo
+
+
+class StatementIndex:
+    """
+    Keeps track of statement boundaries in a SQL buffer that is edited over time, e.g. the contents
+    of the editor in the TUI. On update, only the statements touched by the edit are lexed again and
+    looking up the statement at an offset is a binary search.
+    """
+
+    def __init__(self, text: str = ""):
+        self.text = ""
+        self.statements: List[Statement] = [Statement(0, 0, None, None)]
+        self._starts = [0]
+        self._line_starts = None
+        self.update(text)
+
+    def update(self, text: str):
+        """
+        Update the index to reflect new text
+
+        :param text: new contents of the buffer
+        :type text: str
+        """
+        old_text = self.text
+
+        if text == old_text:
+            return
+
+        prefix = _common_prefix_len(old_text, text)
+        suffix = _common_suffix_len(
+            old_text, text, min(len(old_text), len(text)) - prefix
+        )
+        delta = len(text) - len(old_text)
+        new_change_end = len(text) - suffix
+
+        # everything before the statement containing the first changed character lexes the same,
+        # since the lexer is always in its initial state right after a semicolon
+        first_changed = bisect_right(self._starts, prefix) - 1
+        relexed = []
+
+        # as soon as a statement starts past the edit at the same place a statement started
+        # before the edit, the rest of the old statements can be reused after shifting them
+        resume_idx = None
+
+        for stmt in _lex_statements(text, self.statements[first_changed].start):
+            if stmt.start >= new_change_end:
+                old_start = stmt.start - delta
+                idx = bisect_right(self._starts, old_start) - 1
+
+                if idx >= 0 and self._starts[idx] == old_start:
+                    resume_idx = idx
+                    break
+
+            relexed.append(stmt)
+
+        statements = self.statements[:first_changed] + relexed
+
+        if resume_idx is not None:
+            statements.extend(
+                stmt.shift(delta) for stmt in self.statements[resume_idx:]
+            )
+
+        self.text = text
+        self.statements = statements
+        self._starts = [stmt.start for stmt in statements]
+        self._line_starts = None
+
+    def statement_at(self, offset: int) -> Statement:
+        """
+        Find the statement containing offset. An offset right before a semicolon belongs to the
+        statement the semicolon terminates.
+
+        :param offset: character offset into the text
+        :type offset: int
+        :return: statement at the offset
+        :rtype: Statement
+        """
+        idx = max(bisect_right(self._starts, offset) - 1, 0)
+        return self.statements[idx]
+
+    def _get_line_starts(self) -> List[int]:
+        if self._line_starts is None:
+            self._line_starts = [0] + [
+                match.end() for match in re.finditer("\n", self.text)
+            ]
+
+        return self._line_starts
+
+    def offset_from_location(self, row: int, col: int) -> int:
+        """
+        Convert a (row, column) location in the text to a character offset
+
+        :param row: line number
+        :type row: int
+        :param col: column in the line
+        :type col: int
+        :return: character offset into the text
+        :rtype: int
+        """
+        line_starts = self._get_line_starts()
+        row = min(row, len(line_starts) - 1)
+
+        return min(line_starts[row] + col, len(self.text))
+
+    def location_from_offset(self, offset: int) -> Tuple[int, int]:
+        """
+        Convert a character offset in the text to a (row, column) location
+
+        :param offset: character offset into the text
+        :type offset: int
+        :return: location as (row, column)
+        :rtype: Tuple[int, int]
+        """
+        line_starts = self._get_line_starts()
+        row = bisect_right(line_starts, offset) - 1
+
+        return row, offset - line_starts[row]
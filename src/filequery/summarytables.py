@@ -0,0 +1,195 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Set
+
+import duckdb
+
+from .cursorpool import CursorPool
+from .dependencies import check_dependencies, run_in_dependency_order
+from .tablestats import quote_identifier
+
+# prefix of the table comment that records what a summary table was built from
+FINGERPRINT_PREFIX = "filequery:"
+
+
+@dataclass
+class SummaryTable:
+    name: str
+    query: str
+
+
+def find_table_references(con: duckdb.DuckDBPyConnection, query: str) -> Set[str]:
+    """
+    Get the names of the tables a query reads from, using DuckDB's parser. References to the
+    query's own CTEs are left out.
+
+    :param con: connection to parse the query on
+    :type con: duckdb.DuckDBPyConnection
+    :param query: query to look through
+    :type query: str
+    :raises ValueError: raised if the query can't be parsed
+    :return: referenced table names
+    :rtype: Set[str]
+    """
+    serialized = json.loads(
+        con.execute("select json_serialize_sql(?)", [query]).fetchone()[0]
+    )
+
+    if serialized.get("error"):
+        raise ValueError(serialized.get("error_message", "failed to parse query"))
+
+    names = set()
+    cte_names = set()
+    nodes = [serialized]
+
+    while nodes:
+        node = nodes.pop()
+
+        if isinstance(node, dict):
+            if node.get("type") == "BASE_TABLE" and not node.get("schema_name"):
+                names.add(node["table_name"])
+
+            if "cte_map" in node:
+                cte_names.update(cte["key"] for cte in node["cte_map"]["map"])
+
+            nodes.extend(node.values())
+        elif isinstance(node, list):
+            nodes.extend(node)
+
+    return names - cte_names
+
+
+def _fingerprint(
+    summary: SummaryTable,
+    references: Set[str],
+    inputs: Dict[str, Optional[Any]],
+    fingerprints: Dict[str, Optional[str]],
+) -> Optional[str]:
+    """
+    Hash the summary's query together with the fingerprints of everything it reads from. Returns None
+    if one of the inputs can't be fingerprinted, in which case the summary is always rebuilt.
+    """
+    parts = []
+
+    for name in sorted(references):
+        # anything that isn't a summary or a source table (e.g. a registered object) can't be checked for changes
+        part = fingerprints[name] if name in fingerprints else inputs.get(name)
+
+        if part is None:
+            return None
+
+        parts.append([name, part])
+
+    payload = json.dumps([summary.query, parts], default=str)
+
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _order_summaries(
+    summaries: List[SummaryTable], references: Dict[str, Set[str]]
+) -> Dict[str, List[str]]:
+    """
+    Get the summaries each summary depends on, checking for cycles
+
+    :raises ValueError: raised if summaries depend on each other in a cycle
+    """
+    names = sorted(summary.name for summary in summaries)
+    deps = {name: sorted(references[name] & set(names) - {name}) for name in names}
+
+    check_dependencies(deps, "summary tables")
+
+    return deps
+
+
+def _get_stored_fingerprints(con: duckdb.DuckDBPyConnection) -> Dict[str, str]:
+    con.execute(
+        """
+        select table_name, comment
+        from duckdb_tables()
+        where not internal and starts_with(comment, ?)
+        """,
+        [FINGERPRINT_PREFIX],
+    )
+
+    return {rec[0]: rec[1][len(FINGERPRINT_PREFIX) :] for rec in con.fetchall()}
+
+
+def _build(cur: duckdb.DuckDBPyConnection, summary: SummaryTable, fingerprint: str):
+    table = quote_identifier(summary.name)
+    cur.begin()
+
+    try:
+        cur.execute(f"create or replace table {table} as {summary.query}")
+
+        if fingerprint is not None:
+            # the fingerprint is a hex digest, so it can't contain quotes
+            cur.execute(
+                f"comment on table {table} is '{FINGERPRINT_PREFIX}{fingerprint}'"
+            )
+
+        cur.commit()
+    except:
+        cur.rollback()
+        raise
+
+
+def build_summary_tables(
+    pool: CursorPool,
+    summaries: List[SummaryTable],
+    inputs: Dict[str, Optional[Any]],
+    max_workers: int = None,
+) -> List[str]:
+    """
+    Create a table from each summary's query. A summary is built once everything it reads from is
+    built, and summaries that don't depend on each other are built in parallel. A summary that
+    already exists is only rebuilt when its query or one of its inputs changed.
+
+    :param pool: pool of cursors to build the tables on
+    :type pool: CursorPool
+    :param summaries: summary tables to build
+    :type summaries: List[SummaryTable]
+    :param inputs: mapping from each source table name to something that changes when the table's data changes, or None if that can't be determined
+    :type inputs: Dict[str, Optional[Any]]
+    :param max_workers: maximum number of tables to build at the same time, defaults to None (ThreadPoolExecutor's default)
+    :type max_workers: int, optional
+    :raises ValueError: raised if a query can't be parsed, or summaries depend on each other in a cycle
+    :return: names of the tables that were built, in the order they finished
+    :rtype: List[str]
+    """
+    if not summaries:
+        return []
+
+    by_name = {summary.name: summary for summary in summaries}
+
+    with pool.checkout() as cur:
+        references = {
+            summary.name: find_table_references(cur, summary.query)
+            for summary in summaries
+        }
+        stored = _get_stored_fingerprints(cur)
+
+    deps = _order_summaries(summaries, references)
+    fingerprints: Dict[str, Optional[str]] = {}
+
+    def run(name: str) -> bool:
+        with pool.checkout() as cur:
+            _build(cur, by_name[name], fingerprints[name])
+
+        return True
+
+    def skip(name: str, results: Dict[str, bool]) -> Optional[bool]:
+        # summaries built from a summary without a fingerprint don't get one either, so they are always rebuilt
+        fingerprint = _fingerprint(by_name[name], references[name], inputs, fingerprints)
+        fingerprints[name] = fingerprint
+
+        if fingerprint is not None and stored.get(name) == fingerprint:
+            return False
+
+        return None
+
+    results = run_in_dependency_order(
+        deps, run, skip, max_workers, "filequery-summary"
+    )
+
+    return [name for name, was_built in results.items() if was_built]
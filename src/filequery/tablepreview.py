@@ -0,0 +1,209 @@
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, List, Optional, Tuple
+
+import duckdb
+
+from .tablestats import TableVersions, quote_identifier
+
+# number of rows shown in a table preview
+DEFAULT_PREVIEW_ROWS = 20
+
+# maximum number of previews kept, least recently used previews are dropped first
+DEFAULT_MAX_PREVIEWS = 256
+
+
+@dataclass
+class TablePreview:
+    table: str
+    col_names: List[str]
+    rows: List[tuple]
+
+    # error message if the preview couldn't be fetched, previews with errors aren't cached
+    error: str = None
+
+
+class TablePreviewCache:
+    """
+    First rows of the tables in a database, for showing a preview of a table without running a query.
+    Previews are cached until the table changes, like TableStatsCache. Views are previewed too, but
+    aren't cached since it can't be told when what they read from changes.
+    """
+
+    def __init__(
+        self,
+        cursor_factory: Callable[[], duckdb.DuckDBPyConnection],
+        rows: int = DEFAULT_PREVIEW_ROWS,
+        max_previews: int = DEFAULT_MAX_PREVIEWS,
+        versions: TableVersions = None,
+    ):
+        """
+        TablePreviewCache constructor
+
+        :param cursor_factory: function that creates a new cursor on the database, previews are fetched on their own cursor so they can be fetched in the background
+        :type cursor_factory: Callable[[], duckdb.DuckDBPyConnection]
+        :param rows: number of rows in each preview, defaults to DEFAULT_PREVIEW_ROWS
+        :type rows: int, optional
+        :param max_previews: maximum number of previews to keep, defaults to DEFAULT_MAX_PREVIEWS
+        :type max_previews: int, optional
+        :param versions: statements run against the database, without it updates that keep the number of rows aren't noticed, defaults to None
+        :type versions: TableVersions, optional
+        """
+        self._cursor_factory = cursor_factory
+        self._versions = versions or TableVersions()
+        self.rows = rows
+        self.max_previews = max_previews
+        self._cache: "OrderedDict[str, Tuple[Tuple, TablePreview]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # tables waiting to be fetched by the background thread, most wanted first
+        self._queue: List[str] = []
+        self._on_fetched: Callable[[TablePreview], None] = None
+        self._worker: threading.Thread = None
+
+    def _get_fingerprint(self, cur: duckdb.DuckDBPyConnection, table: str) -> Optional[Tuple]:
+        """
+        Get something that identifies the current version of a table, None for views
+        """
+        cur.execute(
+            """
+            select table_oid, estimated_size, column_count
+            from duckdb_tables()
+            where table_name = ? and not internal
+            """,
+            [table],
+        )
+        rec = cur.fetchone()
+
+        return (*rec, self._versions.get(table)) if rec else None
+
+    def get(self, table: str) -> Optional[TablePreview]:
+        """
+        Get the cached preview of a table without fetching it or checking whether the table changed
+
+        :param table: table name
+        :type table: str
+        :return: cached preview, or None if it hasn't been fetched yet
+        :rtype: Optional[TablePreview]
+        """
+        with self._lock:
+            cached = self._cache.get(table)
+
+        return cached[1] if cached else None
+
+    def fetch(self, table: str) -> TablePreview:
+        """
+        Get the preview of a table, fetching it if it isn't cached or the table changed. Only the first
+        rows are read, the LIMIT lets DuckDB stop scanning once it has them.
+
+        :param table: table or view name
+        :type table: str
+        :return: preview of the table, with an error message if it couldn't be fetched
+        :rtype: TablePreview
+        """
+        cur = self._cursor_factory()
+
+        try:
+            return self._fetch(cur, table)
+        finally:
+            cur.close()
+
+    def _fetch(self, cur: duckdb.DuckDBPyConnection, table: str) -> TablePreview:
+        try:
+            fingerprint = self._get_fingerprint(cur, table)
+
+            with self._lock:
+                cached = self._cache.get(table)
+
+                if fingerprint is not None and cached and cached[0] == fingerprint:
+                    self._cache.move_to_end(table)
+                    return cached[1]
+
+            cur.execute(f"select * from {quote_identifier(table)} limit {int(self.rows)}")
+            preview = TablePreview(
+                table, [col[0] for col in cur.description], cur.fetchall()
+            )
+        except duckdb.Error as e:
+            return TablePreview(table, [], [], str(e))
+
+        if fingerprint is not None:
+            with self._lock:
+                self._cache[table] = (fingerprint, preview)
+                self._cache.move_to_end(table)
+
+                while len(self._cache) > self.max_previews:
+                    self._cache.popitem(last=False)
+
+        return preview
+
+    def prefetch(
+        self, tables: List[str], on_fetched: Callable[[TablePreview], None] = None
+    ) -> threading.Thread:
+        """
+        Fetch previews of tables in a single background thread, in the order given. Tables still waiting
+        from an earlier call are dropped, so while a user moves through a list of tables only the previews
+        around the current one are fetched.
+
+        :param tables: tables to fetch, e.g. the selected table followed by its neighbours
+        :type tables: List[str]
+        :param on_fetched: called from the background thread with each preview once it's fetched (or found in the cache), defaults to None
+        :type on_fetched: Callable[[TablePreview], None], optional
+        :return: thread fetching the previews
+        :rtype: threading.Thread
+        """
+        with self._lock:
+            self._queue = list(dict.fromkeys(tables))
+            self._on_fetched = on_fetched
+
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run_background, name="filequery-preview", daemon=True
+                )
+                self._worker.start()
+
+            return self._worker
+
+    def _run_background(self):
+        cur = self._cursor_factory()
+
+        try:
+            while True:
+                with self._lock:
+                    if not self._queue:
+                        self._worker = None
+                        return
+
+                    table = self._queue.pop(0)
+                    on_fetched = self._on_fetched
+
+                preview = self._fetch(cur, table)
+
+                if on_fetched:
+                    on_fetched(preview)
+        finally:
+            cur.close()
+
+
+def neighbours(items: List[str], index: int, count: int) -> List[str]:
+    """
+    Get the item at index followed by up to count items on either side of it, nearest first,
+    e.g. the order previews are prefetched in as a user moves through a list of tables
+
+    :param items: list to pick from
+    :type items: List[str]
+    :param index: position of the current item
+    :type index: int
+    :param count: number of items to take on each side
+    :type count: int
+    :return: the current item and its neighbours
+    :rtype: List[str]
+    """
+    picked = [items[index]]
+
+    for distance in range(1, count + 1):
+        for position in (index + distance, index - distance):
+            if 0 <= position < len(items):
+                picked.append(items[position])
+
+    return picked
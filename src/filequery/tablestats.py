@@ -0,0 +1,437 @@
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import duckdb
+from rich import markup
+from rich.console import Console
+from rich.table import Table
+
+from .statements import referenced_names
+
+# statement types that never write to a table
+READ_ONLY_STATEMENTS = {duckdb.StatementType.SELECT, duckdb.StatementType.EXPLAIN}
+
+# DuckDB's default block size, used for in-memory databases, which don't report one
+DEFAULT_BLOCK_SIZE = 262144
+
+
+@dataclass
+class ColumnStats:
+    name: str
+    type: str
+    null_fraction: float
+    distinct_estimate: int
+    min: str
+    max: str
+
+
+@dataclass
+class TableStats:
+    table: str
+    row_count: int
+    columns: List[ColumnStats]
+
+    # estimated size of the table's data, see estimate_table_bytes()
+    estimated_bytes: int = None
+
+    def format_as_table(self):
+        """
+        Prints the stats as a table
+        """
+        title = f"{markup.escape(self.table)} ({self.row_count:,} rows"
+
+        if self.estimated_bytes is not None:
+            title += f", ~{format_bytes(self.estimated_bytes)}"
+
+        title += ")"
+        table = Table(title=title)
+        table.add_column("column")
+        table.add_column("type")
+        table.add_column("null %", justify="right")
+        table.add_column("distinct (approx)", justify="right")
+        table.add_column("min")
+        table.add_column("max")
+
+        for col in self.columns:
+            table.add_row(
+                markup.escape(col.name),
+                col.type,
+                f"{col.null_fraction * 100:.1f}",
+                f"{col.distinct_estimate:,}",
+                markup.escape(str(col.min)),
+                markup.escape(str(col.max)),
+            )
+
+        console = Console()
+        console.print(table)
+
+
+def format_bytes(num_bytes: float) -> str:
+    """
+    Format a number of bytes for display, e.g. 1536 as "1.5 KB"
+
+    :param num_bytes: number of bytes
+    :type num_bytes: float
+    :return: formatted size
+    :rtype: str
+    """
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+
+        num_bytes /= 1024
+
+    return f"{num_bytes:.1f} TB"
+
+
+def database_block_size(con: duckdb.DuckDBPyConnection, database: str = None) -> int:
+    """
+    Get the block size of a database
+
+    :param con: connection to the database
+    :type con: duckdb.DuckDBPyConnection
+    :param database: name of the database, defaults to None (the current database)
+    :type database: str, optional
+    :return: block size in bytes
+    :rtype: int
+    """
+    con.execute(
+        """
+        select block_size
+        from pragma_database_size()
+        where database_name = coalesce(?, current_database())
+        """,
+        [database],
+    )
+    rec = con.fetchone()
+
+    # in-memory databases report a block size of 0
+    return rec[0] if rec and rec[0] else DEFAULT_BLOCK_SIZE
+
+
+def estimate_table_bytes(
+    con: duckdb.DuckDBPyConnection, table: str, block_size: int = DEFAULT_BLOCK_SIZE
+) -> int:
+    """
+    Estimate how much memory a table's data takes up, from the blocks its column segments are stored in.
+    Segments of a table in a database file share blocks, so those are counted once. In memory, every
+    segment is counted as a block of its own. That's close for large tables, but DuckDB starts tables
+    with smaller segments, so tables of a few thousand rows come out larger than they are.
+
+    :param con: connection to the database
+    :type con: duckdb.DuckDBPyConnection
+    :param table: table name as it's written in SQL, e.g. "schema"."table"
+    :type table: str
+    :param block_size: block size of the table's database, see database_block_size(), defaults to DEFAULT_BLOCK_SIZE
+    :type block_size: int, optional
+    :return: estimated size in bytes
+    :rtype: int
+    """
+    con.execute(
+        """
+        select
+            count(distinct block_id) filter (where persistent),
+            count(*) filter (where not persistent)
+        from pragma_storage_info(?)
+        """,
+        [table],
+    )
+    persistent_blocks, memory_segments = con.fetchone()
+
+    return (persistent_blocks + memory_segments) * block_size
+
+
+def quote_identifier(name: str) -> str:
+    """
+    Wrap a name in double quotes so it can be used as an identifier in a query
+
+    :param name: table or column name
+    :type name: str
+    :return: quoted name
+    :rtype: str
+    """
+    escaped = name.replace('"', '""')
+    return f'"{escaped}"'
+
+
+class TableVersions:
+    """
+    Count of the statements that may have written to each table. DuckDB doesn't keep a version for
+    tables, and an UPDATE leaves a table's oid, row count and column count as they were, so whoever
+    runs statements records them here and caches include the count in their fingerprints.
+    """
+
+    def __init__(self):
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, table: str) -> int:
+        """
+        Get the version of a table, 0 until a statement that may write to it is recorded
+
+        :param table: table name
+        :type table: str
+        :return: version of the table
+        :rtype: int
+        """
+        with self._lock:
+            return self._versions.get(table.lower(), 0)
+
+    def record(self, query: str):
+        """
+        Record statements that ran, bumping the version of every table they may have written to.
+        Call this once the statements are done, even if they failed, since earlier statements may
+        have written before a later one failed.
+
+        :param query: one or more SQL statements
+        :type query: str
+        """
+        self.bump(self.tables_written(query))
+
+    def bump(self, tables: Set[str]):
+        """
+        Bump the version of tables, see tables_written()
+
+        :param tables: lowercased table names
+        :type tables: Set[str]
+        """
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    @staticmethod
+    def tables_written(query: str) -> Set[str]:
+        """
+        Get the tables statements may write to, every name in a statement that isn't a SELECT. Any
+        identifier could be a table, so some tables are bumped needlessly, which only costs
+        recomputing what's cached for them.
+
+        :param query: one or more SQL statements
+        :type query: str
+        :return: lowercased table names
+        :rtype: Set[str]
+        """
+        try:
+            statements = duckdb.extract_statements(query)
+        except duckdb.Error:
+            # it didn't parse, so nothing ran
+            return set()
+
+        tables = set()
+
+        for stmt in statements:
+            if stmt.type not in READ_ONLY_STATEMENTS:
+                tables.update(referenced_names(stmt.query))
+
+        return tables
+
+
+class TableStatsCache:
+    """
+    Row counts and per-column statistics for the tables in a database, computed with SUMMARIZE.
+    Statistics are cached until the table changes. A table is considered changed when it is
+    recreated, when its number of rows or columns changes, or when its version in versions changes.
+    """
+
+    def __init__(
+        self,
+        cursor_factory: Callable[[], duckdb.DuckDBPyConnection],
+        versions: TableVersions = None,
+    ):
+        """
+        TableStatsCache constructor
+
+        :param cursor_factory: function that creates a new cursor on the database, stats are computed on their own cursor so they can run in the background
+        :type cursor_factory: Callable[[], duckdb.DuckDBPyConnection]
+        :param versions: statements run against the database, without it updates that keep the number of rows aren't noticed, defaults to None
+        :type versions: TableVersions, optional
+        """
+        self._cursor_factory = cursor_factory
+        self._versions = versions or TableVersions()
+        self._cache: Dict[str, Tuple[Tuple, TableStats]] = {}
+        self._lock = threading.Lock()
+        self._worker: threading.Thread = None
+
+        # set when start_background() is called while the worker is running, so it goes through the tables again
+        self._rerun = False
+
+    def _get_fingerprints(self, cur: duckdb.DuckDBPyConnection) -> Dict[str, Tuple]:
+        """
+        Get something that identifies the current version of each table. Views are not included,
+        so no stats are computed for them.
+        """
+        cur.execute(
+            """
+            select table_name, table_oid, estimated_size, column_count
+            from duckdb_tables()
+            where not internal
+            """
+        )
+
+        return {
+            rec[0]: (*rec[1:], self._versions.get(rec[0])) for rec in cur.fetchall()
+        }
+
+    def get(self, table: str) -> Optional[TableStats]:
+        """
+        Get cached stats for a table without computing them. This doesn't check whether the table
+        changed since the stats were computed, so it is cheap enough to call while drawing the UI.
+
+        :param table: table name
+        :type table: str
+        :return: cached stats, or None if they haven't been computed yet
+        :rtype: Optional[TableStats]
+        """
+        with self._lock:
+            cached = self._cache.get(table)
+
+        return cached[1] if cached else None
+
+    def compute(self, table: str) -> Optional[TableStats]:
+        """
+        Get stats for a table, computing them if they aren't cached or the table changed
+
+        :param table: table name
+        :type table: str
+        :return: stats for the table, or None if there is no such table
+        :rtype: Optional[TableStats]
+        """
+        cur = self._cursor_factory()
+
+        try:
+            fingerprint = self._get_fingerprints(cur).get(table)
+            return self._compute(cur, table, fingerprint)
+        finally:
+            cur.close()
+
+    def _compute(
+        self, cur: duckdb.DuckDBPyConnection, table: str, fingerprint: Tuple
+    ) -> Optional[TableStats]:
+        if fingerprint is None:
+            return None
+
+        with self._lock:
+            cached = self._cache.get(table)
+
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+
+        cur.execute(f"summarize {quote_identifier(table)}")
+
+        columns = []
+        row_count = 0
+
+        for rec in cur.fetchall():
+            # columns are column_name, column_type, min, max, approx_unique, avg, std, q25, q50, q75, count, null_percentage
+            row_count = rec[10]
+            columns.append(
+                ColumnStats(
+                    name=rec[0],
+                    type=rec[1],
+                    null_fraction=float(rec[11] or 0) / 100,
+                    distinct_estimate=rec[4],
+                    min=rec[2],
+                    max=rec[3],
+                )
+            )
+
+        stats = TableStats(
+            table,
+            row_count,
+            columns,
+            estimate_table_bytes(
+                cur, quote_identifier(table), database_block_size(cur)
+            ),
+        )
+
+        with self._lock:
+            self._cache[table] = (fingerprint, stats)
+
+        return stats
+
+    def compute_all(self, on_computed: Callable[[TableStats], None] = None):
+        """
+        Compute stats for every table that doesn't have up to date stats, one table at a time.
+        Stats for tables that no longer exist are dropped.
+
+        :param on_computed: called with the stats of each table that had to be computed, defaults to None
+        :type on_computed: Callable[[TableStats], None], optional
+        """
+        cur = self._cursor_factory()
+
+        try:
+            fingerprints = self._get_fingerprints(cur)
+
+            with self._lock:
+                for table in list(self._cache):
+                    if table not in fingerprints:
+                        del self._cache[table]
+
+            for table, fingerprint in fingerprints.items():
+                with self._lock:
+                    cached = self._cache.get(table)
+
+                if cached and cached[0] == fingerprint:
+                    continue
+
+                try:
+                    stats = self._compute(cur, table, fingerprint)
+                except duckdb.Error:
+                    # e.g. the table was dropped while we were going through the list
+                    continue
+
+                if on_computed:
+                    on_computed(stats)
+        finally:
+            cur.close()
+
+    def all_stats(self) -> List[TableStats]:
+        """
+        Get stats for every table, computing them where needed
+
+        :return: stats for each table
+        :rtype: List[TableStats]
+        """
+        self.compute_all()
+
+        with self._lock:
+            return [cached[1] for cached in self._cache.values()]
+
+    def _run_background(self, on_computed: Callable[[TableStats], None]):
+        while True:
+            self.compute_all(on_computed)
+
+            with self._lock:
+                if not self._rerun:
+                    self._worker = None
+                    return
+
+                self._rerun = False
+
+    def start_background(
+        self, on_computed: Callable[[TableStats], None] = None
+    ) -> threading.Thread:
+        """
+        Run compute_all() in a single background thread, so stats are computed one table at a time without
+        competing with each other. If the thread is already running, it goes through the tables again once
+        it's done instead of another thread being started.
+
+        :param on_computed: called from the background thread with the stats of each computed table, defaults to None
+        :type on_computed: Callable[[TableStats], None], optional
+        :return: thread computing the stats
+        :rtype: threading.Thread
+        """
+        with self._lock:
+            if self._worker is not None:
+                self._rerun = True
+            else:
+                self._worker = threading.Thread(
+                    target=self._run_background,
+                    args=(on_computed,),
+                    name="filequery-stats",
+                    daemon=True,
+                )
+                self._worker.start()
+
+            return self._worker
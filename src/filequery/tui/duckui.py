@@ -1,44 +1,115 @@
-import re
+import contextlib
+import time
 from collections import defaultdict
+from datetime import datetime
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Set, Tuple
 
 import duckdb
+from rich.text import Text
 from textual import events, on
 from textual.app import App, ComposeResult
 from textual.binding import Binding
 from textual.containers import Horizontal, Vertical
-from textual.widgets import (DataTable, Footer, Input, Markdown, Tab, Tabs,
-                             TextArea, Tree)
+from textual.widgets import (DataTable, Footer, Input, Markdown, OptionList,
+                             Static, Tab, Tabs, TextArea, Tree)
 from textual.widgets.text_area import Selection
 
+from ..completion import CompletionIndex
+from ..progress import QueryProgress, enable_progress
+from ..queryhistory import HistoryEntry, QueryHistory
+from ..querylog import MemorySampler, QueryLog
+from ..statements import StatementIndex
+from ..tablepreview import TablePreview, TablePreviewCache, neighbours
+from ..tablestats import (ColumnStats, TableStats, TableStatsCache,
+                          TableVersions, format_bytes, quote_identifier)
 from .help_content import help_md
 from .screens.file_browser import FileBrowser
 from .screens.menu import MenuModal
 from .screens.menu_events import MenuEvent
+from .screens.query_history import QueryHistoryScreen
+from .sql_editor import SqlEditor
+
+# statements after which the completion index is refreshed, since they can add, drop or change tables and functions
+CATALOG_STATEMENT_TYPES = {"CREATE", "CREATE_FUNC", "DROP", "ALTER", "ATTACH", "DETACH"}
+
+# temporary table the result of a select is put in, so it can be shown and cached without running the query twice
+RESULT_TABLE_NAME = "__filequery_result"
+
+# seconds between updates of the progress indicator while a query runs
+PROGRESS_REFRESH_INTERVAL = 0.25
+
+# number of tables above and below the highlighted one whose previews are fetched ahead of time
+PREFETCH_NEIGHBOURS = 2
 
 
 class DuckUI(App):
     BINDINGS = [
         Binding(key="f1", action="toggle_menu", description="menu"),
         Binding(key="f2", action="toggle_help", description="help"),
+        Binding(key="f3", action="show_history", description="history"),
         Binding(key="f9", action="execute_query", description="execute query"),
         Binding(key="ctrl+p", action="close_dialog", description="close dialog"),
     ]
     CSS_PATH = "./styles/style.tcss"
 
-    def __init__(self, conn: duckdb.DuckDBPyConnection = None):
+    def __init__(
+        self,
+        conn: duckdb.DuckDBPyConnection = None,
+        sample: str = None,
+        history: QueryHistory = None,
+        query_log: QueryLog = None,
+        sources: Dict[str, str] = None,
+        load_time: float = None,
+    ):
         self.conn = conn
 
+        # log of executed statements with their timing, not kept if this is None. sources and load_time
+        # are the files the tables were loaded from and how long it took, see FileDb.source_files()
+        self.query_log = query_log
+        self.sources = sources
+        self.load_time = load_time
+
+        # executed queries and their cached results, no history is kept if this is None
+        self.history = history
+
+        # sample size the tables were loaded with, if they are a sample of the files
+        self.sample = sample
+
         if self.conn is None:
             self.conn = duckdb.connect(":memory:")
 
         # mapping from tab ID to editor content, tab IDs are "tab-1", "tab-2" and so on
         self.tab_content = defaultdict(str)
-        
+
+        # statement boundaries in the editor, kept up to date as the editor content changes
+        self.statements = StatementIndex()
+
+        # statements run from the editor, so cached stats and previews notice updates
+        self.table_versions = TableVersions()
+
+        # row counts and column stats shown in the table tree, computed in the background
+        self.table_stats = TableStatsCache(self.conn.cursor, self.table_versions)
+
+        # first rows of the highlighted table, shown below the table tree and fetched in the background
+        self.table_previews = TablePreviewCache(
+            self.conn.cursor, versions=self.table_versions
+        )
+        self._preview_table: str = None
+
         # keep track of last query ran, so if user exports result, can use a duckdb copy statement
         self.last_query = ""
 
+        # set when the catalog changes while the completion index is still being built
+        self._completions_ready = False
+        self._catalog_changed = False
+
+        # cursor of the query running in the background, along with the query, its statement types,
+        # whether its result is cached and when it started, None while no query is running
+        self._query_cursor: duckdb.DuckDBPyConnection = None
+        self._running_query: Tuple[str, Set[str], bool, float] = None
+        self._progress_timer = None
+
         super().__init__()
 
     def _get_table_list(self) -> List[str]:
@@ -59,6 +130,64 @@ class DuckUI(App):
 
         return tables
 
+    def _format_column_label(self, col: ColumnStats) -> Text:
+        """
+        Label for a column in the table tree, with the column's stats
+
+        :param col: stats for the column
+        :type col: ColumnStats
+        :return: label to show in the tree
+        :rtype: Text
+        """
+        label = Text(f"{col.name}: {col.type}")
+        label.append(
+            f"  nulls {col.null_fraction:.0%}, ~{col.distinct_estimate:,} distinct, {col.min} .. {col.max}",
+            style="dim",
+        )
+
+        return label
+
+    def _handle_table_stats_computed(self, stats: TableStats):
+        # called from the stats thread
+        if self.is_running:
+            self.call_from_thread(self._update_table_node, stats)
+
+    def _update_table_node(self, stats: TableStats):
+        """
+        Show newly computed stats in the table's node, without recreating the rest of the tree
+
+        :param stats: stats of the table
+        :type stats: TableStats
+        """
+        for table_node in self.tables.root.children:
+            if table_node.data == stats.table:
+                table_node.set_label(self._format_table_label(stats))
+                table_node.remove_children()
+
+                for col in stats.columns:
+                    table_node.add_leaf(self._format_column_label(col))
+
+                return
+
+    def _format_table_label(self, stats: TableStats) -> Text:
+        """
+        Label for a table in the table tree, with its row count and size
+
+        :param stats: stats for the table
+        :type stats: TableStats
+        :return: label to show in the tree
+        :rtype: Text
+        """
+        label = Text(stats.table)
+        size = (
+            f", ~{format_bytes(stats.estimated_bytes)}"
+            if stats.estimated_bytes is not None
+            else ""
+        )
+        label.append(f" ({stats.row_count:,} rows{size})", style="dim")
+
+        return label
+
     def _refresh_table_tree(self):
         # refreshing causes the tree to get recreated, which makes all nodes collapsed
         # keep track of what is expanded right now and expand them again after recreation
@@ -66,18 +195,27 @@ class DuckUI(App):
 
         for child in self.tables.root.children:
             if child.is_expanded:
-                nodes_to_expand.append(str(child.label))
+                nodes_to_expand.append(child.data)
 
         self.tables.root.remove_children()
         cur = self.conn.cursor()
 
         for table in self._get_table_list():
-            table_node = self.tables.root.add(table)
-            
-            cur.execute(f"describe table {table}")
+            stats = self.table_stats.get(table)
 
-            for rec in cur.fetchall():
-                table_node.add_leaf(f"{rec[0]}: {rec[1]}")
+            if stats is None:
+                table_node = self.tables.root.add(Text(table), data=table)
+                cur.execute(f"describe table {quote_identifier(table)}")
+
+                for rec in cur.fetchall():
+                    table_node.add_leaf(Text(f"{rec[0]}: {rec[1]}"))
+            else:
+                table_node = self.tables.root.add(
+                    self._format_table_label(stats), data=table
+                )
+
+                for col in stats.columns:
+                    table_node.add_leaf(self._format_column_label(col))
 
             # expand the table_node if it was expanded before recreation
             if table in nodes_to_expand:
@@ -86,18 +224,33 @@ class DuckUI(App):
         cur.close()
 
     def compose(self) -> ComposeResult:
-        self.tables = Tree("tables", classes="table-browser-area")
+        tree_label = "tables"
+        if self.sample:
+            sample_desc = self.sample if self.sample.endswith("%") else f"{self.sample} row"
+            tree_label = f"tables ({sample_desc} sample)"
+
+        self.tables = Tree(tree_label, classes="table-browser-area")
         self.tables.root.expand()
         self._refresh_table_tree()
 
-        self.text_area = TextArea(
-            language="sql", classes="editor-box", theme="dracula", id="editor"
+        self.completion_list = OptionList(classes="completion-box", id="completion-list")
+        self.text_area = SqlEditor(
+            CompletionIndex(),
+            self.completion_list,
+            self.statements,
+            language="sql",
+            classes="editor-box",
+            theme="dracula",
+            id="editor",
         )
         self.text_area.focus()
 
         self.result_table = DataTable(classes="result-box")
         self.result_table.zebra_stripes = True
 
+        self.preview_table = DataTable(classes="table-preview-box", id="table-preview")
+        self.preview_table.zebra_stripes = True
+
         self.help_box = Markdown(help_md, classes="popup-box")
         self.save_sql_input = Input(
             placeholder="sql file name...",
@@ -112,9 +265,13 @@ class DuckUI(App):
 
         self.tabs = Tabs(Tab("tab 1"))
 
+        self.progress_indicator = Static(classes="progress-indicator")
+
         yield Horizontal(
             Vertical(
                 self.tables,
+                self.preview_table,
+                classes="table-browser-pane",
             ),
             Vertical(
                 self.tabs,
@@ -127,9 +284,68 @@ class DuckUI(App):
         yield self.help_box
         yield self.save_sql_input
         yield self.save_result_input
+        yield self.completion_list
 
+        yield self.progress_indicator
         yield Footer()
 
+    def on_mount(self):
+        self.table_stats.start_background(self._handle_table_stats_computed)
+        self.run_worker(self._build_completions, thread=True)
+
+    def _build_completions(self):
+        # runs in a worker thread, the index is only handed to the editor once it's complete
+        cur = self.conn.cursor()
+
+        try:
+            completions = CompletionIndex()
+            completions.build(cur)
+        finally:
+            cur.close()
+
+        self.call_from_thread(self._set_completions, completions)
+
+    def _set_completions(self, completions: CompletionIndex):
+        if self._catalog_changed:
+            cur = self.conn.cursor()
+            completions.refresh(cur)
+            cur.close()
+
+        self.text_area.completions = completions
+        self._completions_ready = True
+
+    def _get_statement_types(self, query: str) -> Set[str]:
+        """
+        Get the types of the statements in a query, e.g. {"SELECT"}
+
+        :param query: query to parse
+        :type query: str
+        :return: names of the statement types, empty if the query can't be parsed
+        :rtype: Set[str]
+        """
+        try:
+            return {stmt.type.name for stmt in duckdb.extract_statements(query)}
+        except duckdb.Error:
+            return set()
+
+    def _refresh_completions(self, statement_types: Set[str]):
+        """
+        Update the completion index if an executed query changed the catalog
+
+        :param statement_types: types of the statements that were executed
+        :type statement_types: Set[str]
+        """
+        if not statement_types & CATALOG_STATEMENT_TYPES:
+            return
+
+        if not self._completions_ready:
+            self._catalog_changed = True
+            return
+
+        cur = self.conn.cursor()
+        self.text_area.completions.refresh(cur)
+        cur.close()
+
     @on(Input.Submitted, selector="#sql-file-input")
     def handle_sql_file_name_input(self):
         try:
@@ -146,7 +362,11 @@ class DuckUI(App):
     @on(Input.Submitted, selector="#result-file-input")
     def handle_result_file_name_input(self):
         try:
-            self.conn.execute(f"copy ({self.last_query}) to '{self.save_result_input.value}' (header)")
+            # the file name is bound rather than put in the SQL, so quotes in it can't break the statement
+            self.conn.execute(
+                f"copy ({self.last_query}) to ? (header)",
+                [self.save_result_input.value],
+            )
         except:
             # ignore for now, find a way to display an error message
             pass
@@ -159,18 +379,70 @@ class DuckUI(App):
     def handle_editor_content_changed(self):
         cur_tab = self.tabs.active_tab.id
         self.tab_content[cur_tab] = self.text_area.text
+        self.statements.update(self.text_area.text)
 
     @on(Tabs.TabActivated)
     def handle_tab_activated(self, event: Tabs.TabActivated):
         self.text_area.text = self.tab_content[event.tab.id]
         self.result_table.clear(columns=True)
 
+    @on(Tree.NodeHighlighted)
+    def handle_table_highlighted(self, event: Tree.NodeHighlighted):
+        # column nodes show the preview of their table
+        node = event.node if event.node.data is not None else event.node.parent
+        table = node.data if node is not None else None
+
+        if table is None:
+            return
+
+        self._preview_table = table
+        self.preview_table.display = True
+        preview = self.table_previews.get(table)
+
+        if preview is not None:
+            self._show_preview(preview)
+        else:
+            self.preview_table.clear(columns=True)
+            self.preview_table.add_column(f"loading {table}...")
+
+        # the cached preview is checked against the table in the background and replaced if it changed
+        tables = [child.data for child in self.tables.root.children]
+        self.table_previews.prefetch(
+            neighbours(tables, tables.index(table), PREFETCH_NEIGHBOURS),
+            self._handle_preview_fetched,
+        )
+
+    def _handle_preview_fetched(self, preview: TablePreview):
+        # called from the preview thread
+        if self.is_running and preview.table == self._preview_table:
+            self.call_from_thread(self._show_preview, preview)
+
+    def _show_preview(self, preview: TablePreview):
+        """
+        Show the preview of the highlighted table below the table tree
+
+        :param preview: preview to show, ignored if another table was highlighted since it was requested
+        :type preview: TablePreview
+        """
+        if preview.table != self._preview_table:
+            return
+
+        self.preview_table.clear(columns=True)
+
+        if preview.error is not None:
+            self.preview_table.add_column("error")
+            self.preview_table.add_row(preview.error)
+            return
+
+        self.preview_table.add_columns(*preview.col_names)
+        self.preview_table.add_rows(preview.rows)
+
     def on_descendant_focus(self, event: events.DescendantFocus):
         if type(event.widget) == DataTable:
             self.result_table.add_class("focused")
             self.text_area.remove_class("focused")
             self.tables.remove_class("focused")
-        if type(event.widget) == TextArea:
+        if isinstance(event.widget, TextArea):
             self.text_area.add_class("focused")
             self.result_table.remove_class("focused")
             self.tables.remove_class("focused")
@@ -284,58 +556,35 @@ class DuckUI(App):
                  can be used to highlight the query
         :rtype: Tuple[str, Selection]
         """
-        # remove comments
-        text = re.sub("--.+", "", self.text_area.text)
-        queries = text.split(";")
-
-        # add character to the end of each query so that query is selected if cursor
-        # is right before semicolon
-        queries = [q + " " for q in queries]
-
-        line = 0
-        col = 0
-        query_idx_to_run = -1
-        found_query = False
-        selection_start = (0, 0)
-        selection_end = (0, 0)
-
-        for i, query in enumerate(queries):
-            selection_start = (line, col)
-
-            # whether we've seen any characters in the current query besides newline and space
-            found_non_empty_chars = False
+        # make sure the index reflects the editor content, this is a no-op if nothing changed
+        self.statements.update(self.text_area.text)
 
-            for c in query:
-                if line == cursor_x and col == cursor_y:
-                    query_idx_to_run = i
-                    found_query = True
+        offset = self.statements.offset_from_location(cursor_x, cursor_y)
+        stmt = self.statements.statement_at(offset)
 
-                if c == "\n":
-                    col = 0
-                    line += 1
-                else:
-                    col += 1
-                    if c != " ":
-                        found_non_empty_chars = True
+        if stmt.is_empty:
+            return "", Selection()
 
-                # if we've only seen newlines and whitespace, keep incrementing selection start
-                # this way the highlighted portion actually starts at the code
-                if (c == " " or c == "\n") and not found_non_empty_chars:
-                    selection_start = (line, col)
+        query = self.statements.text[stmt.code_start : stmt.code_end]
 
-            selection_end = (line, col)
+        # include the semicolon in the highlighted portion if the statement has one
+        is_terminated = stmt.end < len(self.statements.text)
+        end_offset = stmt.end + 1 if is_terminated else stmt.code_end
 
-            if found_query:
-                break
-
-        query = queries[query_idx_to_run] if query_idx_to_run != -1 else ""
+        selection_start = self.statements.location_from_offset(stmt.code_start)
+        selection_end = self.statements.location_from_offset(end_offset)
 
         return query, Selection(selection_start, selection_end)
 
     def action_execute_query(self):
         """
-        Executes the query at the cursor
+        Executes the query at the cursor. The query runs in a worker thread, so the UI stays
+        responsive and shows the query's progress until the result is ready.
         """
+        if self._query_cursor is not None:
+            self.notify("wait for the running query to finish", severity="warning")
+            return
+
         cursor_x, cursor_y = self.text_area.cursor_location
         query, selection = self._find_query_at_cursor(cursor_x, cursor_y)
 
@@ -345,27 +594,219 @@ class DuckUI(App):
 
         self.text_area.selection = selection
 
-        result = None
         cur = self.conn.cursor()
+        enable_progress(cur)
+        statement_types = self._get_statement_types(query)
+
+        # with history enabled, the result of a select goes through a temporary table so it can be cached
+        cache_result = self.history is not None and statement_types == {"SELECT"}
+
+        self._query_cursor = cur
+        self._running_query = (query, statement_types, cache_result, time.perf_counter())
+        self._update_query_progress()
+        self.progress_indicator.display = True
+        self._progress_timer = self.set_interval(
+            PROGRESS_REFRESH_INTERVAL, self._update_query_progress
+        )
+        self.run_worker(
+            lambda: self._run_query(cur, query, cache_result),
+            thread=True,
+            exit_on_error=False,
+        )
+
+    def _run_query(self, cur: duckdb.DuckDBPyConnection, query: str, cache_result: bool):
+        # runs in a worker thread, the result is handed back to the UI thread
+        # peak memory is only sampled for the query log
+        memory = MemorySampler(self.conn.cursor) if self.query_log is not None else None
 
         try:
-            cur.execute(query)
-            result = cur.fetchall()
-            self.last_query = query
+            start = time.perf_counter()
+
+            with memory or contextlib.nullcontext():
+                try:
+                    if cache_result:
+                        cur.execute(f"create or replace temp table {RESULT_TABLE_NAME} as {query}")
+                        cur.execute(f"select * from {RESULT_TABLE_NAME}")
+                    else:
+                        cur.execute(query)
+                finally:
+                    self.table_versions.record(query)
+
+                rows = cur.fetchall()
+
+            duration = time.perf_counter() - start
+            col_names = [col[0] for col in cur.description] if cur.description else []
         except Exception as e:
-            self._display_error_in_table(str(e))
+            self.call_from_thread(self._finish_query, error=str(e))
+            return
+
+        # saving to the history copies the result, so it's done here rather than on the UI thread
+        warnings = []
+
+        if self.history is not None:
+            try:
+                self.history.record(
+                    cur,
+                    query,
+                    duration,
+                    len(rows),
+                    RESULT_TABLE_NAME if cache_result else None,
+                )
+            except Exception as e:
+                warnings.append(f"failed to save query history: {e}")
+
+        if self.query_log is not None:
+            try:
+                self.query_log.record(
+                    cur,
+                    query,
+                    duration,
+                    rows=len(rows),
+                    sources=self.sources,
+                    load_time=self.load_time,
+                    peak_memory_bytes=memory.peak_bytes,
+                )
+            except Exception as e:
+                warnings.append(f"failed to write to the query log: {e}")
+
+        if cache_result:
+            cur.execute(f"drop table if exists {RESULT_TABLE_NAME}")
+
+        self.call_from_thread(
+            self._finish_query, (col_names, rows, duration), warnings=warnings
+        )
+
+    def _update_query_progress(self):
+        if self._query_cursor is None:
+            return
+
+        percent = self._query_cursor.query_progress()
+        elapsed = time.perf_counter() - self._running_query[3]
+
+        # -1 means DuckDB can't tell how far along the query is
+        self.progress_indicator.update(
+            str(QueryProgress(percent if percent >= 0 else None, elapsed))
+        )
+
+    def _finish_query(
+        self,
+        result: Tuple[List[str], List[tuple], float] = None,
+        error: str = None,
+        warnings: List[str] = None,
+    ):
+        """
+        Show the result of the query that ran in the background, or the error it failed with
+
+        :param result: column names, rows and seconds the query took, defaults to None
+        :type result: Tuple[List[str], List[tuple], float], optional
+        :param error: error message if the query failed, defaults to None
+        :type error: str, optional
+        :param warnings: messages about saving the query to the history or query log that failed, defaults to None
+        :type warnings: List[str], optional
+        """
+        cur = self._query_cursor
+        query, statement_types, _, _ = self._running_query
+        self._query_cursor = None
+        self._running_query = None
+        self._progress_timer.stop()
+        self.progress_indicator.display = False
+
+        if error is not None:
+            self._display_error_in_table(error)
             cur.close()
             return
 
+        col_names, rows, _ = result
+        self.last_query = query
+        self._show_result(col_names, rows)
+
+        for warning in warnings or []:
+            self.notify(warning, severity="warning")
+
+        cur.close()
+
+        # after executing a statement, update the table list and completions in case any tables were
+        # created or dropped and recompute stats for tables that changed
+        self._refresh_completions(statement_types)
+        self._refresh_table_tree()
+        self.table_stats.start_background(self._handle_table_stats_computed)
+
+        # the statement may have changed the table being previewed
+        if self._preview_table is not None:
+            self.table_previews.prefetch(
+                [self._preview_table], self._handle_preview_fetched
+            )
+
+    def _show_result(self, col_names: List[str], rows: List[tuple]):
+        """
+        Show a query result in the result table
+
+        :param col_names: column names
+        :type col_names: List[str]
+        :param rows: rows of the result
+        :type rows: List[tuple]
+        """
         try:
-            col_names = [col[0] for col in cur.description]
             self.result_table.clear(columns=True)
             self.result_table.add_columns(*col_names)
-            self.result_table.add_rows(result)
+            self.result_table.add_rows(rows)
         except Exception as e:
             self._display_error_in_table(str(e))
+
+    def action_show_history(self):
+        if self.history is None:
+            self.notify("query history is not enabled", severity="warning")
+            return
+
+        self.push_screen(
+            QueryHistoryScreen(self.history.entries()),
+            callback=self.handle_history_selected,
+        )
+
+    def handle_history_selected(self, entry: HistoryEntry):
+        if entry is None:
+            return
+
+        executed_at = datetime.fromtimestamp(entry.executed_at).strftime("%Y-%m-%d %H:%M")
+
+        if not entry.is_cached:
+            self.notify(
+                f"the result of this query from {executed_at} is not cached, run it again to see the result",
+                severity="warning",
+            )
+            return
+
+        self.run_worker(
+            lambda: self._open_history_result(entry, executed_at),
+            thread=True,
+            exit_on_error=False,
+        )
+
+    def _open_history_result(self, entry: HistoryEntry, executed_at: str):
+        # runs in a worker thread, reading a large cached result would block the UI
+        cur = self.conn.cursor()
+
+        try:
+            col_names, rows = self.history.open_result(cur, entry)
+        except Exception as e:
+            self.call_from_thread(self._display_error_in_table, str(e))
+            return
         finally:
             cur.close()
 
-        # after executing a statement, update the table list in case any tables were created or dropped
-        self._refresh_table_tree()
+        self.call_from_thread(
+            self._show_history_result, entry, executed_at, col_names, rows
+        )
+
+    def _show_history_result(
+        self,
+        entry: HistoryEntry,
+        executed_at: str,
+        col_names: List[str],
+        rows: List[tuple],
+    ):
+        self._show_result(col_names, rows)
+        self.last_query = entry.query
+        self.notify(
+            f"cached result from {executed_at}, {entry.result_rows:,} of {entry.row_count:,} rows"
+        )
@@ -7,7 +7,8 @@ controls
 |---|------|
 |ctrl+c|quit|
 |f2|toggle help screen|
-|f9|execute SQL in the editor|
+|f3|show query history, select a query to open its cached result|
+|f9|execute SQL in the editor, queries run in the background with their progress shown above the footer|
 |ctrl+q|save editor content|
 |ctrl+r|save result|
 |ctrl+p|close all open dialogs (help screen, save file dialogs)|
@@ -52,7 +53,14 @@ editor controls
 
 ---
 
-When you navigate to the table list on the left side, press `space` or `enter` to expand/collapse table columns.
+While typing a table name, column name, function or keyword, matching names are shown below the cursor. 
+Use `up`/`down` to pick one, `tab` or `enter` to insert it and `escape` to close the list. Type a table name 
+or alias followed by `.` to list that table's columns.
+
+---
+
+When you navigate to the table list on the left side, press `space` or `enter` to expand/collapse table columns. 
+The first rows of the highlighted table are shown below the list.
 
 ---
 
@@ -0,0 +1,58 @@
+from datetime import datetime
+from typing import List
+
+from rich.text import Text
+from textual import on
+from textual.binding import Binding
+from textual.containers import Container, Vertical
+from textual.screen import ModalScreen
+from textual.widgets import OptionList, Rule, Static
+
+from ...queryhistory import HistoryEntry
+
+# number of characters of a query shown in the list
+QUERY_PREVIEW_LENGTH = 80
+
+
+class QueryHistoryScreen(ModalScreen):
+    BINDINGS = [
+        Binding("escape", "exit")
+    ]
+
+    def __init__(self, entries: List[HistoryEntry]):
+        self.entries = entries
+        super().__init__()
+
+    def _format_entry(self, entry: HistoryEntry) -> Text:
+        executed_at = datetime.fromtimestamp(entry.executed_at).strftime("%Y-%m-%d %H:%M")
+        query = " ".join(entry.query.split())
+
+        if len(query) > QUERY_PREVIEW_LENGTH:
+            query = query[: QUERY_PREVIEW_LENGTH - 3] + "..."
+
+        label = Text(query)
+        label.append(
+            f"\n{executed_at}, {entry.duration:.2f}s, {entry.row_count:,} rows",
+            style="dim",
+        )
+
+        if entry.is_cached:
+            label.append(", result cached", style="dim green")
+
+        return label
+
+    def compose(self):
+        with Container(id="history-container"):
+            yield Vertical(
+                Static("Query history", id="menu-title"),
+                Static("(enter to open a cached result, esc to close this)", classes="centered"),
+                Rule(),
+                OptionList(*[self._format_entry(entry) for entry in self.entries]),
+            )
+
+    def action_exit(self):
+        self.dismiss()
+
+    @on(OptionList.OptionSelected)
+    def handle_entry_selected(self, event: OptionList.OptionSelected):
+        self.dismiss(self.entries[event.option_index])
@@ -0,0 +1,160 @@
+import re
+from typing import List, Tuple
+
+from rich.text import Text
+from textual import events
+from textual.widgets import OptionList, TextArea
+
+from ..completion import Completion, CompletionIndex, find_aliases, format_identifier
+from ..completionkind import CompletionKind
+from ..statements import StatementIndex
+
+# maximum number of completions shown in the popup
+MAX_COMPLETIONS = 20
+
+# the name being typed right before the cursor, with the table name or alias before it if it's qualified
+_WORD_REGEX = re.compile(r'(?:("(?:""|[^"])+"|[A-Za-z_][\w$]*)\.)?([A-Za-z_][\w$]*)?$')
+
+
+class SqlEditor(TextArea):
+    """
+    TextArea with a completion popup for table names, column names, functions and keywords.
+    The popup is shown while a name is typed, up and down select a completion, tab or enter
+    inserts it and escape closes the popup.
+    """
+
+    def __init__(
+        self,
+        completions: CompletionIndex,
+        popup: OptionList,
+        statements: StatementIndex,
+        **kwargs,
+    ):
+        """
+        SqlEditor constructor, other arguments are passed on to TextArea
+
+        :param completions: index to look up completions in
+        :type completions: CompletionIndex
+        :param popup: option list to show completions in, it's shown and hidden by the editor
+        :type popup: OptionList
+        :param statements: statement boundaries in the editor, used to find the tables the current statement reads from
+        :type statements: StatementIndex
+        """
+        super().__init__(**kwargs)
+        self.completions = completions
+        self.popup = popup
+        self.statements = statements
+        self._shown: List[Completion] = []
+
+        # set when a key that edits the name at the cursor is pressed, so completions are looked
+        # up when the edit shows up in a Changed event, but not for other changes to the text
+        self._complete_on_change = False
+
+    def _get_word_at_cursor(self) -> Tuple[str, str]:
+        """
+        Get the name being typed at the cursor
+
+        :return: table name or alias before a dot (None if there isn't one), and the partially typed name
+        :rtype: Tuple[str, str]
+        """
+        row, col = self.cursor_location
+        match = _WORD_REGEX.search(self.document[row][:col])
+
+        return match.group(1), match.group(2) or ""
+
+    def update_completions(self):
+        """
+        Look up completions for the name at the cursor and show them, or hide the popup if there are none
+        """
+        qualifier, prefix = self._get_word_at_cursor()
+
+        if qualifier is None and not prefix:
+            self.hide_completions()
+            return
+
+        self.statements.update(self.text)
+        row, col = self.cursor_location
+        stmt = self.statements.statement_at(
+            self.statements.offset_from_location(row, col)
+        )
+        aliases = find_aliases(self.statements.text[stmt.start : stmt.end])
+
+        self._shown = self.completions.complete(
+            prefix, qualifier, aliases, limit=MAX_COMPLETIONS
+        )
+
+        # nothing to offer if the only completion is what's already typed
+        if not self._shown or (
+            len(self._shown) == 1 and self._shown[0].text == prefix
+        ):
+            self.hide_completions()
+            return
+
+        self.popup.clear_options()
+        self.popup.add_options(
+            [
+                Text(completion.text).append(f"  {completion.detail}", style="dim")
+                for completion in self._shown
+            ]
+        )
+        self.popup.highlighted = 0
+
+        cursor = self.cursor_screen_offset
+        self.popup.styles.offset = (max(cursor.x - len(prefix), 0), cursor.y + 1)
+        self.popup.display = True
+
+    def hide_completions(self):
+        self.popup.display = False
+        self._shown = []
+
+    def accept_completion(self):
+        """
+        Replace the name at the cursor with the highlighted completion
+        """
+        if self.popup.highlighted is None or not self._shown:
+            return
+
+        completion = self._shown[self.popup.highlighted]
+        _, prefix = self._get_word_at_cursor()
+        text = completion.text
+
+        if completion.kind in (CompletionKind.TABLE, CompletionKind.COLUMN):
+            text = format_identifier(text)
+
+        row, col = self.cursor_location
+        self.hide_completions()
+        self.replace(text, (row, col - len(prefix)), (row, col))
+
+    async def _on_key(self, event: events.Key):
+        if self.popup.display:
+            handled = True
+
+            if event.key == "up":
+                self.popup.action_cursor_up()
+            elif event.key == "down":
+                self.popup.action_cursor_down()
+            elif event.key in ("tab", "enter"):
+                self.accept_completion()
+            elif event.key == "escape":
+                self.hide_completions()
+            else:
+                handled = False
+
+            if handled:
+                event.stop()
+                event.prevent_default()
+                return
+
+        self._complete_on_change = event.is_printable or event.key == "backspace"
+
+        # any other key, e.g. moving the cursor, closes the popup
+        if not self._complete_on_change:
+            self.hide_completions()
+
+        await super()._on_key(event)
+
+    def on_text_area_changed(self, event: TextArea.Changed):
+        # not stopped, so the app sees the event too
+        if self._complete_on_change:
+            self._complete_on_change = False
+            self.update_completions()
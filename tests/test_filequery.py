@@ -1,6 +1,18 @@
+import asyncio
+import importlib.util
+import io
+import json
 import os
+import subprocess
+import shutil
 import sys
+import tempfile
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import duckdb
+import numpy as np
 
 # add src folder to path so filequery can be imported
 src_path = os.path.join(os.getcwd(), "src")
@@ -10,10 +22,26 @@ sys.path.append(src_path)
 sample_data_path = os.path.join(os.getcwd(), "example")
 sys.path.append(sample_data_path)
 
-from filequery import handle_args, validate_args
+from filequery import (get_query_params, handle_args, parse_job, parse_param,
+                       parse_table_columns, split_queries, validate_args)
+from filequery.asyncfiledb import AsyncFileDb
+from filequery.completion import CompletionIndex, find_aliases, format_identifier
+from filequery.completionkind import CompletionKind
 from filequery.file_query_args import FileQueryArgs
-from filequery.filedb import FileDb, FileType
+from filequery.filedb import BatchFormat, FileDb, FileType
+from filequery.jobs import Job, run_jobs, write_report
+from filequery.jobstatus import JobStatus
+from filequery.loaderrormode import LoadErrorMode
+from filequery.queryhistory import QueryHistory
+from filequery.progress import LoadProgress, ProgressPrinter, QueryProgress
+from filequery.querylog import QueryLog, normalized_sql_hash
 from filequery.queryresult import QueryResult
+from filequery.shards import build_merge_query, query_shards
+from filequery.sources import SourceOptions
+from filequery.statements import StatementIndex
+from filequery.summarytables import SummaryTable
+from filequery.tablepreview import TablePreviewCache, neighbours
+from filequery.tablestats import TableVersions
 
 
 class TestFileQuery(unittest.TestCase):
@@ -144,6 +172,503 @@ class TestFileQuery(unittest.TestCase):
         for rec in res.dict_records:
             self.assertListEqual(list(rec["nested"].keys()), ["subid", "subval"])
 
+    def test_bounded_table_head_and_tail(self):
+        fdb = FileDb("example/test.csv")
+        res = fdb.exec_query("select range as id from range(1000)")
+        table = res._build_table(max_rows=4)
+
+        # two rows from the head, an ellipsis row and two rows from the tail
+        self.assertEqual(table.row_count, 5)
+
+    def test_write_delimited(self):
+        fdb = FileDb("example/test.csv")
+        res = fdb.exec_query("select * from test")
+        out = io.StringIO()
+        res.write_delimited(out, "|")
+
+        self.assertEqual(out.getvalue(), str(res).replace(",", "|") + "\n")
+
+    def test_export_ndjson_to_stream(self):
+        fdb = FileDb("example/test.csv")
+        out = io.BytesIO()
+        fdb.export_query_to_stream("select * from test", out, FileType.NDJSON)
+        lines = out.getvalue().decode().splitlines()
+
+        self.assertEqual(len(lines), 3)
+        self.assertDictEqual(json.loads(lines[0]), {"col1": 1, "col2": "test 1", "col3": 0.1})
+
+    def test_export_json_array_to_stream(self):
+        fdb = FileDb("example/test.csv")
+        out = io.BytesIO()
+        fdb.export_query_to_stream("select * from test", out, FileType.JSON, batch_size=2)
+
+        self.assertEqual(len(json.loads(out.getvalue())), 3)
+
+    def test_exec_query_with_params(self):
+        fdb = FileDb("example/test.csv")
+        res = fdb.exec_query("select col2 from test where col1 = $id", {"id": 2})
+
+        self.assertListEqual(res.records, [["test 2"]])
+
+    def test_prepared_query(self):
+        fdb = FileDb("example/test.csv")
+        query = fdb.prepare("select col2 from test where col1 = ?")
+
+        self.assertSetEqual(query.parameters, {"1"})
+
+        for i in range(1, 4):
+            self.assertEqual(query.exec_query([i]).records[0][0], f"test {i}")
+
+    def test_prepare_multiple_statements(self):
+        fdb = FileDb("example/test.csv")
+
+        with self.assertRaises(ValueError):
+            fdb.prepare("select 1; select 2")
+
+    def test_export_query_with_params_and_quote_in_path(self):
+        fdb = FileDb("example/test.csv")
+        out_file = "test_it's_result.csv"
+        fdb.export_query(
+            "select * from test where col1 > $min_id", out_file, params={"min_id": 1}
+        )
+
+        with open(out_file) as f:
+            lines = f.read().splitlines()
+
+        os.remove(out_file)
+
+        self.assertEqual(len(lines), 3)
+
+    def test_build_summaries(self):
+        # listed before the summary it reads from, so it has to wait for it
+        summaries = [
+            SummaryTable("doubled", "select total * 2 as total from totals"),
+            SummaryTable("totals", "select sum(col1) as total from test"),
+        ]
+        fdb = FileDb("example/test.csv", summaries=summaries)
+        res = fdb.exec_query("select total from doubled")
+
+        self.assertEqual(res.records[0][0], 12)
+
+    def test_summaries_with_cycle(self):
+        fdb = FileDb("example/test.csv")
+        summaries = [
+            SummaryTable("a", "select * from b"),
+            SummaryTable("b", "select * from a"),
+        ]
+
+        with self.assertRaises(ValueError):
+            fdb.build_summaries(summaries)
+
+    def test_summaries_kept_in_database(self):
+        summaries = [SummaryTable("totals", "select count(*) as n from test")]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, "test.csv")
+            db_path = os.path.join(tmp_dir, "test.duckdb")
+            shutil.copy("example/test.csv", csv_path)
+
+            fdb = FileDb(csv_path, database=db_path)
+            self.assertListEqual(fdb.build_summaries(summaries), ["totals"])
+            fdb.close()
+
+            # nothing changed, so the summary from the last run is reused
+            fdb = FileDb(csv_path, database=db_path)
+            self.assertListEqual(fdb.build_summaries(summaries), [])
+            fdb.close()
+
+            with open(csv_path, "a") as f:
+                f.write("4,test 4,0.4\n")
+
+            # make sure the modification time changes even on file systems with coarse timestamps
+            stat = os.stat(csv_path)
+            os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+            fdb = FileDb(csv_path, database=db_path)
+            self.assertListEqual(fdb.build_summaries(summaries), ["totals"])
+            self.assertEqual(fdb.exec_query("select n from totals").records[0][0], 4)
+            fdb.close()
+
+    def test_source_options(self):
+        options = {"test": SourceOptions(order_by=["col1 desc"], indexes=["col1"])}
+        fdb = FileDb("example/test.csv", source_options=options)
+        res = fdb.exec_query("select col1 from test")
+        indexes = fdb.exec_query("select index_name from duckdb_indexes()")
+        load_stats = fdb.load_stats()
+
+        self.assertListEqual([rec[0] for rec in res.records], [3, 2, 1])
+        self.assertListEqual(indexes.records, [["test_col1_idx"]])
+        self.assertListEqual(list(load_stats[0].index_times), ["col1"])
+
+    def test_source_options_columns_and_where(self):
+        options = {"test": SourceOptions(columns=["col1", "col3"], where="col1 > 1")}
+        fdb = FileDb("example/test.csv", source_options=options)
+        res = fdb.exec_query("select * from test order by col1")
+
+        self.assertListEqual(list(res.result_cols), ["col1", "col3"])
+        self.assertListEqual([rec[0] for rec in res.records], [2, 3])
+
+    def test_source_options_exclude(self):
+        fdb = FileDb("example/test.csv", source_options={"test": SourceOptions(exclude=["col2"])})
+        res = fdb.exec_query("select * from test")
+
+        self.assertListEqual(list(res.result_cols), ["col1", "col3"])
+
+    def test_source_options_json_columns(self):
+        options = {
+            "ndjson_test": SourceOptions(json_columns={"id": "INTEGER", "value": "VARCHAR"})
+        }
+        fdb = FileDb("example/ndjson_test.ndjson", source_options=options)
+        res = fdb.exec_query("select * from ndjson_test order by id")
+
+        self.assertListEqual(list(res.result_cols), ["id", "value"])
+        self.assertListEqual(res.records[0], [1, "abc"])
+
+    def test_source_options_json_paths(self):
+        options = {
+            "json_test": SourceOptions(json_paths={"item": "$"}, json_unnest="$.list")
+        }
+        fdb = FileDb("example/json_test.json", source_options=options)
+        res = fdb.exec_query("select item from json_test")
+
+        self.assertListEqual([rec[0] for rec in res.records], ["1", "2", "3", "4"])
+
+    def test_source_options_json_invalid(self):
+        with self.assertRaises(ValueError):
+            SourceOptions(json_format="lines")
+
+        with self.assertRaises(ValueError):
+            SourceOptions(json_unnest="$.list")
+
+        with self.assertRaises(ValueError):
+            FileDb("example/test.csv", source_options={"test": SourceOptions(json_format="array")})
+
+    def test_source_options_unknown_table(self):
+        with self.assertRaises(ValueError):
+            FileDb("example/test.csv", source_options={"other": SourceOptions(indexes=["col1"])})
+
+    def test_add_and_remove_sources(self):
+        fdb = FileDb("example/test.csv")
+        added = fdb.add_sources(
+            ["example/json_test.json", "example/ndjson_test.ndjson"],
+            {"ndjson_test": SourceOptions(columns=["id"])},
+        )
+        res = fdb.exec_query("select * from ndjson_test")
+
+        self.assertListEqual(added, ["json_test", "ndjson_test"])
+        self.assertListEqual(list(res.result_cols), ["id"])
+        self.assertListEqual(
+            [info.table for info in fdb.sources()], ["test", "json_test", "ndjson_test"]
+        )
+        self.assertEqual(fdb.sources()[1].format, FileType.JSON)
+
+        fdb.remove_source("json_test")
+
+        self.assertListEqual(sorted(fdb.source_files()), ["ndjson_test", "test"])
+
+        with self.assertRaises(Exception):
+            fdb.exec_query("select * from json_test")
+
+        with self.assertRaises(ValueError):
+            fdb.add_source("example/test.csv")
+
+    def test_add_sources_rolls_back(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bad_path = os.path.join(tmp_dir, "bad.parquet")
+
+            with open(bad_path, "w") as f:
+                f.write("not parquet")
+
+            fdb = FileDb("example/test.csv")
+
+            with self.assertRaises(Exception):
+                fdb.add_sources(["example/json_test.json", bad_path])
+
+            tables = fdb.exec_query("select table_name from duckdb_tables()")
+
+            self.assertListEqual(tables.records, [["test"]])
+            self.assertListEqual(list(fdb.source_files()), ["test"])
+
+    def test_skip_files_that_fail_to_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shutil.copy("example/test.csv", tmp_dir)
+
+            with open(os.path.join(tmp_dir, "bad.parquet"), "w") as f:
+                f.write("not parquet")
+
+            with self.assertRaises(Exception):
+                FileDb(tmp_dir)
+
+            fdb = FileDb(tmp_dir, on_load_error=LoadErrorMode.SKIP)
+            errors = fdb.load_errors()
+
+            self.assertListEqual(list(fdb.source_files()), ["test"])
+            self.assertListEqual([error.table for error in errors], ["bad"])
+
+    def test_skip_file_with_same_table_name(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shutil.copy("example/test.csv", os.path.join(tmp_dir, "t.csv"))
+            shutil.copy("example/json_test.json", os.path.join(tmp_dir, "t.json"))
+
+            fdb = FileDb(tmp_dir, on_load_error=LoadErrorMode.SKIP)
+            errors = fdb.load_errors()
+            loaded_path = fdb.source_files()["t"]
+
+            self.assertEqual(len(errors), 1)
+            self.assertNotEqual(errors[0].path, loaded_path)
+            self.assertListEqual([info.table for info in fdb.sources()], ["t"])
+            self.assertGreater(fdb.exec_query("select count(*) from t").records[0][0], 0)
+
+    def test_skipped_file_leaves_no_table(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shutil.copy("example/test.csv", os.path.join(tmp_dir, "bad.csv"))
+
+            # the table is created before building its index fails
+            fdb = FileDb(
+                tmp_dir,
+                source_options={"bad": SourceOptions(indexes=["missing"])},
+                on_load_error=LoadErrorMode.SKIP,
+            )
+            tables = fdb.exec_query("select table_name from duckdb_tables()")
+
+            self.assertListEqual([error.table for error in fdb.load_errors()], ["bad"])
+            self.assertListEqual(tables.records, [])
+
+    def test_quarantine_malformed_rows(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, "data.csv")
+
+            with open(csv_path, "w") as f:
+                f.write("a,b\n1,2\n3,4,5\n6,7\n")
+
+            fdb = FileDb(csv_path, on_load_error=LoadErrorMode.QUARANTINE)
+            rows = fdb.exec_query("select a from data order by a")
+            rejects = fdb.exec_query("select table_name, csv_line from load_rejects")
+
+            self.assertListEqual(rows.records, [[1], [6]])
+            self.assertListEqual(rejects.records, [["data", "3,4,5"]])
+
+    def test_resume_load(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_dir = os.path.join(tmp_dir, "data")
+            db_path = os.path.join(tmp_dir, "load.duckdb")
+            shutil.copytree("example/data", data_dir)
+
+            with self.assertRaises(ValueError):
+                FileDb(data_dir, resume=True)
+
+            FileDb(data_dir, database=db_path).close()
+
+            csv_path = os.path.join(data_dir, "test.csv")
+
+            with open(csv_path, "a") as f:
+                f.write("4,test 4,0.4\n")
+
+            stat = os.stat(csv_path)
+            os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+            fdb = FileDb(data_dir, database=db_path, resume=True)
+
+            # only the file that changed is loaded again
+            self.assertListEqual([stats.table for stats in fdb.load_stats()], ["test"])
+            self.assertEqual(fdb.exec_query("select count(*) from test").records[0][0], 4)
+            self.assertEqual(len(fdb.sources()), len(os.listdir(data_dir)))
+            fdb.close()
+
+    def test_refresh_source(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, "data.csv")
+            shutil.copy("example/test.csv", csv_path)
+
+            fdb = FileDb(csv_path)
+
+            self.assertFalse(fdb.refresh_source("data"))
+
+            with open(csv_path, "a") as f:
+                f.write("4,d,0.4\n")
+
+            stat = os.stat(csv_path)
+            os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+            self.assertTrue(fdb.refresh_source("data"))
+            self.assertEqual(fdb.exec_query("select count(*) from data").records[0][0], 4)
+
+    def test_force_refresh_source_when_resuming(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            csv_path = os.path.join(tmp_dir, "data.csv")
+            shutil.copy("example/test.csv", csv_path)
+            db_path = os.path.join(tmp_dir, "data.duckdb")
+
+            fdb = FileDb(csv_path, database=db_path, resume=True)
+            fdb.exec_query("insert into data values (4, 'd', 0.4)")
+
+            # the file didn't change, so its checkpoint still matches
+            self.assertTrue(fdb.refresh_source("data", force=True))
+            self.assertEqual(fdb.exec_query("select count(*) from data").records[0][0], 3)
+
+    @unittest.skipIf(importlib.util.find_spec("pyarrow") is None, "requires pyarrow")
+    def test_export_arrow_to_stream(self):
+        import pyarrow as pa
+
+        fdb = FileDb("example/test.csv")
+        out = io.BytesIO()
+        fdb.export_query_to_stream("select * from test", out, FileType.ARROW)
+        table = pa.ipc.open_stream(out.getvalue()).read_all()
+
+        self.assertEqual(table.num_rows, 3)
+        self.assertListEqual(table.column_names, ["col1", "col2", "col3"])
+
+    def test_register_numpy_arrays(self):
+        fdb = FileDb(tables={"nums": {"id": np.array([1, 2, 3])}})
+        res = fdb.exec_query("select sum(id) from nums")
+
+        self.assertEqual(res.records[0][0], 6)
+
+    def test_register_with_files(self):
+        fdb = FileDb(["example/test.csv"], tables={"ids": {"col1": np.array([1, 3])}})
+        res = fdb.exec_query("select * from test inner join ids using (col1)")
+
+        self.assertEqual(len(res.records), 2)
+
+    def test_registered_object_visible_on_cursor(self):
+        fdb = FileDb("example/test.csv")
+        fdb.register("ids", {"col1": np.array([1, 2])})
+        cur = fdb.cursor()
+
+        self.assertEqual(len(cur.execute("select * from ids").fetchall()), 2)
+        cur.close()
+
+    def test_iter_query_rows(self):
+        fdb = FileDb("example/test.csv")
+        batches = list(fdb.iter_query("select * from range(25)", batch_size=10))
+
+        self.assertListEqual([len(batch) for batch in batches], [10, 10, 5])
+
+    def test_iter_query_stop_early(self):
+        fdb = FileDb("example/test.csv")
+        batches = fdb.iter_query("select * from range(100)", batch_size=10)
+        first = next(batches)
+        batches.close()
+
+        self.assertEqual(first[0], (0,))
+
+    @unittest.skipIf(importlib.util.find_spec("pyarrow") is None, "requires pyarrow")
+    def test_iter_query_numpy(self):
+        fdb = FileDb("example/test.csv")
+        batches = list(
+            fdb.iter_query("select * from test", batch_format=BatchFormat.NUMPY)
+        )
+
+        self.assertEqual(len(batches), 1)
+        self.assertEqual(batches[0]["col1"].sum(), 6)
+
+    def test_exec_query_from_threads(self):
+        fdb = FileDb("example/test.csv", max_cursors=2)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(
+                executor.map(lambda _: fdb.exec_query("select * from test"), range(8))
+            )
+
+        for res in results:
+            self.check_select_star_from_test(res)
+
+        stats = fdb.cursor_pool_stats()
+        self.assertLessEqual(stats.size, 2)
+        self.assertEqual(stats.in_use, 0)
+        self.assertEqual(stats.checkouts, 8)
+
+    def test_table_created_in_thread_visible_to_others(self):
+        fdb = FileDb("example/test.csv")
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            executor.submit(
+                fdb.exec_query, "create table test2 as select * from test"
+            ).result()
+
+        res = fdb.exec_query("select * from test2")
+
+        self.check_select_star_from_test(res)
+
+    def test_table_stats(self):
+        fdb = FileDb("example/data/test_null.csv")
+        stats = fdb.table_stats("test_null")
+        col2 = [col for col in stats.columns if col.name == "col2"][0]
+
+        self.assertEqual(stats.row_count, 3)
+        self.assertAlmostEqual(col2.null_fraction, 1 / 3, places=2)
+        self.assertEqual(col2.min, "test 1")
+
+    def test_memory_report(self):
+        fdb = FileDb("example/data")
+        fdb.exec_query("create table big as select range as id from range(1000000)")
+        report = fdb.memory_report()
+        tables = {mem.table: mem for mem in report.tables}
+
+        self.assertIn("space filename", tables)
+        self.assertEqual(tables["big"].row_count, 1000000)
+        self.assertGreater(tables["big"].estimated_bytes, 1000000 * 8 * 0.9)
+        self.assertGreater(report.memory_usage_bytes, 0)
+        self.assertIsNotNone(fdb.table_stats("big").estimated_bytes)
+
+    def test_table_stats_cached_until_table_changes(self):
+        fdb = FileDb("example/test.csv")
+        stats = fdb.table_stats("test")
+
+        self.assertIs(fdb.table_stats("test"), stats)
+
+        fdb.exec_query("insert into test values (4, 'test 4', 0.4)")
+
+        self.assertEqual(fdb.table_stats("test").row_count, 4)
+
+        # an update keeps the number of rows and columns
+        stats = fdb.table_stats("test")
+        fdb.exec_query("select * from test")
+
+        self.assertIs(fdb.table_stats("test"), stats)
+
+        fdb.exec_query("update test set col1 = col1 + 100")
+
+        self.assertEqual(fdb.table_stats("test").columns[0].min, "101")
+
+    def test_sample_rows(self):
+        fdb = FileDb("example/data/test_special_chars.csv", sample="2")
+        res = fdb.exec_query("select * from test_special_chars")
+
+        self.assertEqual(len(res.records), 2)
+
+    def test_sample_percent_full(self):
+        fdb = FileDb("example/test.csv", sample="100%")
+        res = fdb.exec_query("select * from test")
+
+        self.check_select_star_from_test(res)
+
+    def test_invalid_sample(self):
+        with self.assertRaises(ValueError):
+            FileDb("example/test.csv", sample="ten percent")
+
+    def test_read_from_stdin(self):
+        script = (
+            "from filequery.filedb import FileDb, FileType;"
+            "fdb = FileDb('-', input_format=FileType.CSV);"
+            "print(fdb.exec_query('select count(*) from stdin').records[0][0])"
+        )
+
+        with open("example/test.csv") as f:
+            proc = subprocess.run(
+                [sys.executable, "-c", script],
+                stdin=f,
+                capture_output=True,
+                text=True,
+                env={**os.environ, "PYTHONPATH": src_path},
+            )
+
+        self.assertEqual(proc.stdout.strip(), "3")
+
+    def test_stdin_requires_input_format(self):
+        with self.assertRaises(ValueError):
+            FileDb("-")
+
     def test_valid_unquoted_identifier(self):
         fdb = FileDb("example/test.csv")
         should_quote = fdb._should_quote_table_name("test_table")
@@ -193,6 +718,419 @@ class TestFileQuery(unittest.TestCase):
         self.assertTrue(should_quote)
 
 
+class TestCompletion(unittest.TestCase):
+    def setUp(self):
+        self.fdb = FileDb("example/test.csv")
+        self.completions = CompletionIndex()
+        self.completions.build(self.fdb.db)
+
+    def test_prefix(self):
+        completions = self.completions.complete("tes")
+
+        self.assertEqual(completions[0].text, "test")
+        self.assertEqual(completions[0].kind, CompletionKind.TABLE)
+
+    def test_fuzzy(self):
+        completions = self.completions.complete("cl3")
+
+        self.assertIn("col3", [completion.text for completion in completions])
+
+    def test_qualified_with_alias(self):
+        aliases = find_aliases("select t. from test t")
+        completions = self.completions.complete("", "t", aliases)
+
+        self.assertListEqual([completion.text for completion in completions], ["col1", "col2", "col3"])
+
+    def test_refresh_after_ddl(self):
+        self.fdb.exec_query("create table other (other_col int)")
+        self.fdb.exec_query("drop table test")
+        changed = self.completions.refresh(self.fdb.db)
+
+        self.assertSetEqual(changed, {"other", "test"})
+        self.assertEqual(self.completions.complete("other_")[0].text, "other_col")
+        self.assertNotIn("col1", [completion.text for completion in self.completions.complete("col")])
+
+    def test_format_identifier(self):
+        self.assertEqual(format_identifier("col1"), "col1")
+        self.assertEqual(format_identifier("First Name"), '"First Name"')
+
+
+class TestTablePreview(unittest.TestCase):
+    def setUp(self):
+        self.con = duckdb.connect()
+        self.con.execute("create table t as select range as a from range(1000)")
+        self.versions = TableVersions()
+        self.previews = TablePreviewCache(self.con.cursor, rows=5, versions=self.versions)
+
+    def tearDown(self):
+        self.con.close()
+
+    def test_fetch_caches_until_table_changes(self):
+        preview = self.previews.fetch("t")
+
+        self.assertListEqual(preview.col_names, ["a"])
+        self.assertEqual(len(preview.rows), 5)
+        self.assertIs(self.previews.fetch("t"), preview)
+
+        self.con.execute("create or replace table t as select 'x' as b")
+        preview = self.previews.fetch("t")
+
+        self.assertListEqual(preview.col_names, ["b"])
+        self.assertIsNotNone(self.previews.fetch("missing").error)
+
+    def test_fetch_after_update(self):
+        self.previews.fetch("t")
+
+        query = "update t set a = a + 100"
+        self.con.execute(query)
+        self.versions.record(query)
+
+        self.assertEqual(self.previews.fetch("t").rows[0][0], 100)
+
+    def test_prefetch(self):
+        self.con.execute("create table u as select 1 as c")
+        fetched = []
+
+        self.previews.prefetch(["t", "u"], fetched.append).join()
+
+        self.assertListEqual([preview.table for preview in fetched], ["t", "u"])
+        self.assertIsNotNone(self.previews.get("u"))
+        self.assertListEqual(neighbours(["a", "b", "c", "d"], 1, 2), ["b", "c", "a", "d"])
+
+
+class TestQueryHistory(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fdb = FileDb("example/test.csv")
+        self.fdb.exec_query("create table result as select * from test")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_record_and_open_result(self):
+        history = QueryHistory(self.tmp_dir.name)
+        entry = history.record(self.fdb.db, "select * from test", 0.5, 3, "result")
+
+        # a new instance reads the history saved by the first one
+        entries = QueryHistory(self.tmp_dir.name).entries()
+        col_names, rows = history.open_result(self.fdb.db, entries[0])
+
+        self.assertEqual(entries[0].id, entry.id)
+        self.assertListEqual(col_names, ["col1", "col2", "col3"])
+        self.assertEqual(len(rows), 3)
+
+    def test_result_rows_limited(self):
+        history = QueryHistory(self.tmp_dir.name, max_result_rows=2)
+        entry = history.record(self.fdb.db, "select * from test", 0.5, 3, "result")
+        _, rows = history.open_result(self.fdb.db, entry)
+
+        self.assertEqual(entry.result_rows, 2)
+        self.assertEqual(len(rows), 2)
+
+    def test_least_recently_used_result_evicted(self):
+        history = QueryHistory(self.tmp_dir.name)
+        first = history.record(self.fdb.db, "select 1", 0.1, 3, "result")
+        second = history.record(self.fdb.db, "select 2", 0.1, 3, "result")
+
+        # opening the first result makes the second one the least recently used
+        history.open_result(self.fdb.db, first)
+        history.max_cache_bytes = first.result_size + second.result_size
+        history.record(self.fdb.db, "select 3", 0.1, 3, "result")
+
+        cached = {entry.query for entry in history.entries() if entry.is_cached}
+
+        self.assertSetEqual(cached, {"select 1", "select 3"})
+
+    def test_max_entries(self):
+        history = QueryHistory(self.tmp_dir.name, max_entries=2)
+
+        for i in range(3):
+            history.record(self.fdb.db, f"select {i}", 0.1, 3, "result")
+
+        entries = history.entries()
+        parquet_files = [name for name in os.listdir(self.tmp_dir.name) if name.endswith(".parquet")]
+
+        self.assertListEqual([entry.query for entry in entries], ["select 2", "select 1"])
+        self.assertEqual(len(parquet_files), 2)
+
+
+class TestQueryLog(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_path = os.path.join(self.tmp_dir.name, "query_log.ndjson")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_normalized_sql_hash(self):
+        con = FileDb("example/test.csv").db
+        query_hash = normalized_sql_hash(con, "select * from test where col1 = 1")
+
+        self.assertEqual(query_hash, normalized_sql_hash(con, "SELECT *\nFROM test -- comment\nWHERE col1 = 2"))
+        self.assertNotEqual(query_hash, normalized_sql_hash(con, "select * from test where col2 = 1"))
+
+    def test_log_queries(self):
+        fdb = FileDb("example/data", query_log=QueryLog(self.log_path))
+        out_file = os.path.join(self.tmp_dir.name, "result.csv")
+        res = fdb.exec_query("select * from test join test1 using (col1)")
+        fdb.export_query("select * from test", out_file)
+
+        # the log is queried like any other file
+        records = FileDb(self.log_path).exec_query("select * from query_log").dict_records
+
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]["rows"], len(res.records))
+        self.assertEqual([source["table"] for source in records[0]["sources"]], ["test", "test1"])
+        self.assertEqual(records[0]["sources"][0]["size_bytes"], os.path.getsize("example/data/test.csv"))
+        self.assertEqual(records[1]["bytes_written"], os.path.getsize(out_file))
+        self.assertEqual(records[1]["load_time"], fdb.load_time)
+        self.assertGreater(records[1]["peak_memory_bytes"], 0)
+
+
+class TestProgress(unittest.TestCase):
+    def test_load_progress(self):
+        updates = []
+        FileDb("example/data", on_progress=updates.append)
+        load_updates = [update for update in updates if update.table is None]
+
+        # one update after each file, sharing the same object
+        self.assertEqual(len(load_updates), len(os.listdir("example/data")))
+        self.assertEqual(updates[-1].files_loaded, updates[-1].files_total)
+        self.assertEqual(updates[-1].bytes_loaded, updates[-1].bytes_total)
+        self.assertGreater(updates[-1].rows_loaded, 0)
+
+    def test_query_progress(self):
+        updates = []
+        fdb = FileDb(on_progress=updates.append)
+        fdb.exec_query("create table t as select range as a, random() as b from range(10000000)")
+        fdb.exec_query("select a % 1000, count(distinct b) from t group by 1")
+
+        self.assertTrue(updates)
+        self.assertTrue(all(isinstance(update, QueryProgress) for update in updates))
+        self.assertTrue(all(0 <= update.percent <= 100 for update in updates))
+
+    def test_printer_not_a_terminal(self):
+        out = io.StringIO()
+        printer = ProgressPrinter(out)
+        progress = LoadProgress(2, 100)
+        printer(progress)
+        printer(progress)
+
+        # the final update is printed even right after another one
+        progress.files_loaded = 2
+        printer(progress)
+
+        self.assertEqual(len(out.getvalue().splitlines()), 2)
+
+
+class TestJobs(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.fdb = FileDb("example/test.csv")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_run_jobs(self):
+        out_file = os.path.join(self.tmp_dir.name, "totals.csv")
+        jobs = [
+            # listed before the job it depends on, so it has to wait for it
+            Job("export", query="select * from totals order by col1", out_file=out_file, depends_on=["totals"]),
+            Job("totals", query="create table totals as select col1, sum(col3) as total from test where col1 >= $min group by col1"),
+            Job("broken", query="select * from missing_table"),
+            Job("after_broken", query="select 1", depends_on=["broken"]),
+        ]
+        results = run_jobs(self.fdb, jobs, params={"min": 2})
+
+        self.assertListEqual([result.name for result in results], ["export", "totals", "broken", "after_broken"])
+        self.assertListEqual(
+            [result.status for result in results],
+            [JobStatus.SUCCEEDED, JobStatus.SUCCEEDED, JobStatus.FAILED, JobStatus.SKIPPED],
+        )
+        self.assertGreaterEqual(results[0].started_at, results[1].started_at + results[1].duration)
+
+        with open(out_file) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+        report_path = os.path.join(self.tmp_dir.name, "report.json")
+        write_report(results, report_path)
+
+        with open(report_path) as f:
+            report = json.load(f)
+
+        self.assertFalse(report["succeeded"])
+        self.assertEqual(report["jobs"][3]["status"], "skipped")
+
+    def test_invalid_dependencies(self):
+        with self.assertRaises(ValueError):
+            run_jobs(self.fdb, [Job("a", query="select 1", depends_on=["missing"])])
+
+        with self.assertRaises(ValueError):
+            run_jobs(
+                self.fdb,
+                [
+                    Job("a", query="select 1", depends_on=["b"]),
+                    Job("b", query="select 1", depends_on=["a"]),
+                ],
+            )
+
+    def test_parse_job(self):
+        job = parse_job({"name": "a", "query": "select 1", "out_file": "a.parquet", "out_file_format": "parquet", "depends_on": "b"})
+
+        self.assertEqual(job.out_file_format, FileType.PARQUET)
+        self.assertListEqual(job.out_file, ["a.parquet"])
+        self.assertListEqual(job.depends_on, ["b"])
+
+        with self.assertRaises(ValueError):
+            parse_job({"name": "a", "query": "select 1", "out_file_format": "xlsx"})
+
+
+class TestShards(unittest.TestCase):
+    def setUp(self):
+        # two shards with the same file, so every group is in both
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.shard_dirs = []
+
+        for name in ("a", "b"):
+            shard_dir = os.path.join(self.tmp_dir.name, name)
+            os.mkdir(shard_dir)
+            shutil.copy("example/test.csv", shard_dir)
+            self.shard_dirs.append(shard_dir)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_merge_aggregates(self):
+        query = "select col2, count(*) as n, sum(col1) as s, max(col3) from test group by col2 order by n desc, col2"
+        fdb = query_shards(self.shard_dirs, query, max_workers=2, memory_limit="256MB")
+        res = fdb.exec_query(build_merge_query(fdb.db, query))
+        expected = FileDb("example/test.csv").exec_query(query)
+
+        self.assertListEqual(list(res.result_cols), list(expected.result_cols))
+        self.assertListEqual(
+            res.records,
+            [[col2, n * 2, s * 2, col3] for col2, n, s, col3 in expected.records],
+        )
+
+    def test_concatenate_with_order_and_limit(self):
+        query = "select * from test where col1 > $min order by col1 desc limit 3"
+        fdb = query_shards(self.shard_dirs, query, {"min": 1}, max_workers=2)
+        res = fdb.exec_query(build_merge_query(fdb.db, query))
+
+        self.assertListEqual([rec[0] for rec in res.records], [3, 3, 2])
+
+    def test_unmergeable_query(self):
+        queries = [
+            "select avg(col3) from test",
+            # the groups would be merged by the sum instead of col2
+            "select sum(col1) as s from test group by col2",
+            "select col2, sum(col1) from test group by rollup(col2)",
+        ]
+
+        for query in queries:
+            fdb = query_shards(self.shard_dirs, query, max_workers=2)
+
+            with self.subTest(query=query), self.assertRaises(ValueError):
+                build_merge_query(fdb.db, query)
+
+    def test_log_shard_queries(self):
+        log_path = os.path.join(self.tmp_dir.name, "query_log.ndjson")
+        query = "select count(*) from test"
+        query_shards(self.shard_dirs, query, max_workers=2, query_log=QueryLog(log_path))
+
+        with open(log_path) as f:
+            records = [json.loads(line) for line in f]
+
+        self.assertListEqual([record["query"] for record in records], [query, query])
+        self.assertListEqual(
+            sorted(record["sources"][0]["path"] for record in records),
+            [os.path.join(shard_dir, "test.csv") for shard_dir in self.shard_dirs],
+        )
+
+    def test_merge_group_keys_by_alias_and_position(self):
+        query = "select col2 as c, sum(col1) as s from test group by 1 order by c"
+        fdb = query_shards(self.shard_dirs, query, max_workers=2)
+        res = fdb.exec_query(build_merge_query(fdb.db, query))
+        expected = FileDb("example/test.csv").exec_query(query)
+
+        self.assertListEqual(res.records, [[c, s * 2] for c, s in expected.records])
+
+
+class TestAsyncFileDb(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_exec_query(self):
+        async with await AsyncFileDb.open("example/test.csv") as adb:
+            results = await asyncio.gather(
+                *[adb.exec_query("select count(*) from test") for _ in range(8)]
+            )
+
+        self.assertTrue(all(res.records[0][0] == 3 for res in results))
+
+    async def test_exec_query_timeout(self):
+        async with await AsyncFileDb.open("example/test.csv") as adb:
+            with self.assertRaises(asyncio.TimeoutError):
+                await adb.exec_query(
+                    "select count(*) from range(10000000000) a, range(1000) b where a.range * b.range = 7",
+                    timeout=0.1,
+                )
+
+            # the database is still usable after a query was interrupted
+            res = await adb.exec_query("select count(*) from test")
+
+        self.assertEqual(res.records[0][0], 3)
+
+    async def test_timeout_while_queued(self):
+        slow_query = "select count(*) from range(10000000000) a, range(1000) b where a.range * b.range = 7"
+
+        async with await AsyncFileDb.open("example/test.csv", max_workers=1) as adb:
+            running = asyncio.ensure_future(adb.exec_query(slow_query, timeout=2))
+            await asyncio.sleep(0.1)
+            start = time.perf_counter()
+
+            # waits behind the slow query for the only worker, and is dropped without running
+            with self.assertRaises(asyncio.TimeoutError):
+                await adb.exec_query("select count(*) from test", timeout=0.2)
+
+            self.assertLess(time.perf_counter() - start, 1)
+
+            with self.assertRaises(asyncio.TimeoutError):
+                await running
+
+    async def test_uses_cursor_pool(self):
+        async with await AsyncFileDb.open("example/test.csv", max_cursors=2) as adb:
+            await asyncio.gather(
+                *[adb.exec_query("select count(*) from test") for _ in range(8)]
+            )
+            stats = adb.fdb.cursor_pool_stats()
+
+        self.assertEqual(stats.checkouts, 8)
+        self.assertLessEqual(stats.size, 2)
+
+    async def test_iter_query(self):
+        async with await AsyncFileDb.open("example/test.csv") as adb:
+            batches = [
+                batch
+                async for batch in adb.iter_query("select * from range(25)", batch_size=10)
+            ]
+
+        self.assertListEqual([len(batch) for batch in batches], [10, 10, 5])
+
+    async def test_log_queries(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            log_path = os.path.join(tmp_dir, "query_log.ndjson")
+            out_file = os.path.join(tmp_dir, "result.csv")
+
+            async with await AsyncFileDb.open("example/test.csv", query_log=QueryLog(log_path)) as adb:
+                adb.fdb.exec_query("select * from test")
+                await adb.exec_query("select count(*) from test")
+                await adb.export_query("select * from test", out_file)
+
+            with open(log_path) as f:
+                records = [json.loads(line) for line in f]
+
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[1]["rows"], 1)
+
+
 class TestFileQueryCli(unittest.TestCase):
     #####################################################
     # tests for invalid arguments
@@ -214,6 +1152,38 @@ class TestFileQueryCli(unittest.TestCase):
 
         self.assertIsNotNone(err)
 
+    def test_resume_without_database(self):
+        args = FileQueryArgs(
+            filename=None,
+            filesdir="example/data",
+            query="select * from test",
+            query_file=None,
+            out_file=None,
+            out_file_format=None,
+            delimiter=None,
+            editor=False,
+            resume=True,
+        )
+
+        self.assertIsNotNone(validate_args(args))
+
+    def test_shard_dirs_with_filesdir(self):
+        args = FileQueryArgs(
+            filename=None,
+            filesdir="example/data",
+            query="select * from test",
+            query_file=None,
+            out_file=None,
+            out_file_format=None,
+            delimiter=None,
+            editor=False,
+            shard_dirs=["example/data"],
+        )
+
+        err = validate_args(args)
+
+        self.assertIsNotNone(err)
+
     def test_provide_filename_and_filesdir(self):
         args = FileQueryArgs(
             filename="example/test.csv",
@@ -246,6 +1216,70 @@ class TestFileQueryCli(unittest.TestCase):
 
         self.assertIsNotNone(err)
 
+    def test_stats_without_query(self):
+        args = FileQueryArgs(
+            filename="example/test.csv",
+            filesdir=None,
+            query=None,
+            query_file=None,
+            out_file=None,
+            out_file_format=None,
+            delimiter=None,
+            editor=False,
+            stats=True,
+        )
+
+        err = validate_args(args)
+
+        self.assertIsNone(err)
+
+    def test_invalid_sample_arg(self):
+        args = FileQueryArgs(
+            filename="example/test.csv",
+            filesdir=None,
+            query="select * from test",
+            query_file=None,
+            out_file=None,
+            out_file_format=None,
+            delimiter=None,
+            editor=False,
+            sample="150%",
+        )
+
+        err = validate_args(args)
+
+        self.assertIsNotNone(err)
+
+    def test_parse_param(self):
+        self.assertTupleEqual(parse_param("id=5"), ("id", 5))
+        self.assertTupleEqual(parse_param("name=test 1"), ("name", "test 1"))
+        self.assertTupleEqual(parse_param("day=2024-01-01"), ("day", "2024-01-01"))
+
+    def test_parse_table_columns(self):
+        self.assertTupleEqual(parse_table_columns("test=col1, col2"), ("test", ["col1", "col2"]))
+
+    def test_get_query_params(self):
+        params = {"a": 1, "b": 2}
+
+        self.assertDictEqual(get_query_params("select $a", params), {"a": 1})
+        self.assertIsNone(get_query_params("select 1", params))
+
+    def test_stdin_without_input_format(self):
+        args = FileQueryArgs(
+            filename="-",
+            filesdir=None,
+            query="select * from stdin",
+            query_file=None,
+            out_file=None,
+            out_file_format=None,
+            delimiter=None,
+            editor=False,
+        )
+
+        err = validate_args(args)
+
+        self.assertIsNotNone(err)
+
     def test_provide_query_and_query_file(self):
         args = FileQueryArgs(
             filename="example/test.csv",
@@ -332,6 +1366,38 @@ class TestFileQueryCli(unittest.TestCase):
 
         self.handle_args_single_out_file(args, out_file)
 
+    def test_single_output_file_ndjson(self):
+        out_file = "test_result.ndjson"
+
+        args = FileQueryArgs(
+            filename="example/test.csv",
+            filesdir=None,
+            query="select * from test",
+            query_file=None,
+            out_file=[out_file],
+            out_file_format="ndjson",
+            delimiter=None,
+            editor=False,
+        )
+
+        self.handle_args_single_out_file(args, out_file)
+
+    def test_invalid_out_file_format(self):
+        args = FileQueryArgs(
+            filename="example/test.csv",
+            filesdir=None,
+            query="select * from test",
+            query_file=None,
+            out_file=["test_result.xlsx"],
+            out_file_format="xlsx",
+            delimiter=None,
+            editor=False,
+        )
+
+        err = validate_args(args)
+
+        self.assertIsNotNone(err)
+
     def test_multiple_output_files_default(self):
         out_files = ["test_result1.csv", "test_result2.csv", "test_result3.csv"]
 
@@ -385,6 +1451,42 @@ class TestFileQueryCli(unittest.TestCase):
         self.handle_args_multiple_out_files(args)
 
 
+class TestStatements(unittest.TestCase):
+    def test_split_simple(self):
+        queries = split_queries("select 1; select 2;")
+
+        self.assertListEqual(queries, ["select 1", "select 2"])
+
+    def test_split_semicolon_in_string(self):
+        queries = split_queries("select ';' as a; select \"a;b\" from t")
+
+        self.assertListEqual(queries, ["select ';' as a", 'select "a;b" from t'])
+
+    def test_split_semicolon_in_comments(self):
+        queries = split_queries("select 1 -- a;b\n; /* ; */ select 2; -- done;")
+
+        self.assertListEqual(queries, ["select 1", "select 2"])
+
+    def test_split_dollar_quoted(self):
+        queries = split_queries("select $$a;b$$, $tag$;$tag$; select 2")
+
+        self.assertListEqual(queries, ["select $$a;b$$, $tag$;$tag$", "select 2"])
+
+    def test_statement_at_offset(self):
+        idx = StatementIndex("select 1;\nselect 2;")
+
+        self.assertEqual(idx.statement_at(8).code_start, 0)
+        self.assertEqual(idx.statement_at(10).code_start, 10)
+
+    def test_incremental_update_matches_full_lex(self):
+        idx = StatementIndex("select 1; select 2; select 3;")
+        idx.update("select 1; select ';'; select 3;")
+        idx.update("select 1; select ';; select 3;")
+
+        self.assertListEqual(idx.statements, StatementIndex(idx.text).statements)
+        self.assertEqual(len([s for s in idx.statements if not s.is_empty]), 2)
+
+
 if __name__ == "__main__":
     unittest.main()
 